@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+# 离线批量识别：对目录或 zip 压缩包中的全部图片做批量推理，结果逐条写入 JSONL / CSV，
+# 可选输出标注图；运行清单记录参数和进度，中断后再次执行同一命令即可从断点继续；
+# 结束时生成可直接导入 imgrecords 表的 CSV 和 LOAD DATA 语句
+#
+# 用法（在 flask 项目根目录执行）：
+#   python batch_predict.py ../测试图片 --weight rice_best.pt --conf 0.4 --annotate
+#   python batch_predict.py field_2025_06.zip --weight corn_best.pt --output ./runs/batch/corn_0601
+import argparse
+import csv
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from predict import predictImg
+from predict.inputFetcher import decode_image
+from predict.quantize import resolve_variant
+from predict.weightsManifest import file_sha256, weights_manifest
+from predict.workerPool import executor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+CSV_FIELDS = ['source', 'status', 'labels', 'confidences', 'count', 'inferMs', 'outImg', 'error']
+IMGRECORDS_FIELDS = ['input_img', 'out_img', 'confidence', 'all_time', 'conf', 'weight', 'username', 'start_time',
+                     'label', 'kind']
+
+
+class ImageSource:
+    """目录或 zip 压缩包中的图片列表，按相对路径排序，保证每次运行顺序一致"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.is_zip = zipfile.is_zipfile(self.path) if os.path.isfile(self.path) else False
+        self._local = threading.local()  # 每个解码线程独立打开压缩包
+        if self.is_zip:
+            with zipfile.ZipFile(self.path) as archive:
+                self.items = sorted(info.filename for info in archive.infolist()
+                                    if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS))
+        elif os.path.isdir(self.path):
+            self.items = sorted(os.path.relpath(os.path.join(root, f), self.path).replace(os.sep, '/')
+                                for root, _, files in os.walk(self.path)
+                                for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            raise ValueError(f"输入既不是目录也不是 zip 压缩包: {path}")
+
+    def read(self, item):
+        if self.is_zip:
+            archive = getattr(self._local, 'archive', None)
+            if archive is None:
+                archive = self._local.archive = zipfile.ZipFile(self.path)
+            return archive.read(item)
+        with open(os.path.join(self.path, item), 'rb') as f:
+            return f.read()
+
+
+def prefetch(source, items, workers=4, depth=32):
+    """多线程读取并解码图片，最多提前 depth 张；按原顺序产出 (图片名, BGR ndarray 或 None, 错误信息)"""
+
+    def load(item):
+        try:
+            return item, decode_image(source.read(item), item), None
+        except Exception as e:
+            return item, None, str(e)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode') as pool:
+        pending = deque()
+        items = iter(items)
+        for item in items:
+            pending.append(pool.submit(load, item))
+            if len(pending) >= depth:
+                break
+        while pending:
+            yield pending.popleft().result()
+            for item in items:
+                pending.append(pool.submit(load, item))
+                break
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BatchRun:
+    """一次批量识别的输出目录：manifest.json（参数与进度）、results.jsonl、results.csv、annotated/"""
+
+    def __init__(self, output_dir, config, restart=False):
+        self.output_dir = output_dir
+        self.config = config
+        self.manifest_path = os.path.join(output_dir, 'manifest.json')
+        self.jsonl_path = os.path.join(output_dir, 'results.jsonl')
+        self.csv_path = os.path.join(output_dir, 'results.csv')
+        self.annotated_dir = os.path.join(output_dir, 'annotated')
+        os.makedirs(output_dir, exist_ok=True)
+        self.done = {}  # 图片名 -> 已写入的结果
+        if not restart:
+            self._resume()
+        else:
+            for path in (self.jsonl_path, self.csv_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._jsonl = open(self.jsonl_path, 'a', encoding='utf-8')
+        self._rewrite_csv()
+        self._csv_file = open(self.csv_path, 'a', encoding='utf-8-sig', newline='')
+        self._csv = csv.DictWriter(self._csv_file, CSV_FIELDS)
+        self.save_manifest(finished=False)
+
+    def _resume(self):
+        """读取上次的清单和结果；参数不一致时拒绝续跑，避免混入不同模型/阈值的结果"""
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f).get('config', {})
+        for key in ('input', 'weight', 'sha256', 'conf', 'imgsz', 'variant'):
+            if previous.get(key) != self.config.get(key):
+                raise ValueError(f"输出目录中已有参数不同的运行（{key}: {previous.get(key)} != {self.config.get(key)}），"
+                                 f"请更换 --output 或加 --restart 重新开始")
+        if not os.path.exists(self.jsonl_path):
+            return
+        valid = []
+        with open(self.jsonl_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # 中断时写了一半的最后一行
+                self.done[record['source']] = record
+                valid.append(line if line.endswith('\n') else line + '\n')
+        with open(self.jsonl_path, 'w', encoding='utf-8') as f:
+            f.writelines(valid)
+
+    def _rewrite_csv(self):
+        """CSV 由 JSONL 重建后再追加，去掉中断时可能写了一半的行"""
+        with open(self.csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, CSV_FIELDS)
+            writer.writeheader()
+            for record in self.done.values():
+                writer.writerow(self._csv_row(record))
+
+    @staticmethod
+    def _csv_row(record):
+        return {
+            'source': record['source'],
+            'status': record['status'],
+            'labels': json.dumps(record.get('labels', []), ensure_ascii=False),
+            'confidences': json.dumps(record.get('confidences', [])),
+            'count': len(record.get('labels', [])),
+            'inferMs': record.get('inferMs'),
+            'outImg': record.get('outImg') or '',
+            'error': record.get('error') or ''
+        }
+
+    def write(self, record):
+        self.done[record['source']] = record
+        self._jsonl.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._csv.writerow(self._csv_row(record))
+
+    def flush(self):
+        self._jsonl.flush()
+        self._csv_file.flush()
+        self.save_manifest(finished=False)
+
+    def save_manifest(self, finished):
+        statuses = {}
+        for record in self.done.values():
+            statuses[record['status']] = statuses.get(record['status'], 0) + 1
+        data = {'config': self.config, 'processed': len(self.done), 'statuses': statuses, 'finished': finished,
+                'updatedAt': time.strftime('%Y-%m-%d %H:%M:%S')}
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def close(self, finished):
+        self._jsonl.close()
+        self._csv_file.close()
+        self.save_manifest(finished)
+
+    def export_imgrecords(self, params):
+        """
+        生成 imgrecords.csv（列与 imgrecords 表一致，不含自增 id）和对应的 LOAD DATA 语句；
+        标签、置信度、耗时的格式与接口保存的识别记录相同
+        """
+        csv_path = os.path.join(self.output_dir, 'imgrecords.csv')
+        rows = 0
+        with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(IMGRECORDS_FIELDS)
+            for record in self.done.values():
+                if record['status'] != 'ok':
+                    continue
+                row = predictImg.build_img_record(dict(params, inputImg=record['inputImg']), {
+                    'labels': record['labels'], 'confidences': record['confidences'],
+                    'allTime': record['inferMs'] / 1000
+                })
+                writer.writerow([row['inputImg'], record.get('outImg') or '', row['confidence'], row['allTime'],
+                                 row['conf'], row['weight'], row['username'], row['startTime'], row['label'],
+                                 row['kind']])
+                rows += 1
+        sql_path = os.path.join(self.output_dir, 'imgrecords_load.sql')
+        with open(sql_path, 'w', encoding='utf-8') as f:
+            f.write(f"-- 在 MySQL 客户端中执行（需开启 local_infile）：mysql --local-infile=1 cropdisease < {sql_path}\n")
+            f.write(f"LOAD DATA LOCAL INFILE '{os.path.abspath(csv_path).replace(os.sep, '/')}'\n"
+                    f"INTO TABLE `imgrecords` CHARACTER SET utf8mb4\n"
+                    f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPE BY ''\n"
+                    f"LINES TERMINATED BY '\\r\\n' IGNORE 1 LINES\n"
+                    f"({', '.join(IMGRECORDS_FIELDS)});\n")
+        return csv_path, rows
+
+
+def annotated_name(item):
+    """图片名 -> 标注图文件名（子目录展开为下划线，统一为 .jpg）"""
+    return re.sub(r'[\\/:]+', '_', os.path.splitext(item)[0]) + '.jpg'
+
+
+def run(args):
+    weights_path = os.path.join(args.weights_root, args.weight)
+    if not os.path.exists(weights_path):
+        raise FileNotFoundError(f"权重文件不存在: {weights_path}")
+    weights_manifest.load(args.weights_root)
+    model_path = resolve_variant(weights_path, args.variant)
+    kind = args.kind or args.weight.split('_')[0]
+    source = ImageSource(args.input)
+    name = os.path.splitext(os.path.basename(source.path.rstrip('/\\')))[0]
+    output_dir = args.output or os.path.join('./runs/batch', f"{name}_{os.path.splitext(args.weight)[0]}")
+    entry = weights_manifest.entry(weights_path)
+    config = {
+        'input': source.path, 'weight': args.weight, 'sha256': (entry or {}).get('sha256') or file_sha256(weights_path),
+        'conf': args.conf, 'imgsz': args.imgsz, 'variant': args.variant or 'fp32', 'kind': kind,
+        'total': len(source.items)
+    }
+    batch_run = BatchRun(output_dir, config, restart=args.restart)
+    todo = [item for item in source.items if item not in batch_run.done]
+    print(f"共 {len(source.items)} 张图片，已完成 {len(batch_run.done)} 张，本次处理 {len(todo)} 张 -> {output_dir}")
+
+    # ImagePredictor 负责标签、置信度整理和标注图编码；批量推理直接提交整批图片
+    predictor = predictImg.ImagePredictor(model_path, '', kind, save_path=None, conf=args.conf, imgsz=args.imgsz,
+                                          font_path=args.font)
+    if args.annotate:
+        os.makedirs(batch_run.annotated_dir, exist_ok=True)
+    infer_kwargs = dict(conf=args.conf, half=False, device='cpu', verbose=False)
+    if args.imgsz:
+        infer_kwargs['imgsz'] = args.imgsz
+    input_prefix = f"{source.path}!" if source.is_zip else source.path + '/'
+
+    start = time.time()
+    processed = 0
+    finished = False
+    try:
+        for batch in batched(prefetch(source, todo, args.decode_workers, args.prefetch), args.batch_size):
+            images = [(item, image) for item, image, _ in batch if image is not None]
+            batch_start = time.time()
+            boxes = executor().predict_boxes(model_path, [image for _, image in images], **infer_kwargs) \
+                if images else []
+            infer_ms = (time.time() - batch_start) * 1000 / max(1, len(images))
+            boxes = dict(zip((item for item, _ in images), boxes))
+            for item, image, error in batch:
+                record = {'source': item, 'inputImg': input_prefix + item}
+                if image is None:
+                    record.update(status='error', labels=[], confidences=[], inferMs=0.0, error=error)
+                    batch_run.write(record)
+                    continue
+                predictor.result_image = None
+                result = predictor.postprocess([predictor.build_result(image, boxes[item])], infer_ms / 1000,
+                                               save=args.annotate)
+                detected = isinstance(result['labels'], list)  # 未检出时 postprocess 返回 '预测失败'
+                record.update(status='ok' if detected else 'empty',
+                              labels=result['labels'] if detected else [],
+                              confidences=[round(c, 4) for c in result['confidences']] if detected else [],
+                              inferMs=round(infer_ms, 2))
+                if predictor.result_image is not None:
+                    out_path = os.path.join(batch_run.annotated_dir, annotated_name(item))
+                    with open(out_path, 'wb') as f:
+                        f.write(predictor.result_image)
+                    record['outImg'] = os.path.abspath(out_path)
+                batch_run.write(record)
+            processed += len(batch)
+            batch_run.flush()
+            if processed % args.log_every < len(batch) or processed == len(todo):
+                elapsed = time.time() - start
+                print(f"[{len(batch_run.done)}/{len(source.items)}] {processed / elapsed:.1f} 张/秒")
+        finished = True
+    except KeyboardInterrupt:
+        print("已中断，再次执行相同命令即可从断点继续")
+    finally:
+        batch_run.close(finished and len(batch_run.done) == len(source.items))
+
+    elapsed = time.time() - start
+    print(f"本次处理 {processed} 张，用时 {elapsed:.1f}s（{processed / elapsed if elapsed else 0:.1f} 张/秒）")
+    if finished:
+        csv_path, rows = batch_run.export_imgrecords({
+            'username': args.username, 'weight': args.weight, 'conf': args.conf, 'kind': kind,
+            'startTime': time.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        print(f"imgrecords 导入文件: {csv_path}（{rows} 条），导入语句见 imgrecords_load.sql")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线批量识别目录或 zip 压缩包中的图片')
+    parser.add_argument('input', help='图片目录或 zip 压缩包')
+    parser.add_argument('--weight', required=True, help='权重文件名，如 rice_best.pt')
+    parser.add_argument('--weights-root', default='./weights')
+    parser.add_argument('--kind', default=None, help='作物种类，默认取权重名前缀')
+    parser.add_argument('--conf', type=float, default=0.5)
+    parser.add_argument('--imgsz', type=int, default=None)
+    parser.add_argument('--variant', default=None, choices=['fp32', 'int8'])
+    parser.add_argument('--batch-size', type=int, default=8, help='每次前向推理的图片数')
+    parser.add_argument('--decode-workers', type=int, default=4, help='读取解码线程数')
+    parser.add_argument('--prefetch', type=int, default=32, help='最多提前解码的图片数')
+    parser.add_argument('--annotate', action='store_true', help='输出标注图到 <output>/annotated/')
+    parser.add_argument('--font', default=None, help='标注图中文标签字体（TrueType）')
+    parser.add_argument('--username', default='admin', help='写入 imgrecords 的用户名')
+    parser.add_argument('--output', default=None, help='输出目录，默认 ./runs/batch/<输入名>_<权重名>')
+    parser.add_argument('--restart', action='store_true', help='忽略已有进度，重新开始')
+    parser.add_argument('--log-every', type=int, default=200)
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+# @File : benchmark.py
+# 性能基准测试：对图片（/predict、/predictBatch）、视频（/predictVideo）和摄像头（/predictCamera）路径
+# 测量 p50/p95/p99 延迟、吞吐、视频帧率和峰值内存，结果保存为 JSON 便于不同版本之间对比
+#
+# 用法（在 flask 项目根目录执行）：
+#   python benchmark.py --weights-root ./weights --requests 50 --concurrency 4
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+
+import cv2
+import numpy as np
+
+from main import VideoProcessingApp
+from predict.modelRegistry import model_registry
+
+DEFAULT_IMAGE_DIRS = ['../测试图片', '.']
+
+
+RECORD_ROUTES = ('/imgRecords', '/videoRecords', '/cameraRecords')  # Spring Boot 中实际存在的记录接口
+
+
+class StubBackend:
+    """本地替身服务：代替 Spring Boot 的 files/upload 与 *Records 接口，并提供测试素材下载"""
+
+    def __init__(self, files_dir):
+        self.files_dir = files_dir
+        self.uploads = 0
+        self.records = {}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                name = unquote(urlparse(self.path).path).split('/files/', 1)[-1]
+                path = os.path.join(stub.files_dir, os.path.basename(name))
+                if not os.path.isfile(path):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                with open(path, 'rb') as f:
+                    body = f.read()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = self.rfile.read(length)
+                route = urlparse(self.path).path
+                base, batch = (route[:-len('/batch')], True) if route.endswith('/batch') else (route, False)
+                if route == '/files/upload':
+                    stub.uploads += 1
+                    body = json.dumps({'code': '0', 'data': f'{stub.url}/files/result.jpg'}).encode('utf-8')
+                elif base in RECORD_ROUTES:
+                    records = json.loads(payload or b'null')
+                    records = records if batch else [records]
+                    if not all(stub.valid_record(base, record) for record in records):
+                        self.send_response(400)  # 与 Jackson 反序列化失败时一致
+                        self.end_headers()
+                        return
+                    stub.records[base] = stub.records.get(base, 0) + len(records)
+                    body = json.dumps({'code': '0'}).encode('utf-8')
+                else:
+                    # 与 Spring Boot 一致：未定义的接口返回 404，避免掩盖调用了不存在接口的问题
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def valid_record(route, record):
+        """ImgRecords 的 conf / confidence / allTime 为 BigDecimal，非数值时 Spring Boot 拒绝该请求"""
+        if not isinstance(record, dict):
+            return False
+        if route != '/imgRecords':
+            return True
+        for field in ('conf', 'confidence', 'allTime'):
+            value = record.get(field)
+            if value is None:
+                continue
+            try:
+                float(value)
+            except (TypeError, ValueError):
+                return False
+        return True
+
+    def file_url(self, name):
+        return f'{self.url}/files/{quote(name)}'
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentiles(values):
+    """延迟分位数（毫秒）"""
+    if not values:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'mean': 0.0}
+    arr = np.asarray(values) * 1000
+    return {
+        'p50': round(float(np.percentile(arr, 50)), 2),
+        'p95': round(float(np.percentile(arr, 95)), 2),
+        'p99': round(float(np.percentile(arr, 99)), 2),
+        'mean': round(float(arr.mean()), 2)
+    }
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB）"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024, 1)
+    except ImportError:  # Windows 没有 resource 模块
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 1024 / 1024, 1)
+        except Exception:
+            return 0.0
+
+
+def collect_images(image_dirs):
+    images = []
+    for directory in image_dirs:
+        for pattern in ('*.jpg', '*.jpeg', '*.png'):
+            images.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted(set(images))
+
+
+def make_synthetic_video(images, path, frames=150, fps=25, size=(640, 480)):
+    """用测试图片合成一段带缓慢平移的视频，作为视频/摄像头输入"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    decoded = [cv2.resize(cv2.imdecode(np.fromfile(p, dtype=np.uint8), cv2.IMREAD_COLOR), size) for p in images[:10]]
+    for i in range(frames):
+        frame = decoded[(i // fps) % len(decoded)]
+        writer.write(np.roll(frame, shift=(i % fps) * 4, axis=1))
+    writer.release()
+    return path
+
+
+def run_load(fn, payloads, concurrency):
+    """并发执行请求，返回 (每次延迟列表, 总耗时, 失败次数)"""
+    latencies, failures = [], 0
+    lock = threading.Lock()
+
+    def call(payload):
+        nonlocal failures
+        start = time.time()
+        ok = fn(payload)
+        elapsed = time.time() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                failures += 1
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, payloads))
+    return latencies, time.time() - start, failures
+
+
+def bench_image(app, stub, weight, kind, image_names, args):
+    client_local = threading.local()
+
+    def client():
+        if not hasattr(client_local, 'client'):
+            client_local.client = app.app.test_client()
+        return client_local.client
+
+    def predict(name):
+        response = client().post('/predict', json={
+            'weight': weight, 'kind': kind, 'conf': args.conf, 'inputImg': stub.file_url(name),
+            'username': 'benchmark', 'startTime': ''
+        })
+        return json.loads(response.get_data(as_text=True)).get('status') in (200, 400)
+
+    def predict_batch(names):
+        response = client().post('/predictBatch', json={
+            'weight': weight, 'kind': kind, 'conf': args.conf, 'inputImg': [stub.file_url(n) for n in names]
+        })
+        return json.loads(response.get_data(as_text=True)).get('status') == 200
+
+    payloads = [image_names[i % len(image_names)] for i in range(args.requests)]
+    latencies, total, failures = run_load(predict, payloads, args.concurrency)
+    single = {'requests': len(payloads), 'failures': failures, 'rps': round(len(payloads) / total, 2),
+              'latency_ms': percentiles(latencies)}
+
+    batches = [payloads[i:i + args.batch_size] for i in range(0, len(payloads), args.batch_size)]
+    latencies, total, failures = run_load(predict_batch, batches, args.concurrency)
+    batch = {'requests': len(batches), 'batch_size': args.batch_size, 'failures': failures,
+             'images_per_sec': round(len(payloads) / total, 2), 'latency_ms': percentiles(latencies)}
+    return single, batch
+
+
+def count_mjpeg_frames(response, limit=None):
+    """读取 MJPEG 流并统计帧数，返回 (帧数, 耗时)"""
+    frames = 0
+    start = time.time()
+    for chunk in response.response:
+        frames += chunk.count(b'--frame\r\n')
+        if limit and frames >= limit:
+            break
+    elapsed = time.time() - start
+    response.close()
+    return frames, elapsed
+
+
+def bench_video(app, stub, weight, kind, video_name, args):
+    client = app.app.test_client()
+    query = (f'weight={quote(weight)}&kind={kind}&conf={args.conf}&username=benchmark&startTime='
+             f'&inputVideo={quote(stub.file_url(video_name), safe="")}')
+    response = client.get(f'/predictVideo?{query}')
+    frames, elapsed = count_mjpeg_frames(response)
+    return {'frames': frames, 'seconds': round(elapsed, 2), 'fps': round(frames / elapsed, 2) if elapsed else 0.0}
+
+
+def bench_camera(app, weight, kind, video_path, args):
+    app.camera_source = video_path  # 用合成视频代替摄像头
+    client = app.app.test_client()
+    session_id = f'bench{int(time.time())}'
+    query = f'weight={quote(weight)}&kind={kind}&conf={args.conf}&username=benchmark&startTime=&sessionId={session_id}'
+    response = client.get(f'/predictCamera?{query}')
+    frames, elapsed = count_mjpeg_frames(response, limit=args.camera_frames)
+    client.get(f'/stopCamera?sessionId={session_id}')
+    return {'frames': frames, 'seconds': round(elapsed, 2), 'fps': round(frames / elapsed, 2) if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='图片/视频/摄像头路径性能基准测试')
+    parser.add_argument('--weights-root', default='./weights')
+    parser.add_argument('--weights', nargs='*', help='只测试指定权重文件，默认测试目录下全部 .pt')
+    parser.add_argument('--images', nargs='*', default=DEFAULT_IMAGE_DIRS, help='测试图片目录')
+    parser.add_argument('--requests', type=int, default=40, help='每个权重的 /predict 请求数')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=8, help='/predictBatch 每次提交的图片数')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--video-frames', type=int, default=150, help='合成测试视频的帧数')
+    parser.add_argument('--camera-frames', type=int, default=100, help='摄像头路径读取的帧数')
+    parser.add_argument('--skip-video', action='store_true')
+    parser.add_argument('--skip-camera', action='store_true')
+    parser.add_argument('--output', default=None, help='结果 JSON 路径，默认 ./runs/benchmark/<时间>.json')
+    args = parser.parse_args()
+
+    images = collect_images(args.images)
+    if not images:
+        raise SystemExit(f'没有找到测试图片: {args.images}')
+
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+    image_names = []
+    for i, path in enumerate(images):
+        name = f'{i}{os.path.splitext(path)[1]}'  # 避免中文文件名在 URL 中的编码问题
+        shutil.copy(path, os.path.join(work_dir, name))
+        image_names.append(name)
+    video_path = make_synthetic_video(images, os.path.join(work_dir, 'video.mp4'), frames=args.video_frames)
+
+    stub = StubBackend(work_dir)
+    app = VideoProcessingApp()
+    app.weights_root = os.path.abspath(args.weights_root)
+    app.backend_url = stub.url
+    app.outbox.backend_url = stub.url
+
+    weights = args.weights or sorted(f for f in os.listdir(app.weights_root) if f.endswith('.pt'))
+    report = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': vars(args),
+        'cpu_count': os.cpu_count(),
+        'images': len(image_names),
+        'weights': {}
+    }
+    try:
+        for weight in weights:
+            kind = weight.split('_')[0]
+            print(f'===== {weight} =====')
+            load_start = time.time()
+            model_registry.get(os.path.join(app.weights_root, weight))
+            result = {
+                'load_seconds': round(time.time() - load_start, 2),
+                'backend': model_registry.backend_of(os.path.join(app.weights_root, weight))
+            }
+            result['predict'], result['predictBatch'] = bench_image(app, stub, weight, kind, image_names, args)
+            if not args.skip_video:
+                result['video'] = bench_video(app, stub, weight, kind, 'video.mp4', args)
+            if not args.skip_camera:
+                result['camera'] = bench_camera(app, weight, kind, video_path, args)
+            result['peak_rss_mb'] = peak_rss_mb()
+            report['weights'][weight] = result
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+    finally:
+        stub.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join('./runs/benchmark', time.strftime('%Y%m%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'基准测试结果已保存到 {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,163 @@
 # -*- coding: utf-8 -*-
+# 模型精度对比：在带标注的验证集上比较每个权重的 float32 模型与 INT8 量化模型
+# （mAP50、mAP50-95、各类别召回率、单张推理耗时、模型大小），判断哪些权重可以改用 INT8 模型
+#
+# 验证集目录结构（YOLO 格式）：
+#   <val>/images/*.jpg
+#   <val>/labels/*.txt
+# 可以按作物分子目录（<val>/rice/images、<val>/rice/labels ...），按权重名前缀自动匹配
+#
+# 用法（在 flask 项目根目录执行）：
+#   python -m predict.quantize --weights-root ./weights --calib ../测试图片   # 先生成 INT8 模型
+#   python check_model_precision.py --weights-root ./weights --val ./dataset/val
+import argparse
+import json
+import os
+import tempfile
+import time
+
 import torch
+import yaml
 from ultralytics import YOLO
 
-# 替换为你的模型路径（和main.py中一致）
-MODEL_PATH = "./weights/corn_best.pt"  # 可改为 rice_best.pt/tomato_best.pt
+from predict.backends import BACKENDS, export_artifact
+from predict.quantize import int8_path
+
 
-def check_model_device_and_precision():
-    """验证模型的设备和精度"""
-    print("===== 模型精度/设备验证 =====")
-    
-    # 1. 加载模型并强制CPU + float32
-    model = YOLO(MODEL_PATH)
+def check_model_device_and_precision(model_path):
+    """验证 float32 模型的设备和精度（CPU 不支持半精度推理）"""
+    model = YOLO(model_path)
     model.to(device='cpu', dtype=torch.float32)
-    
-    # 2. 检查模型设备
-    print(f"✅ 模型当前设备: {model.device}")
-    
-    # 3. 检查模型参数精度
-    first_param = next(model.parameters())
-    dtype = first_param.dtype
-    print(f"✅ 模型参数精度: {dtype}")
-    
-    # 4. 验证是否为CPU兼容格式
-    if model.device.type == 'cpu' and dtype == torch.float32:
-        print("\n🎉 验证通过！模型已使用 CPU + float32（单精度），兼容CPU运行")
+    dtype = next(model.parameters()).dtype
+    ok = model.device.type == 'cpu' and dtype == torch.float32
+    print(f"{'✅' if ok else '❌'} {os.path.basename(model_path)} 设备: {model.device}，参数精度: {dtype}")
+    return ok
+
+
+def model_size_mb(path):
+    if os.path.isdir(path):
+        size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
     else:
-        print("\n❌ 验证失败！模型配置不兼容CPU：")
-        if model.device.type != 'cpu':
-            print("   - 模型未运行在CPU上（当前：{}）".format(model.device.type))
-        if dtype != torch.float32:
-            print("   - 模型精度不是float32（当前：{}），CPU不支持该精度".format(dtype))
-    
-    # 5. 测试预测（模拟实际调用）
-    print("\n===== 测试CPU预测 =====")
-    try:
-        # 用空图片路径测试（仅验证模型推理逻辑）
-        results = model(
-            source="./test.png",  # 随便填一个路径，仅测试推理初始化
-            conf=0.5,
-            half=False,  # 强制关闭半精度
-            device='cpu'
-        )
-        print("✅ 预测初始化成功，CPU推理逻辑正常")
-    except Exception as e:
-        if "slow_conv2d_cpu not implemented for 'Half'" in str(e):
-            print("❌ 错误：模型仍在使用半精度！请检查predictImg.py中half=True是否改为False")
-        else:
-            print(f"❌ 预测测试失败：{str(e)[:100]}")
+        size = os.path.getsize(path)
+    return round(size / 1024 / 1024, 2)
+
+
+def write_data_yaml(val_dir, names, work_dir):
+    """为验证集生成 ultralytics 需要的 data.yaml（train/val 都指向验证集图片）"""
+    path = os.path.join(work_dir, 'data.yaml')
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump({'path': os.path.abspath(val_dir), 'train': 'images', 'val': 'images',
+                        'names': dict(names)}, f, allow_unicode=True)
+    return path
+
+
+def evaluate(model_path, data_yaml, imgsz, batch):
+    """在验证集上评估，返回 mAP、各类别召回率、单张推理耗时和模型大小"""
+    model = YOLO(model_path, task='detect')
+    start = time.time()
+    metrics = model.val(data=data_yaml, imgsz=imgsz, batch=batch, device='cpu', half=False, plots=False,
+                        verbose=False)
+    names = metrics.names
+    per_class = {}
+    for i, cls in enumerate(metrics.box.ap_class_index):
+        precision, recall, ap50, ap = metrics.box.class_result(i)
+        per_class[names[int(cls)]] = {'recall': round(float(recall), 4), 'ap50': round(float(ap50), 4)}
+    return {
+        'model': os.path.basename(model_path),
+        'mAP50': round(float(metrics.box.map50), 4),
+        'mAP50-95': round(float(metrics.box.map), 4),
+        'perClass': per_class,
+        'latencyMs': round(float(metrics.speed['inference']), 2),  # 单张图片前向推理耗时
+        'sizeMB': model_size_mb(model_path),
+        'evalSeconds': round(time.time() - start, 1)
+    }
+
+
+def compare(weights_path, val_dir, imgsz, max_map_drop, max_recall_drop):
+    """比较一个权重的 float32（ONNX，与 INT8 同一推理引擎，耗时可直接对比）与 INT8 模型"""
+    names = YOLO(weights_path).names
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_yaml = write_data_yaml(val_dir, names, work_dir)
+        float_model = export_artifact(weights_path, BACKENDS['onnx'], imgsz)
+        report = {'weight': os.path.basename(weights_path), 'fp32': evaluate(float_model, data_yaml, imgsz, 1)}
+        quantized = int8_path(weights_path)
+        if not os.path.exists(quantized):
+            print(f"⚠️  未找到 INT8 模型: {quantized}")
+            report['int8'] = None
+            report['recommend'] = 'fp32'
+            return report
+        report['int8'] = evaluate(quantized, data_yaml, imgsz, 1)
+
+    fp32, int8 = report['fp32'], report['int8']
+    recall_drops = {name: round(fp32['perClass'][name]['recall'] - stats['recall'], 4)
+                    for name, stats in int8['perClass'].items() if name in fp32['perClass']}
+    report['delta'] = {
+        'mAP50': round(int8['mAP50'] - fp32['mAP50'], 4),
+        'mAP50-95': round(int8['mAP50-95'] - fp32['mAP50-95'], 4),
+        'maxRecallDrop': max(recall_drops.values(), default=0.0),
+        'recallDrop': recall_drops,
+        'speedup': round(fp32['latencyMs'] / int8['latencyMs'], 2) if int8['latencyMs'] else None,
+        'sizeRatio': round(int8['sizeMB'] / fp32['sizeMB'], 3) if fp32['sizeMB'] else None
+    }
+    acceptable = (fp32['mAP50'] - int8['mAP50'] <= max_map_drop and
+                  report['delta']['maxRecallDrop'] <= max_recall_drop)
+    report['recommend'] = 'int8' if acceptable else 'fp32'
+    return report
+
+
+def print_report(report):
+    print(f"\n===== {report['weight']} =====")
+    rows = [('fp32', report['fp32'])] + ([('int8', report['int8'])] if report['int8'] else [])
+    print(f"{'变体':<6}{'mAP50':>8}{'mAP50-95':>10}{'耗时(ms)':>10}{'大小(MB)':>10}")
+    for name, stats in rows:
+        print(f"{name:<6}{stats['mAP50']:>8.4f}{stats['mAP50-95']:>10.4f}{stats['latencyMs']:>10.2f}"
+              f"{stats['sizeMB']:>10.2f}")
+    if report['int8']:
+        delta = report['delta']
+        print(f"mAP50 变化 {delta['mAP50']:+.4f}，推理加速 {delta['speedup']}x，"
+              f"体积为原来的 {delta['sizeRatio']}，最大类别召回率下降 {delta['maxRecallDrop']:.4f}")
+        for name, drop in delta['recallDrop'].items():
+            print(f"   {name}: 召回率 {report['fp32']['perClass'][name]['recall']:.4f} -> "
+                  f"{report['int8']['perClass'][name]['recall']:.4f} ({-drop:+.4f})")
+    print(f"建议使用: {report['recommend']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='float32 与 INT8 模型精度/速度对比')
+    parser.add_argument('--weights-root', default='./weights')
+    parser.add_argument('--weights', nargs='*', help='只对比指定权重文件，默认目录下全部 .pt')
+    parser.add_argument('--val', required=True, help='带标注的验证集目录（可按作物分子目录）')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--max-map-drop', type=float, default=0.01, help='可接受的 mAP50 最大下降')
+    parser.add_argument('--max-recall-drop', type=float, default=0.03, help='可接受的单类别召回率最大下降')
+    parser.add_argument('--output', default=None, help='报告 JSON 路径，默认 ./runs/precision/<时间>.json')
+    args = parser.parse_args()
+
+    weights = args.weights or sorted(f for f in os.listdir(args.weights_root) if f.endswith('.pt'))
+    reports = []
+    for name in weights:
+        weights_path = os.path.join(args.weights_root, name)
+        if not check_model_device_and_precision(weights_path):
+            continue
+        val_dir = os.path.join(args.val, name.split('_')[0])
+        val_dir = val_dir if os.path.isdir(val_dir) else args.val
+        try:
+            report = compare(weights_path, val_dir, args.imgsz, args.max_map_drop, args.max_recall_drop)
+        except Exception as e:
+            print(f"❌ 对比 {name} 失败: {e}")
+            continue
+        print_report(report)
+        reports.append(report)
+
+    variants = {r['weight']: r['recommend'] for r in reports if r['recommend'] == 'int8'}
+    print(f"\n可在 main.py 中配置 self.weight_variants = {variants}")
+    output = args.output or os.path.join('./runs/precision', time.strftime('%Y%m%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'config': vars(args), 'reports': reports, 'weightVariants': variants}, f,
+                  ensure_ascii=False, indent=2)
+    print(f"对比报告已保存到 {output}")
+
 
 if __name__ == "__main__":
-    check_model_device_and_precision()
\ No newline at end of file
+    main()
@@ -3,16 +3,37 @@
 # @Author : 林枫
 # @File : main.py
 
+import base64
 import json
 import os
-import subprocess
+import threading
+import time
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import requests
-import torch  # 新增：导入torch控制精度
 from flask import Flask, Response, request
-from ultralytics import YOLO
 from predict import predictImg
-from flask_socketio import SocketIO, emit
+from predict.modelRegistry import model_registry
+from predict.batchEngine import batch_engine
+from predict.resultCache import detection_cache
+from predict.requestContext import RequestContext, SessionManager, SessionExistsError
+from predict.videoPipeline import VideoPipeline
+from predict.videoEncoder import create_video_writer
+from predict.metrics import metrics, RequestTimer
+from predict.outbox import Outbox
+from predict.inputFetcher import input_fetcher
+from predict.cameraStream import camera_hub
+from predict.tiling import parse_tiling, tiling_stats
+from predict.tracker import parse_tracking
+from predict.motionGate import parse_motion_gate
+from predict.quantize import VARIANTS, resolve_variant
+from predict.workerPool import executor as get_executor, start_worker_pool
+from predict.videoJobs import VideoJobQueue, QueueFullError, JobExistsError
+from predict.weightsManifest import weights_manifest
+from predict.latencyBudget import latency_planner, parse_budget
+from predict.cropRouter import crop_router, is_auto, sample_frames
+from flask_socketio import SocketIO, emit, join_room
 
 
 # Flask 应用设置
@@ -24,16 +45,44 @@ class VideoProcessingApp:
         self.host = host
         self.port = port
         self.setup_routes()
-        self.data = {}  # 存储接收参数
-        self.paths = {
-            'download': './runs/video/download.mp4',
-            'output': './runs/video/output.mp4',
-            'camera_output': "./runs/video/camera_output.avi",
-            'video_output': "./runs/video/camera_output.avi"
-        }
-        self.recording = False  # 标志位，判断是否正在录制视频
+        # 每个请求使用独立的 RequestContext 保存参数，并在 runs/jobs/<id>/ 下拥有独立工作目录
+        self.runs_root = './runs'
+        self.sessions = SessionManager()  # 正在运行的视频/摄像头会话，可按 ID 停止
+        # 图片推理与录像收尾工作的线程池，限制并发占用的 CPU
+        self.worker_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix='predict')
+        self.camera_source = 0  # 摄像头设备号，也可以配置为视频文件路径或 'synthetic'，便于无摄像头环境测试
+        # 摄像头运动门控：画面静止时复用上一次的检测结果，至少每秒推理一次；请求参数 gate 可覆盖（如 'hash:8'、'false'）
+        self.camera_motion_gate = {'method': 'diff', 'threshold': 0.02, 'refresh_seconds': 1.0}
+        self.backend_url = "http://localhost:9999"  # Spring Boot 后端地址（文件上传、记录保存）
+        # 上传与记录保存交给后台发件箱（连接池 + 重试 + 本地 spool 持久化），接口在推理完成后立即返回
+        self.outbox = Outbox(backend_url=self.backend_url, spool_dir=os.path.join(self.runs_root, 'outbox'))
+        # 按权重默认开启切片推理（手机拍摄的高分辨率叶片图），请求参数 tile 可覆盖，如 {'rice_best.pt': '640:0.2'}
+        self.tiling_weights = {}
+        # 按权重默认开启视频关键帧跟踪（只检测关键帧，中间帧由光流跟踪），请求参数 track 可覆盖，如 {'rice_best.pt': '5'}
+        self.tracking_weights = {}
+        # 按权重默认使用的模型变体（fp32 / int8），根据 check_model_precision.py 的精度对比结果配置，
+        # 如 {'corn_best.pt': 'int8'}；请求参数 variant 可覆盖
+        self.weight_variants = {}
+        # 图片结果默认同步上传（识别记录由 Spring Boot /flask/predict 插入）；请求参数 asyncUpload=true 或
+        # 设为 True 时推理完成即返回，outImg 为内联 data URL，识别记录由发件箱在上传成功后保存
+        # （响应带 recordQueued，Spring Boot 不再重复插入）
+        self.async_image_upload = False
+        # 推理进程数：0 时在本进程内推理；多核推理节点上可设为 CPU 核心数 // threads_per_worker，
+        # 例如 32 核设为 16 个进程 × 2 线程，吞吐随核心数近似线性增长
+        self.inference_workers = 0
+        self.threads_per_worker = 2
+        # 后台视频任务：/videoJobs 提交后立即返回任务 ID，最多同时处理 max_concurrent 个视频，其余排队；
+        # 状态和进度只推送到任务对应的 Socket.IO 房间（提交者及之后订阅该任务的客户端）
+        self.video_jobs = VideoJobQueue(self.run_video_job, max_concurrent=2, on_update=self.emit_job_update)
+        metrics.gauge('yolo_outbox_pending', '发件箱中尚未发送成功的任务数').set_function(self.outbox.pending)
+        metrics.gauge('yolo_active_sessions', '正在运行的视频/摄像头会话数', ('kind',)).set_function(
+            lambda: {kind: self.sessions.active(kind) for kind in ('video', 'camera')})
+        metrics.gauge('yolo_video_jobs', '各状态的后台视频任务数', ('status',)).set_function(self.video_jobs.counts)
         # 新增：模型根目录（统一管理）
         self.weights_root = r"D:\cyd\Desktop\yolo_web\yolo_cropDisease_detection_flask\weights"
+        weights_manifest.load(self.weights_root)  # 只读取已有的清单文件，扫描和模型加载在启动后进行
+        # 作物自动路由：请求不指定 weight（或 weight=auto）时按内容判断作物，分类模型放在 weights/router/crop_cls.pt
+        crop_router.weights_root = self.weights_root
         # 新增：系统字体路径（统一管理，避免重复定义）
         self.system_font_path = "C:/Windows/Fonts/msyh.ttc"  # 微软雅黑
 
@@ -44,9 +93,25 @@ class VideoProcessingApp:
         self.app.add_url_rule('/predict', 'predict', self.predictImg, methods=['POST'])
         # 保留原有 /predictImg 接口（兼容）
         self.app.add_url_rule('/predictImg', 'predictImg', self.predictImg, methods=['POST'])
+        # 批量图片预测接口：一次提交多张图片，走微批推理引擎
+        self.app.add_url_rule('/predictBatch', 'predictBatch', self.predictBatch, methods=['POST'])
         self.app.add_url_rule('/predictVideo', 'predictVideo', self.predictVideo)
+        # 后台视频任务：提交/列表、状态、取消、结果、预览流
+        self.app.add_url_rule('/videoJobs', 'submitVideoJob', self.submitVideoJob, methods=['POST'])
+        self.app.add_url_rule('/videoJobs', 'listVideoJobs', self.listVideoJobs, methods=['GET'])
+        self.app.add_url_rule('/videoJobs/<job_id>', 'videoJobStatus', self.videoJobStatus, methods=['GET'])
+        self.app.add_url_rule('/videoJobs/<job_id>/cancel', 'cancelVideoJob', self.cancelVideoJob,
+                              methods=['GET', 'POST'])
+        self.app.add_url_rule('/videoJobs/<job_id>/result', 'videoJobResult', self.videoJobResult, methods=['GET'])
+        self.app.add_url_rule('/videoJobs/<job_id>/preview', 'videoJobPreview', self.videoJobPreview,
+                              methods=['GET'])
         self.app.add_url_rule('/predictCamera', 'predictCamera', self.predictCamera)
         self.app.add_url_rule('/stopCamera', 'stopCamera', self.stopCamera, methods=['GET'])
+        # Prometheus 指标接口
+        self.app.add_url_rule('/metrics', 'metrics', self.export_metrics, methods=['GET'])
+        # 各切片设置的平均耗时与多检出数量
+        self.app.add_url_rule('/tilingStats', 'tilingStats', self.tiling_stats, methods=['GET'])
+        self.app.add_url_rule('/latencyProfiles', 'latencyProfiles', self.latency_profiles, methods=['GET'])
 
         # 添加 WebSocket 事件
         @self.socketio.on('connect')
@@ -58,20 +123,30 @@ class VideoProcessingApp:
         def handle_disconnect():
             print("WebSocket disconnected!")
 
+        @self.socketio.on('joinJob')
+        def handle_join_job(data):
+            """刷新页面或重连后重新订阅视频任务的进度，并立即收到当前状态"""
+            job = self.video_jobs.get((data or {}).get('jobId'))
+            if job is None:
+                emit('message', {'data': '任务不存在或已过期'})
+                return
+            join_room(job.room)
+            emit('jobStatus', {'data': self.video_jobs.status(job)})
+
     def run(self):
         """启动 Flask 应用"""
         self.socketio.run(self.app, host=self.host, port=self.port, allow_unsafe_werkzeug=True)
 
     def file_names(self):
-        """模型列表接口 - 强制返回模型列表"""
-        print("=== 我是新的 file_names 方法，正在执行！===")  # 新增这行
+        """模型列表接口：从权重清单读取（不加载模型），附带作物种类、类别数和输入尺寸"""
         try:
-            weight_items = [
-                {'value': 'corn_best.pt', 'label': 'corn_best.pt'},
-                {'value': 'rice_best.pt', 'label': 'rice_best.pt'},
-                {'value': 'strawberry_best.pt', 'label': 'strawberry_best.pt'},
-                {'value': 'tomato_best.pt', 'label': 'tomato_best.pt'}
-            ]
+            weight_items = [{
+                'value': entry['name'],
+                'label': entry['name'],
+                'kind': entry.get('kind'),
+                'classes': entry.get('labels', []),
+                'imgsz': entry.get('imgsz')
+            } for entry in weights_manifest.weights()]
             return json.dumps({'weight_items': weight_items}, ensure_ascii=False)
         except Exception as e:
             print(f"获取模型列表失败: {e}")
@@ -79,6 +154,7 @@ class VideoProcessingApp:
 
     def predictImg(self):
         """图片预测接口 - 核心修复：定义model_path + 兼容参数 + CPU精度强制"""
+        timer = RequestTimer('predict')  # 分阶段计时：下载、解码、推理、编码、上传等
         try:
             # 修复：兼容表单提交和 JSON 提交
             if request.is_json:
@@ -89,9 +165,11 @@ class VideoProcessingApp:
             print("接收的预测参数:", data)
             
             # 参数校验（非必填参数不强制校验，避免前端传参不全报错）
-            required_params = ['weight', 'inputImg']  # 仅保留核心必填参数
+            # 仅保留核心必填参数；weight 不传（或为 auto）时按图片内容自动选择作物模型
+            required_params = ['inputImg']
             for param in required_params:
                 if param not in data or not data[param]:
+                    timer.finish(400)
                     return json.dumps({
                         "status": 400,
                         "message": f"缺少必要参数: {param}",
@@ -100,23 +178,52 @@ class VideoProcessingApp:
                         "allTime": 0.0,      # 返回数值而非字符串
                         "outImg": ""
                     }, ensure_ascii=False)
+            error = (self.invalid_variant(data.get('variant'), label="", confidence=0.0, allTime=0.0, outImg="")
+                     or self.invalid_input(data['inputImg'], label="", confidence=0.0, allTime=0.0, outImg=""))
+            if error:
+                timer.finish(400)
+                return error
+            # 延迟预算模式：latencyBudget（毫秒）或 tier（fast / balanced / accurate），按本机延迟画像选择
+            # 推理尺寸、模型变体和是否切片；显式传入 variant 时只在该变体内选择，tile=false 时不切片
+            budget, error = self.request_budget(data.get('latencyBudget'), data.get('tier'),
+                                                label="", confidence=0.0, allTime=0.0, outImg="")
+            if error:
+                timer.finish(400)
+                return error
+            if budget is not None:
+                budget.update(variant=data.get('variant') or None,
+                              allow_tiling=str(data.get('tile', '')).lower() != 'false')
             
-            # 补充默认值，避免参数为空
-            self.data.clear()
-            self.data.update({
+            # 补充默认值，避免参数为空；参数保存在请求级上下文中，并发请求互不影响
+            ctx = RequestContext('image', {
                 "username": data.get('username', ''), 
-                "weight": data['weight'],
+                "weight": data.get('weight', ''),
                 "conf": float(data.get('conf', 0.5)),  # 转为浮点数，设置默认值0.5
                 "startTime": data.get('startTime', ''),
                 "inputImg": data['inputImg'],
                 "kind": data.get('kind', '')
-            })
+            }, self.runs_root)
+            timer.request_id = ctx.id
+            # 作物自动路由：下载的图片字节直接交给预测器，不再重复下载
+            routing = image_bytes = None
+            if is_auto(ctx.data["weight"]):
+                with timer.stage('route'):
+                    image_bytes = input_fetcher.fetch(ctx.data["inputImg"])
+                    routing = crop_router.route_image(image_bytes)
+                ctx.data.update(weight=routing['weight'], kind=routing['kind'])
+            # 结果图返回方式：不传时只返回上传后的地址；base64 时内联返回；bytes 时直接返回 JPEG 字节
+            return_img = str(data.get('returnImg', '')).lower()
+            need_upload = str(data.get('upload', 'true')).lower() != 'false'
+            async_upload = str(data.get('asyncUpload', self.async_image_upload)).lower() == 'true'
+            tiling = parse_tiling(data.get('tile'), parse_tiling(self.tiling_weights.get(ctx.data["weight"])))
             
             # 核心修复1：定义model_path（拼接绝对路径）
-            model_path = os.path.join(self.weights_root, self.data["weight"])
+            model_path = os.path.join(self.weights_root, ctx.data["weight"])
             print(f"模型路径: {model_path}")
             # 检查模型文件是否存在
             if not os.path.exists(model_path):
+                ctx.cleanup()
+                timer.finish(404)
                 return json.dumps({
                     "status": 404,
                     "message": f"模型文件不存在: {model_path}",
@@ -125,72 +232,45 @@ class VideoProcessingApp:
                     "allTime": 0.0,
                     "outImg": ""
                 }, ensure_ascii=False)
-            
-            # 核心修复2：创建预测器（移除不兼容的device/precision参数，predictImg.py已内置CPU配置）
-            predict = predictImg.ImagePredictor(
-                weights_path=model_path,
-                img_path=self.data["inputImg"], 
-                save_path='./runs/result.jpg', 
-                kind=self.data["kind"],
-                conf=float(self.data["conf"])
-            )
-            
-            # 核心修复3：强制模型使用CPU + float32（兜底，确保精度正确）
-            predict.model.to(device='cpu', dtype=torch.float32)
-            
-            # 执行预测
-            results = predict.predict()
-            
-            # 处理预测结果 - 关键修复：统一返回数值类型
-            if results.get('labels') != '预测失败' and results.get('labels'):
-                # 上传结果图片
-                uploadedUrl = self.upload('./runs/result.jpg') or ""
-                
-                # 处理 confidence：数组取平均值/第一个值，转为浮点数
-                confidences = results.get('confidences', [])
-                confidence_val = 0.0
-                if isinstance(confidences, list) and len(confidences) > 0:
-                    # 取第一个置信度值，或计算平均值
-                    confidence_val = float(confidences[0]) if confidences[0] else 0.0
-                
-                # 处理 allTime：转为浮点数
-                all_time_val = float(results.get('allTime', 0.0)) if results.get('allTime') else 0.0
-                
-                # 处理 label：数组转字符串，方便后端存储
-                labels = results.get('labels', [])
-                label_str = ",".join(labels) if isinstance(labels, list) else str(labels)
-                
-                response_data = {
-                    "status": 200,
-                    "message": "预测成功",
-                    "outImg": uploadedUrl,
-                    "allTime": all_time_val,          # 数值类型
-                    "confidence": confidence_val,    # 数值类型（非数组）
-                    "label": label_str,              # 字符串类型（非数组）
-                    # 保留原数组字段，兼容后续扩展
-                    "confidences": results.get('confidences', []),
-                    "labels": results.get('labels', [])
-                }
-            else:
-                response_data = {
-                    "status": 400,
-                    "message": "该图片无法识别，请重新上传！",
-                    "label": "",
-                    "confidence": 0.0,  # 数值类型
-                    "allTime": 0.0,      # 数值类型
-                    "outImg": ""
-                }
-            
-            # 清理临时文件
-            path = self.data["inputImg"].split('/')[-1]
-            if os.path.exists('./' + path):
-                os.remove('./' + path)
-            
+
+            # 模型变体：variant=int8 时使用量化模型（需先运行 python -m predict.quantize 生成）；
+            # 延迟预算模式下变体由预测器按画像选择，这里保留 .pt 路径
+            if budget is None:
+                model_path = self.resolve_model_path(ctx.data["weight"], data.get('variant'))
+
+            # 在线程池中执行推理，结果图只在内存中编码，不再写入磁盘
+            try:
+                response_data, image_bytes = self.worker_pool.submit(
+                    self._run_image_prediction, ctx, model_path, need_upload and not async_upload,
+                    timer, time.perf_counter(), tiling, budget, image_bytes).result()
+            finally:
+                ctx.cleanup()
+            timer.finish(response_data["status"], weight=ctx.data["weight"],
+                         cacheHit=response_data.get("cacheHit", False))
+            if routing is not None:
+                response_data["routing"] = self.routing_report(routing)
+
+            if image_bytes and need_upload and async_upload:
+                # 异步上传：先用内联 data URL 返回结果图，上传成功后由发件箱保存识别记录
+                response_data["outImg"] = "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode('ascii')
+                self.outbox.upload_then_record(image_bytes, 'result.jpg', f'{self.backend_url}/imgRecords',
+                                               self.build_img_record(ctx, response_data), field='outImg')
+                response_data["recordQueued"] = True
+
+            if image_bytes and return_img == 'base64':
+                response_data["outImgBase64"] = base64.b64encode(image_bytes).decode('ascii')
+            elif image_bytes and return_img == 'bytes':
+                # 原始字节模式：响应体为 JPEG，预测结果放在响应头中
+                response = Response(image_bytes, mimetype='image/jpeg')
+                response.headers['X-Predict-Result'] = quote(json.dumps(response_data, ensure_ascii=False))
+                return response
+
             # 确保返回格式前端能解析
             return json.dumps(response_data, ensure_ascii=False)
             
         except Exception as e:
             print(f"图片预测失败: {e}")
+            timer.finish(500)
             # 返回统一的错误格式 - 数值类型默认值
             return json.dumps({
                 "status": 500,
@@ -201,170 +281,570 @@ class VideoProcessingApp:
                 "outImg": ""
             }, ensure_ascii=False)
 
+    def _run_image_prediction(self, ctx, model_path, need_upload=True, timer=None, submitted_at=None, tiling=None,
+                              budget=None, image_bytes=None):
+        """执行单张图片预测并上传结果图，返回 (响应字典, 结果图 JPEG 字节)"""
+        timer = timer or RequestTimer('predict', ctx.id)
+        if submitted_at is not None:
+            timer.record('worker_queue', time.perf_counter() - submitted_at)
+        # 核心修复2：创建预测器（模型来自全局注册表，已强制CPU + float32 并预热）
+        # save_path=None：结果图直接编码到内存，上传时不再读写磁盘
+        predict = predictImg.ImagePredictor(
+            weights_path=model_path,
+            img_path=ctx.data["inputImg"],
+            save_path=None,
+            kind=ctx.data["kind"],
+            conf=float(ctx.data["conf"]),
+            engine=batch_engine,  # 与并发请求合并为一次批量推理
+            cache=detection_cache,  # 同一图片重复提交（仅 conf 不同）时直接复用缓存的检测框
+            timer=timer,
+            tiling=tiling,  # 高分辨率图片切片后批量推理，避免小病斑在缩放中丢失
+            font_path=self.system_font_path,  # 中文标签使用系统字体
+            budget=budget,  # 延迟预算：按本机延迟画像选择推理尺寸、模型变体和切片设置
+            image_bytes=image_bytes  # 自动路由时已下载的图片字节
+        )
+
+        # 执行预测
+        results = predict.predict()
+
+        # 处理预测结果 - 关键修复：统一返回数值类型
+        if results.get('labels') != '预测失败' and results.get('labels'):
+            # 上传结果图片（直接发送内存中的 JPEG 字节）
+            uploadedUrl = ""
+            if need_upload and predict.result_image:
+                with timer.stage('upload'):
+                    uploadedUrl = self.upload_bytes(predict.result_image, 'result.jpg') or ""
+
+            # 处理 confidence：数组取平均值/第一个值，转为浮点数
+            confidences = results.get('confidences', [])
+            confidence_val = 0.0
+            if isinstance(confidences, list) and len(confidences) > 0:
+                # 取第一个置信度值，或计算平均值
+                confidence_val = float(confidences[0]) if confidences[0] else 0.0
+
+            # 处理 allTime：转为浮点数
+            all_time_val = float(results.get('allTime', 0.0)) if results.get('allTime') else 0.0
+
+            # 处理 label：数组转字符串，方便后端存储
+            labels = results.get('labels', [])
+            label_str = ",".join(labels) if isinstance(labels, list) else str(labels)
+
+            return {
+                "status": 200,
+                "message": "预测成功",
+                "outImg": uploadedUrl,
+                "allTime": all_time_val,          # 数值类型
+                "confidence": confidence_val,    # 数值类型（非数组）
+                "label": label_str,              # 字符串类型（非数组）
+                # 保留原数组字段，兼容后续扩展
+                "confidences": results.get('confidences', []),
+                "labels": results.get('labels', []),
+                "cacheHit": predict.cache_hit,
+                "tiling": predict.tiling_report,
+                "latency": self.latency_report(predict.latency_choice)
+            }, predict.result_image
+        return {
+            "status": 400,
+            "message": "该图片无法识别，请重新上传！",
+            "label": "",
+            "confidence": 0.0,  # 数值类型
+            "allTime": 0.0,      # 数值类型
+            "outImg": ""
+        }, None
+
+    def predictBatch(self):
+        """批量图片预测接口：inputImg 为图片地址列表，返回每张图片的标签、置信度和耗时"""
+        timer = RequestTimer('predictBatch')
+        try:
+            data = request.get_json(silent=True) or request.form.to_dict(flat=False)
+            weight = data.get('weight')
+            weight = weight[0] if isinstance(weight, list) else weight
+            kind = data.get('kind', '')
+            kind = kind[0] if isinstance(kind, list) else kind
+            conf = data.get('conf', 0.5)
+            conf = float(conf[0] if isinstance(conf, list) else conf)
+            variant = data.get('variant')
+            variant = variant[0] if isinstance(variant, list) else variant
+            error = self.invalid_variant(variant, results=[])
+            if error:
+                timer.finish(400)
+                return error
+            input_imgs = data.get('inputImg') or data.get('inputImgs') or []
+            if isinstance(input_imgs, str):
+                input_imgs = [input_imgs]
+            if not weight or not input_imgs:
+                return json.dumps({"status": 400, "message": "缺少必要参数: weight 或 inputImg", "results": []},
+                                  ensure_ascii=False)
+
+            model_path = os.path.join(self.weights_root, weight)
+            if not os.path.exists(model_path):
+                return json.dumps({"status": 404, "message": f"模型文件不存在: {model_path}", "results": []},
+                                  ensure_ascii=False)
+
+            model_path = self.resolve_model_path(weight, variant)
+            predictor = predictImg.ImagePredictor(weights_path=model_path, img_path='', kind=kind, conf=conf)
+            start_time = time.time()
+
+            # 并行下载解码后一次性提交，让引擎把它们合并成尽量少的批次
+            with timer.stage('download_decode'), ThreadPoolExecutor(max_workers=min(8, len(input_imgs))) as pool:
+                loaded = list(pool.map(self._load_image_safe, input_imgs))
+            futures = [batch_engine.submit(model_path, conf, image) if image is not None else None
+                       for image in loaded]
+
+            items = []
+            for url, future in zip(input_imgs, futures):
+                if future is None:
+                    items.append({"inputImg": url, "status": 400, "message": "图片下载或解码失败",
+                                  "labels": [], "confidences": [], "allTime": 0.0})
+                    continue
+                try:
+                    result, timing = future.result()
+                    res = predictor.postprocess([result], timing['queueTime'] + timing['inferTime'], save=False)
+                    ok = res.get('labels') != '预测失败' and res.get('labels')
+                    items.append({
+                        "inputImg": url,
+                        "status": 200 if ok else 400,
+                        "message": "预测成功" if ok else "该图片无法识别",
+                        "labels": res['labels'] if ok else [],
+                        "confidences": res['confidences'] if ok else [],
+                        "allTime": float(res['allTime']),
+                        "queueTime": timing['queueTime'],
+                        "inferTime": timing['inferTime'],
+                        "batchSize": timing['batchSize']
+                    })
+                except Exception as e:
+                    items.append({"inputImg": url, "status": 500, "message": f"预测出错: {str(e)}",
+                                  "labels": [], "confidences": [], "allTime": 0.0})
+
+            timer.finish(200, weight=weight, images=len(input_imgs))
+            return json.dumps({
+                "status": 200,
+                "message": "预测完成",
+                "totalTime": time.time() - start_time,
+                "results": items
+            }, ensure_ascii=False)
+        except Exception as e:
+            print(f"批量预测失败: {e}")
+            timer.finish(500)
+            return json.dumps({"status": 500, "message": f"预测出错: {str(e)}", "results": []}, ensure_ascii=False)
+
+    def _load_image_safe(self, url):
+        """下载并解码图片，失败时返回 None"""
+        try:
+            return predictImg.load_image(url)
+        except Exception as e:
+            print(f"读取图片失败 {url}: {e}")
+            return None
+
     def predictVideo(self):
         """视频流处理接口 - 新增：指定系统字体，避免字体下载"""
-        self.data.clear()
-        self.data.update({
-            "username": request.args.get('username'), "weight": request.args.get('weight'),
-            "conf": request.args.get('conf'), "startTime": request.args.get('startTime'),
-            "inputVideo": request.args.get('inputVideo'),
-            "kind": request.args.get('kind')
-        })
-        self.download(self.data["inputVideo"], self.paths['download'])
-        cap = cv2.VideoCapture(self.paths['download'])
-        if not cap.isOpened():
+        error = self.invalid_variant(request.args.get('variant')) or self.invalid_input(request.args.get('inputVideo'))
+        if error:
+            return error
+        try:
+            ctx = self.sessions.register(self.video_context(request.args))
+        except SessionExistsError as e:
+            return json.dumps({"status": 409, "message": str(e)}, ensure_ascii=False)
+        video_output = ctx.path('output.mp4')
+        cap = self.open_video(ctx)
+        if cap is None:
+            self.sessions.unregister(ctx)
+            ctx.cleanup()
             raise ValueError("无法打开视频文件")
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        print(fps)
-
-        # 视频写入器
-        video_writer = cv2.VideoWriter(
-            self.paths['video_output'],
-            cv2.VideoWriter_fourcc(*'XVID'),
-            fps,
-            (640, 480)
-        )
-        
-        # 使用硬编码的绝对路径加载模型
-        model_path = os.path.join(self.weights_root, self.data["weight"])
-        model = YOLO(model_path)
-        # 新增：视频预测也强制CPU + float32
-        model.to(device='cpu', dtype=torch.float32)
+        room = request.args.get('sid')
+        video_writer = None
+        try:
+            routing, prefetched = self.route_video(ctx, cap)
+            fps = int(cap.get(cv2.CAP_PROP_FPS))
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            print(fps)
+
+            # 视频写入器：标注帧直接送入 ffmpeg 编码为 MP4，进度按已写入帧数计算；
+            # 前端传入 Socket.IO 的 sid 时进度只发给该客户端，否则与旧版一样广播
+            video_writer = create_video_writer(
+                video_output, fps, (640, 480), total_frames=total_frames,
+                on_progress=lambda progress: self.socketio.emit('progress', {'data': progress}, to=room)
+            )
+
+            # 从全局注册表获取模型（已强制CPU + float32、融合并预热；variant=int8 时为量化模型）
+            model_path = self.resolve_model_path(ctx.data["weight"], request.args.get('variant'))
+            get_executor().names(model_path)
+
+            # 解码、批量推理、标注编码、按序输出分别在独立线程中运行，阶段之间用有界队列形成背压
+            pipeline = VideoPipeline(
+                cap, model_path, ctx.data['conf'],
+                frame_size=(640, 480),
+                video_writer=video_writer,
+                font_path=self.system_font_path,  # 中文标签使用系统字体，标签图块按权重缓存
+                tracking=self.video_tracking(ctx.data["weight"], request.args.get('track')),
+                prefetched=prefetched
+            )
+        except Exception:
+            # 流水线启动前失败（路由、模型加载等）：释放已占用的视频读写器、会话和工作目录
+            self.cleanup_resources(cap, video_writer)
+            self.sessions.unregister(ctx)
+            ctx.cleanup()
+            raise
 
         def generate():
             try:
-                while cap.isOpened():
-                    ret, frame = cap.read()
-                    if not ret:
+                for jpeg in pipeline.frames():
+                    if ctx.stopped:
                         break
-                    frame = cv2.resize(frame, (640, 480))
-                    # 核心修改：添加font参数，使用系统自带字体
-                    results = model.predict(
-                        source=frame, 
-                        conf=float(self.data['conf']), 
-                        show=False, 
-                        half=False,
-                        font=self.system_font_path  # 指定系统字体，避免下载
-                    )
-                    processed_frame = results[0].plot(font=self.system_font_path)  # 绘制时也指定字体
-                    video_writer.write(processed_frame)
-                    _, jpeg = cv2.imencode('.jpg', processed_frame)
-                    yield b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n'
+                    yield b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
             finally:
+                # 先停止流水线（等待写入线程退出），再释放视频读写器
+                pipeline.stop()
+                print(f"视频流水线各阶段吞吐: {pipeline.report()}")
                 self.cleanup_resources(cap, video_writer)
-                self.socketio.emit('message', {'data': '处理完成，正在保存！'})
-                for progress in self.convert_avi_to_mp4(self.paths['video_output']):
-                    self.socketio.emit('progress', {'data': progress})
-                uploadedUrl = self.upload(self.paths['output'])
-                self.data["outVideo"] = uploadedUrl
-                self.save_data(json.dumps(self.data), 'http://localhost:9999/videoRecords')
-                self.cleanup_files([self.paths['download'], self.paths['output'], self.paths['video_output']])
+                self.sessions.unregister(ctx)
+                if pipeline.error is not None:
+                    # 解码/推理/编码线程异常退出：录像不完整，不上传也不保存记录
+                    print(f"视频处理失败: {pipeline.error}")
+                    ctx.cleanup()
+                    self.socketio.emit('message', {'data': f'视频处理失败: {pipeline.error}'}, to=room)
+                else:
+                    self.finish_recording(ctx, video_output, f'{self.backend_url}/videoRecords', room=room)
+
+        response = Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+        response.headers['X-Session-Id'] = ctx.id
+        if routing is not None:
+            response.headers['X-Crop-Routing'] = quote(json.dumps(self.routing_report(routing), ensure_ascii=False))
+        return response
+
+    def video_context(self, params):
+        """由请求参数创建视频会话上下文（predictVideo 与后台视频任务共用）"""
+        return RequestContext('video', {
+            "username": params.get('username'), "weight": params.get('weight'),
+            "conf": params.get('conf'), "startTime": params.get('startTime'),
+            "inputVideo": params.get('inputVideo'),
+            "kind": params.get('kind')
+        }, self.runs_root, session_id=params.get('sessionId'))
+
+    def video_tracking(self, weight, value=None):
+        """视频关键帧跟踪设置：请求参数 track 优先，其次按权重的默认设置，均未设置时逐帧检测"""
+        try:
+            return parse_tracking(value, parse_tracking(self.tracking_weights.get(weight)))
+        except ValueError:
+            print(f"无效的跟踪参数: {value}，改为逐帧检测")
+            return None
+
+    def route_video(self, ctx, cap):
+        """
+        未指定权重时按视频中均匀抽取的几帧判断作物，更新会话的 weight / kind
+        :return: (路由结果或 None, 抽样时从不能定位的视频流中读出的帧，需交给流水线先处理)
+        """
+        if not is_auto(ctx.data["weight"]):
+            return None, []
+        frames, prefetched = sample_frames(cap)
+        routing = crop_router.route_frames(frames, source='video')
+        ctx.data.update(weight=routing['weight'], kind=routing['kind'])
+        return routing, prefetched
+
+    @staticmethod
+    def routing_report(routing):
+        """响应中返回的路由结果"""
+        return {key: routing.get(key) for key in ('kind', 'weight', 'method', 'confidence', 'cached', 'routeMs')}
+
+    def open_video(self, ctx):
+        """打开输入视频：远程视频由 FFmpeg 边下载边解码，无法流式读取时才完整下载；失败返回 None"""
+        try:
+            cap = input_fetcher.open_video(ctx.data["inputVideo"], fallback_path=ctx.path('download.mp4'))
+        except Exception as e:
+            print(f"打开视频失败: {e}")
+            return None
+        return cap if cap is not None and cap.isOpened() else None
+
+    def submitVideoJob(self):
+        """提交后台视频任务，立即返回任务 ID；参数同 predictVideo，另可传 sid（Socket.IO 客户端 ID）接收进度"""
+        params = request.get_json(silent=True) or request.form.to_dict() or request.args.to_dict()
+        for param in ('inputVideo',):  # weight 不传（或为 auto）时在任务开始后按视频内容自动选择
+            if not params.get(param):
+                return json.dumps({"status": 400, "code": 400, "message": f"缺少必要参数: {param}"},
+                                  ensure_ascii=False)
+        error = (self.invalid_variant(params.get('variant'), code=400)
+                 or self.invalid_input(params['inputVideo'], code=400))
+        if error:
+            return error
+        ctx = self.video_context(params)
+        if self.sessions.get(ctx.id) is not None:
+            return json.dumps({"status": 409, "code": 409, "message": f"会话 ID 已存在: {ctx.id}"},
+                              ensure_ascii=False)
+        try:
+            # 跟踪设置在任务开始、完成作物自动路由后再按实际权重确定
+            job = self.video_jobs.submit(ctx, variant=params.get('variant'), track=params.get('track'))
+        except JobExistsError as e:
+            return json.dumps({"status": 409, "code": 409, "message": str(e)}, ensure_ascii=False)
+        except QueueFullError as e:
+            return json.dumps({"status": 429, "code": 429, "message": str(e)}, ensure_ascii=False)
+        if params.get('sid'):
+            # 提交成功后提交者才加入任务房间（重复 ID 的请求不能借此订阅别人的任务），之后的状态和进度只推送给该房间
+            join_room(ctx.id, sid=params['sid'], namespace='/')
+        return json.dumps({"status": 200, "code": 0, "message": "任务已提交", "data": self.video_jobs.status(job),
+                           "previewUrl": f"/videoJobs/{job.id}/preview"}, ensure_ascii=False)
+
+    def listVideoJobs(self):
+        """所有保留中的视频任务状态"""
+        return json.dumps({"status": 200, "code": 0, "data": self.video_jobs.list()}, ensure_ascii=False)
+
+    def videoJobStatus(self, job_id):
+        job = self.video_jobs.get(job_id)
+        if job is None:
+            return json.dumps({"status": 404, "code": 404, "message": "任务不存在或已过期"}, ensure_ascii=False)
+        return json.dumps({"status": 200, "code": 0, "data": self.video_jobs.status(job)}, ensure_ascii=False)
+
+    def cancelVideoJob(self, job_id):
+        """取消排队中或正在处理的任务，已处理的部分不会上传"""
+        job = self.video_jobs.cancel(job_id)
+        if job is None:
+            return json.dumps({"status": 404, "code": 404, "message": "任务不存在或已过期"}, ensure_ascii=False)
+        return json.dumps({"status": 200, "code": 0, "data": self.video_jobs.status(job)}, ensure_ascii=False)
+
+    def videoJobResult(self, job_id):
+        """任务结果：结果视频地址（上传完成后才有）和流水线各阶段吞吐"""
+        job = self.video_jobs.get(job_id)
+        if job is None:
+            return json.dumps({"status": 404, "code": 404, "message": "任务不存在或已过期"}, ensure_ascii=False)
+        if not job.finished:
+            return json.dumps({"status": 409, "code": 409, "message": "任务尚未结束",
+                               "data": self.video_jobs.status(job)}, ensure_ascii=False)
+        return json.dumps({"status": 200, "code": 0, "data": dict(self.video_jobs.status(job), **job.result,
+                                                                   uploaded='outVideo' in job.result)},
+                          ensure_ascii=False)
+
+    def videoJobPreview(self, job_id):
+        """附加到任务上的 MJPEG 预览流：只发送最新的标注帧，断开预览不影响任务"""
+        job = self.video_jobs.get(job_id)
+        if job is None or job.finished:
+            return json.dumps({"status": 404, "code": 404, "message": "任务不存在或已结束"}, ensure_ascii=False)
+
+        def generate():
+            for jpeg in job.preview():
+                yield b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
 
         return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+    def run_video_job(self, job):
+        """在后台任务线程中处理一个视频：与 predictVideo 相同的流水线，输出帧只保留最新一帧供预览"""
+        ctx = job.ctx
+        self.sessions.register(ctx)  # 会话 ID 已被占用时抛出 SessionExistsError，任务失败；取消见 /videoJobs/<id>/cancel
+        video_output = ctx.path('output.mp4')
+        cap = video_writer = pipeline = None
+        try:
+            cap = self.open_video(ctx)
+            if cap is None:
+                raise ValueError("无法打开视频文件")
+            routing, prefetched = self.route_video(ctx, cap)
+            if routing is not None:
+                job.result['routing'] = self.routing_report(routing)
+            job.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            video_writer = create_video_writer(
+                video_output, int(cap.get(cv2.CAP_PROP_FPS)), (640, 480), total_frames=job.total_frames,
+                on_progress=lambda progress: self.video_jobs.set_progress(job, progress)
+            )
+            model_path = self.resolve_model_path(ctx.data["weight"], job.options.get('variant'))
+            get_executor().names(model_path)
+            pipeline = VideoPipeline(cap, model_path, ctx.data['conf'], frame_size=(640, 480),
+                                     video_writer=video_writer, font_path=self.system_font_path,
+                                     tracking=self.video_tracking(ctx.data["weight"], job.options.get('track')),
+                                     prefetched=prefetched)
+            for jpeg in pipeline.frames():
+                if ctx.stopped:
+                    break
+                job.publish_frame(jpeg)
+            if pipeline.error is not None:
+                raise pipeline.error
+            job.result['stages'] = pipeline.report()
+        except Exception:
+            ctx.cleanup()
+            raise
+        finally:
+            if pipeline is not None:
+                pipeline.stop()
+            self.cleanup_resources(cap, video_writer)
+            self.sessions.unregister(ctx)
+        if ctx.stopped:
+            ctx.cleanup()  # 已取消：丢弃处理了一半的视频
+            return
+        self.finish_recording(ctx, video_output, f'{self.backend_url}/videoRecords', room=job.room,
+                              on_uploaded=lambda url: job.result.update(outVideo=url))
+
+    def emit_job_update(self, job, event):
+        """视频任务的状态与进度只推送到任务房间"""
+        if event == 'progress':
+            self.socketio.emit('progress', {'data': job.progress, 'jobId': job.id}, to=job.room)
+        else:
+            self.socketio.emit('jobStatus', {'data': self.video_jobs.status(job)}, to=job.room)
+
     def predictCamera(self):
         """摄像头视频流处理接口 - 新增：指定系统字体，避免字体下载"""
-        self.data.clear()
-        self.data.update({
-            "username": request.args.get('username'), "weight": request.args.get('weight'),
-            "kind": request.args.get('kind'),
-            "conf": request.args.get('conf'), "startTime": request.args.get('startTime')
-        })
-        self.socketio.emit('message', {'data': '正在加载，请稍等！'})
-        
-        # 使用硬编码的绝对路径加载模型
-        model_path = os.path.join(self.weights_root, self.data["weight"])
-        model = YOLO(model_path)
-        # 新增：摄像头预测也强制CPU + float32
-        model.to(device='cpu', dtype=torch.float32)
+        error = self.invalid_variant(request.args.get('variant'))
+        if error:
+            return error
+        budget, error = self.request_budget(request.args.get('latencyBudget'), request.args.get('tier'))
+        if error:
+            return error
+        try:
+            motion_gate = parse_motion_gate(request.args.get('gate'), self.camera_motion_gate)
+        except ValueError as e:
+            return json.dumps({"status": 400, "message": str(e)}, ensure_ascii=False)
+        # 前端传入 sessionId，以便之后通过 /stopCamera?sessionId=... 停止自己的会话；ID 已被占用时拒绝
+        try:
+            ctx = self.sessions.register(RequestContext('camera', {
+                "username": request.args.get('username'), "weight": request.args.get('weight'),
+                "kind": request.args.get('kind'),
+                "conf": request.args.get('conf'), "startTime": request.args.get('startTime')
+            }, self.runs_root, session_id=request.args.get('sessionId')))
+        except SessionExistsError as e:
+            return json.dumps({"status": 409, "message": str(e)}, ensure_ascii=False)
+        # 会话 ID 只发给发起请求的 Socket.IO 客户端（sid），不再广播给所有连接
+        sid = request.args.get('sid')
+        self.socketio.emit('message', {'data': '正在加载，请稍等！'}, to=sid)
+        if sid:
+            self.socketio.emit('session', {'data': ctx.id}, to=sid)
         
-        cap = cv2.VideoCapture(0)
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        video_writer = cv2.VideoWriter(self.paths['camera_output'], cv2.VideoWriter_fourcc(*'XVID'), 20, (640, 480))
-        self.recording = True
+        # 同一摄像头只打开一次：采集线程只保留最新帧，同一权重和阈值的观看者共用一个推理循环
+        camera_output = ctx.path('output.mp4')
+        imgsz, latency_choice, routing = 640, None, None
+        try:
+            if is_auto(ctx.data["weight"]):
+                # 作物自动路由：按当前画面判断作物（采集线程保持打开，随后的订阅直接复用）
+                frame = camera_hub.peek(self.camera_source)
+                if frame is None:
+                    raise ValueError("无法读取摄像头画面")
+                routing = crop_router.route_frames([frame], source='camera')
+                ctx.data.update(weight=routing['weight'], kind=routing['kind'])
+            model_path = self.resolve_model_path(ctx.data["weight"], request.args.get('variant'))
+            # 延迟预算模式：latencyBudget 为每帧推理预算（毫秒），按画像选择推理尺寸和模型变体（摄像头帧不切片）
+            if budget is not None:
+                latency_choice = latency_planner.choose(os.path.join(self.weights_root, ctx.data["weight"]), (480, 640),
+                                                        budget['budget_ms'], budget['tier'],
+                                                        request.args.get('variant'), allow_tiling=False)
+                model_path, imgsz = latency_choice['modelPath'], latency_choice['imgsz'] or imgsz
+            viewer = camera_hub.subscribe(self.camera_source, model_path, ctx.data['conf'],
+                                          font_path=self.system_font_path,  # 中文标签使用系统字体
+                                          imgsz=imgsz, motion_gate=motion_gate)
+        except Exception as e:
+            print(f"打开摄像头失败: {e}")
+            self.sessions.unregister(ctx)
+            ctx.cleanup()
+            return json.dumps({"status": 500, "message": f"打开摄像头失败: {str(e)}"}, ensure_ascii=False)
+        video_writer = create_video_writer(camera_output, 20, (640, 480))
 
         def generate():
             try:
-                while self.recording:
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                    # 核心修改：添加font参数，使用系统自带字体
-                    results = model.predict(
-                        source=frame, 
-                        imgsz=640, 
-                        conf=float(self.data['conf']), 
-                        show=False, 
-                        half=False,
-                        font=self.system_font_path  # 指定系统字体，避免下载
-                    )
-                    processed_frame = results[0].plot(font=self.system_font_path)  # 绘制时也指定字体
-                    if self.recording and video_writer:
-                        video_writer.write(processed_frame)
-                    _, jpeg = cv2.imencode('.jpg', processed_frame)
-                    yield b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n'
+                # 每个观看者按自己的网络状况调整 JPEG 质量和分辨率，录像仍使用原尺寸标注帧
+                for frame, jpeg in viewer.frames(lambda: ctx.stopped):
+                    if video_writer:
+                        video_writer.write(frame)
+                    yield b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
             finally:
-                self.cleanup_resources(cap, video_writer)
-                self.socketio.emit('message', {'data': '处理完成，正在保存！'})
-                for progress in self.convert_avi_to_mp4(self.paths['camera_output']):
-                    self.socketio.emit('progress', {'data': progress})
-                uploadedUrl = self.upload(self.paths['output'])
-                self.data["outVideo"] = uploadedUrl
-                print(self.data)
-                self.save_data(json.dumps(self.data), 'http://localhost:9999/cameraRecords')
-                self.cleanup_files([self.paths['download'], self.paths['output'], self.paths['camera_output']])
+                viewer.close()
+                print(f"摄像头推流统计: {viewer.report()}")
+                self.cleanup_resources(None, video_writer)
+                self.sessions.unregister(ctx)
+                self.finish_recording(ctx, camera_output, f'{self.backend_url}/cameraRecords')
 
-        return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+        response = Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+        response.headers['X-Session-Id'] = ctx.id
+        if routing is not None:
+            response.headers['X-Crop-Routing'] = quote(json.dumps(self.routing_report(routing), ensure_ascii=False))
+        if latency_choice is not None:
+            response.headers['X-Latency-Choice'] = quote(json.dumps(self.latency_report(latency_choice),
+                                                                    ensure_ascii=False))
+        return response
 
     def stopCamera(self):
-        """停止摄像头预测"""
-        self.recording = False
-        return json.dumps({"status": 200, "message": "预测成功", "code": 0})
+        """
+        停止摄像头预测：只停止 sessionId 指定的摄像头会话（视频任务通过 /videoJobs/<id>/cancel 取消）；
+        旧版客户端不传 sessionId 时，停止调用者（按 username，未传时不区分用户）唯一的摄像头会话，有多个时要求指定
+        """
+        session_id = request.args.get('sessionId')
+        if not session_id:
+            candidates = self.sessions.find('camera', request.args.get('username') or None)
+            if len(candidates) > 1:
+                return json.dumps({"status": 400, "message": "有多个摄像头会话，请指定 sessionId", "code": 400},
+                                  ensure_ascii=False)
+            session_id = candidates[0].id if candidates else None
+        stopped = self.sessions.stop(session_id, kind='camera') if session_id else []
+        return json.dumps({"status": 200, "message": "预测成功", "code": 0, "stopped": stopped})
 
-    def save_data(self, data, path):
-        """将结果数据上传到服务器"""
-        headers = {'Content-Type': 'application/json'}
+    def finish_recording(self, ctx, output_path, record_url, room=None, on_uploaded=None):
+        """
+        录像收尾：MP4 已在处理过程中编码完成，直接上传并保存记录，最后删除该会话的工作目录
+        :param room: 提示消息只发给该 Socket.IO 房间，为空时广播
+        :param on_uploaded: 上传成功后的回调，参数为视频地址
+        """
+        timer = RequestTimer(ctx.kind, ctx.id)
         try:
-            response = requests.post(path, data=data, headers=headers)
-            print("记录上传成功！" if response.status_code == 200 else f"记录上传失败，状态码: {response.status_code}")
-        except requests.RequestException as e:
-            print(f"上传记录时发生错误: {str(e)}")
-
-    def convert_avi_to_mp4(self, temp_output):
-        """使用 FFmpeg 将 AVI 格式转换为 MP4 格式，并显示转换进度。"""
-        ffmpeg_command = f"ffmpeg -i {temp_output} -vcodec libx264 {self.paths['output']} -y"
-        process = subprocess.Popen(ffmpeg_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                   text=True)
-        total_duration = self.get_video_duration(temp_output)
-
-        for line in process.stderr:
-            if "time=" in line:
-                try:
-                    time_str = line.split("time=")[1].split(" ")[0]
-                    h, m, s = map(float, time_str.split(":"))
-                    processed_time = h * 3600 + m * 60 + s
-                    if total_duration > 0:
-                        progress = (processed_time / total_duration) * 100
-                        yield progress
-                except Exception as e:
-                    print(f"解析进度时发生错误: {e}")
+            self.socketio.emit('message', {'data': '处理完成，正在保存！'}, to=room)
+            with timer.stage('enqueue_upload'):
+                # 视频文件移入发件箱 spool 目录，后台上传成功后再保存记录，不阻塞视频流结束
+                if os.path.exists(output_path):
+                    self.outbox.upload_then_record(output_path, 'output.mp4', record_url, ctx.data, field='outVideo',
+                                                   on_uploaded=on_uploaded)
+            self.socketio.emit('progress', {'data': 100}, to=room)
+            print(ctx.data)
+        finally:
+            ctx.cleanup()
+            timer.finish(200, weight=ctx.data.get("weight"))
+
+    @staticmethod
+    def latency_report(choice):
+        """延迟预算模式下实际使用的设置、预计耗时与实际耗时（毫秒），未使用预算时为 None"""
+        if choice is None:
+            return None
+        return {key: choice.get(key) for key in ('tier', 'budgetMs', 'imgsz', 'variant', 'tiling', 'estimatedMs',
+                                                 'actualMs', 'reason')}
 
-        process.wait()
-        yield 100
+    def latency_profiles(self):
+        """本机各权重在不同推理尺寸、模型变体下的单张推理耗时（毫秒）"""
+        return json.dumps({"status": 200, "data": latency_planner.report()}, ensure_ascii=False)
 
-    def get_video_duration(self, path):
-        """获取视频总时长（秒）"""
+    @staticmethod
+    def invalid_variant(variant, **fields):
+        """校验请求参数 variant（不传或 fp32 / int8），无效时返回 400 响应，否则返回 None；需在占用会话等资源前调用"""
+        if variant in (None, '') or variant in VARIANTS:
+            return None
+        return json.dumps(dict({"status": 400, "message": f"未知的模型变体: {variant}，可选 {VARIANTS}"}, **fields),
+                          ensure_ascii=False)
+
+    @staticmethod
+    def invalid_input(source, **fields):
+        """校验输入地址：接口只接受 http(s) 地址（本地路径须在允许目录下），无效时返回 400 响应，否则返回 None"""
+        if input_fetcher.is_allowed(source or ''):
+            return None
+        return json.dumps(dict({"status": 400, "message": f"只接受 http(s) 地址: {source}"}, **fields),
+                          ensure_ascii=False)
+
+    @staticmethod
+    def request_budget(budget, tier, **fields):
+        """解析延迟预算参数，返回 (预算或 None, 参数无效时的 400 响应或 None)；需在占用会话等资源前调用"""
         try:
-            cap = cv2.VideoCapture(path)
-            if not cap.isOpened():
-                return 0
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            cap.release()
-            return total_frames / fps if fps > 0 else 0
-        except Exception:
-            return 0
+            return parse_budget(budget, tier), None
+        except ValueError as e:
+            return None, json.dumps(dict({"status": 400, "message": str(e)}, **fields), ensure_ascii=False)
+
+    def resolve_model_path(self, weight, variant=None):
+        """权重文件名 + 变体 -> 实际加载的模型路径；INT8 模型不存在时退回 float32 权重"""
+        return resolve_variant(os.path.join(self.weights_root, weight), variant or self.weight_variants.get(weight))
+
+    def export_metrics(self):
+        """Prometheus 文本格式的运行指标"""
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    def tiling_stats(self):
+        """各 (权重, 切片尺寸, 重叠率) 的平均耗时与相对整图推理多检出的目标数"""
+        return json.dumps({"status": 200, "data": tiling_stats.report()}, ensure_ascii=False)
+
+    def save_data(self, data, path):
+        """将结果数据上传到服务器（交给发件箱异步发送，失败自动重试）"""
+        record = json.loads(data) if isinstance(data, str) else data
+        self.outbox.post_record(path, record)
+
+    def build_img_record(self, ctx, response_data):
+        """按 imgrecords 表的格式组装图片识别记录"""
+        return predictImg.build_img_record(ctx.data, response_data)
 
     def get_file_names(self, directory):
         """获取指定文件夹中的所有文件名 - 备用方法（当前未使用）"""
@@ -395,7 +875,7 @@ class VideoProcessingApp:
 
     def upload(self, out_path):
         """上传处理后的图片或视频文件到远程服务器 - 修复：增强错误处理"""
-        upload_url = "http://localhost:9999/files/upload"
+        upload_url = f"{self.backend_url}/files/upload"
         try:
             if not os.path.exists(out_path):
                 print(f"文件不存在: {out_path}")
@@ -414,18 +894,27 @@ class VideoProcessingApp:
             print(f"上传文件时发生错误: {str(e)}")
             return ""
 
+    def upload_bytes(self, data, filename, content_type='image/jpeg'):
+        """把内存中的文件内容直接上传到远程服务器，不经过磁盘"""
+        upload_url = f"{self.backend_url}/files/upload"
+        try:
+            files = {'file': (filename, data, content_type)}
+            response = requests.post(upload_url, files=files, timeout=30)
+            if response.status_code == 200:
+                print("文件上传成功！")
+                return response.json().get('data', "")
+            print(f"文件上传失败，状态码: {response.status_code}")
+            return ""
+        except Exception as e:
+            print(f"上传文件时发生错误: {str(e)}")
+            return ""
+
     def download(self, url, save_path):
         """下载文件并保存到指定路径"""
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
         try:
-            with requests.get(url, stream=True, timeout=30) as response:
-                response.raise_for_status()
-                with open(save_path, 'wb') as file:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            file.write(chunk)
+            input_fetcher.download(url, save_path)  # 复用连接池，按块流式写入，超过大小上限时中止
             print(f"文件已成功下载并保存到 {save_path}")
-        except requests.RequestException as e:
+        except (requests.RequestException, ValueError) as e:
             print(f"下载失败: {e}")
 
     def cleanup_files(self, file_paths):
@@ -459,4 +948,20 @@ if __name__ == '__main__':
         os.makedirs(dir_path, exist_ok=True)
     
     video_app = VideoProcessingApp()
+    metrics.log_timings = False  # 改为 True 时每个请求输出一行 JSON 格式的分阶段耗时日志
+    video_app.outbox.start()  # 恢复上次未发送完的上传/记录任务
+    # 服务先启动，再在后台更新权重清单、预热模型：torch / ultralytics 在后台线程或第一次推理时才导入
+    weights_manifest.refresh(background=True)
+    # 延迟预算模式使用的本机延迟画像：主机与权重未变时直接读取 runs/latency_profile.json，否则在后台重新测量
+    latency_planner.profile_all(video_app.weights_root, background=True)
+    if video_app.inference_workers:
+        # 多进程推理：每个进程独立的 torch 线程预算，绑定核心并预加载全部模型
+        preload = [os.path.join(video_app.weights_root, f) for f in os.listdir(video_app.weights_root)
+                   if f.endswith('.pt')] if os.path.isdir(video_app.weights_root) else []
+        start_worker_pool(workers=video_app.inference_workers, threads_per_worker=video_app.threads_per_worker,
+                          pin_cores=True, preload=preload)
+    else:
+        # 后台预加载并预热所有模型；预热完成前到达的请求会等待对应模型加载完成
+        threading.Thread(target=model_registry.warm_up, args=(video_app.weights_root,), name='warm-up',
+                         daemon=True).start()
     video_app.run()
\ No newline at end of file
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# @File : backends.py
+# CPU 推理后端：把 weights/*.pt 一次性导出为 OpenVINO / ONNX Runtime / TorchScript 格式并缓存在权重旁边，
+# 启动时测速选出最快的可用后端，任何环节失败都回退到 PyTorch
+#
+# 注意：torch / ultralytics 在第一次导出或加载模型时才导入，导入本模块（以及 main.py）不会拖慢服务启动
+import importlib.util
+import os
+import time
+
+import numpy as np
+
+
+class Backend:
+    """推理后端描述"""
+
+    def __init__(self, name, export_format, module, suffix, max_batch=None, export_kwargs=None, prebuilt=False):
+        """
+        :param name: 后端名称
+        :param export_format: ultralytics export 的 format 参数（pytorch 为 None）
+        :param module: 运行该后端需要的 Python 包（None 表示无额外依赖）
+        :param suffix: 导出产物相对 .pt 去掉扩展名后的后缀
+        :param max_batch: 单次前向最多图片数，None 表示不限
+        :param export_kwargs: 额外的导出参数
+        :param prebuilt: 产物由其他工具生成（如 INT8 量化），直接按文件加载，不由 .pt 导出
+        """
+        self.name = name
+        self.export_format = export_format
+        self.module = module
+        self.suffix = suffix
+        self.max_batch = max_batch
+        self.export_kwargs = export_kwargs or {}
+        self.prebuilt = prebuilt
+
+    def available(self):
+        return self.module is None or importlib.util.find_spec(self.module) is not None
+
+    def artifact_path(self, weights_path):
+        if self.export_format is None or self.prebuilt:
+            return weights_path
+        return os.path.splitext(weights_path)[0] + self.suffix
+
+
+BACKENDS = {
+    # dynamic=True 导出动态 batch，才能配合微批引擎和视频流水线的批量推理
+    'openvino': Backend('openvino', 'openvino', 'openvino', '_openvino_model', export_kwargs={'dynamic': True}),
+    'onnx': Backend('onnx', 'onnx', 'onnxruntime', '.onnx', export_kwargs={'dynamic': True, 'simplify': True}),
+    # TorchScript 导出为固定 batch=1 的计算图，批量推理时需逐张执行
+    'torchscript': Backend('torchscript', 'torchscript', None, '.torchscript', max_batch=1),
+    'pytorch': Backend('pytorch', None, None, '.pt'),
+    # predict/quantize.py 生成的 INT8 ONNX 模型，通过 variant=int8 选择
+    'onnx-int8': Backend('onnx-int8', 'onnx', 'onnxruntime', '_int8.onnx', prebuilt=True),
+}
+
+# backend='auto' 时参与测速的候选，TorchScript 在 CPU 上通常不比融合后的 eager 快，需要显式指定
+AUTO_CANDIDATES = ['openvino', 'onnx', 'pytorch']
+
+
+def export_artifact(weights_path, backend, imgsz=640):
+    """导出（或复用已导出的）产物，产物比 .pt 旧时重新导出"""
+    target = backend.artifact_path(weights_path)
+    if backend.export_format is None:
+        return target
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(weights_path):
+        return target
+    from ultralytics import YOLO
+
+    print(f"导出 {os.path.basename(weights_path)} -> {backend.name}")
+    exported = YOLO(weights_path).export(format=backend.export_format, imgsz=imgsz, device='cpu',
+                                         half=False, **backend.export_kwargs)
+    exported = str(exported)
+    if os.path.abspath(exported) != os.path.abspath(target) and os.path.exists(exported):
+        os.replace(exported, target)
+    return target
+
+
+def load_backend(weights_path, backend, imgsz=640):
+    """按指定后端加载模型并预热，返回 YOLO 实例"""
+    from ultralytics import YOLO
+
+    path = weights_path if backend.prebuilt else export_artifact(weights_path, backend, imgsz)
+    if backend.export_format is None:
+        import torch
+        model = YOLO(path)
+        model.to(device='cpu', dtype=torch.float32)
+        try:
+            model.fuse()
+        except Exception as e:
+            print(f"模型融合失败，使用未融合模型: {e}")
+    else:
+        model = YOLO(path, task='detect')
+    # 预热：初始化 predictor，避免第一次请求承担初始化开销
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    model.predict(source=dummy, imgsz=imgsz, half=False, device='cpu', verbose=False)
+    return model
+
+
+def benchmark(model, imgsz=640, runs=5):
+    """单张图片的平均推理耗时（秒）"""
+    dummy = np.random.randint(0, 255, (imgsz, imgsz, 3), dtype=np.uint8)
+    start = time.time()
+    for _ in range(runs):
+        model.predict(source=dummy, imgsz=imgsz, half=False, device='cpu', verbose=False)
+    return (time.time() - start) / runs
+
+
+def load_fastest(weights_path, preferred='auto', imgsz=640):
+    """
+    加载模型：preferred 为具体后端名时直接使用，为 'auto' 时对所有可用后端测速取最快者；
+    任何后端失败都回退到 PyTorch
+    :return: (后端, YOLO 实例)
+    """
+    for backend in BACKENDS.values():
+        if backend.prebuilt and weights_path.endswith(backend.suffix):
+            # 量化产物只能用对应后端加载，不参与测速和回退
+            return backend, load_backend(weights_path, backend, imgsz)
+    if preferred != 'auto':
+        candidates = [preferred] if preferred in BACKENDS else []
+    else:
+        candidates = [name for name in AUTO_CANDIDATES if BACKENDS[name].available()]
+
+    best = None
+    for name in candidates:
+        backend = BACKENDS[name]
+        if not backend.available():
+            print(f"推理后端 {name} 不可用（缺少 {backend.module}）")
+            continue
+        try:
+            model = load_backend(weights_path, backend, imgsz)
+            if len(candidates) == 1:
+                return backend, model
+            latency = benchmark(model, imgsz)
+            print(f"{os.path.basename(weights_path)} [{name}] 平均推理耗时 {latency * 1000:.1f} ms")
+            if best is None or latency < best[0]:
+                best = (latency, backend, model)
+        except Exception as e:
+            print(f"推理后端 {name} 加载失败: {e}")
+
+    if best is not None:
+        return best[1], best[2]
+    backend = BACKENDS['pytorch']
+    return backend, load_backend(weights_path, backend, imgsz)
+
+
+def artifact_size(path):
+    """导出产物占用的磁盘大小（目录则累加），用于估算内存占用"""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path) if os.path.exists(path) else 0
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# @File : batchEngine.py
+# 动态微批推理引擎：把并发到达、权重和置信度相同的单图请求合并成一次批量前向推理
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from predict.workerPool import executor
+from predict.metrics import metrics
+
+BATCH_SIZE = metrics.histogram('yolo_batch_size', '微批引擎每次前向推理的图片数', buckets=(1, 2, 4, 8, 16, 32))
+
+
+class _BatchItem:
+    """等待推理的单个请求"""
+
+    def __init__(self, image):
+        self.image = image
+        self.future = Future()
+        self.enqueue_time = time.time()
+
+
+class BatchInferenceEngine:
+    def __init__(self, max_batch_size=8, max_wait_ms=10, idle_timeout=60):
+        """
+        初始化微批推理引擎
+        :param max_batch_size: 单次前向推理的最大图片数
+        :param max_wait_ms: 收到第一张图片后最多等待多久以凑批（毫秒）
+        :param idle_timeout: 某个分组空闲多久后回收其调度线程（秒）
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.idle_timeout = idle_timeout
+        self._queues = {}  # (权重路径, conf, imgsz) -> queue.Queue
+        self._lock = threading.Lock()
+
+    def submit(self, weights_path, conf, image, imgsz=None):
+        """
+        提交一张图片（BGR ndarray），返回 Future，结果为 ((原图, 检测框 ndarray(N, 6)), 计时字典)
+        """
+        key = (weights_path, float(conf), imgsz)
+        item = _BatchItem(image)
+        with self._lock:
+            q = self._queues.get(key)
+            if q is None:
+                q = queue.Queue()
+                self._queues[key] = q
+                threading.Thread(target=self._worker, args=(key, q), daemon=True).start()
+            q.put(item)
+        return item.future
+
+    def infer(self, weights_path, conf, image, imgsz=None, timeout=None):
+        """同步推理单张图片，阻塞直到所在批次完成"""
+        return self.submit(weights_path, conf, image, imgsz).result(timeout=timeout)
+
+    def queue_depth(self):
+        """当前所有分组中排队等待的请求数"""
+        with self._lock:
+            return sum(q.qsize() for q in self._queues.values())
+
+    def _worker(self, key, q):
+        """每个 (权重, conf, imgsz) 分组一个调度线程：凑批 -> 批量推理 -> 分发结果"""
+        while True:
+            try:
+                first = q.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    # 加锁后再确认一次队列为空，避免与 submit 竞争
+                    if q.empty():
+                        self._queues.pop(key, None)
+                        return
+                continue
+
+            batch = [first]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(key, batch)
+
+    def _run_batch(self, key, batch):
+        weights_path, conf, imgsz = key
+        start_time = time.time()
+        kwargs = dict(conf=conf, half=False, device='cpu', verbose=False)
+        if imgsz:
+            kwargs['imgsz'] = imgsz
+        images = [item.image for item in batch]
+        pool = executor()
+        if hasattr(pool, 'submit'):
+            # 多进程推理池：异步提交，调度线程立即继续凑下一批，多个批次可在不同进程中并行推理
+            pool.submit(weights_path, images, **kwargs).add_done_callback(
+                lambda future: self._finish_batch(batch, start_time, future=future))
+            return
+        try:
+            # 按后端的 batch 上限执行前向推理（动态 batch 的后端一次完成）
+            results = pool.predict_boxes(weights_path, images, **kwargs)
+        except Exception as e:
+            self._finish_batch(batch, start_time, error=e)
+            return
+        self._finish_batch(batch, start_time, results=results)
+
+    @staticmethod
+    def _finish_batch(batch, start_time, results=None, future=None, error=None):
+        if future is not None:
+            try:
+                results = future.result()
+            except Exception as e:
+                error = e
+        if error is not None:
+            for item in batch:
+                item.future.set_exception(error)
+            return
+        infer_time = time.time() - start_time
+        BATCH_SIZE.observe(len(batch))
+        for item, boxes in zip(batch, results):
+            item.future.set_result(((item.image, boxes), {
+                'queueTime': start_time - item.enqueue_time,
+                'inferTime': infer_time,
+                'batchSize': len(batch)
+            }))
+
+
+# 全局单例，/predict 与 /predictBatch 共用
+batch_engine = BatchInferenceEngine()
+metrics.gauge('yolo_batch_queue_depth', '微批引擎中排队等待的请求数').set_function(batch_engine.queue_depth)
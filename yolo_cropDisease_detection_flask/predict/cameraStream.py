@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+# @File : cameraStream.py
+# 低延迟摄像头推流：采集线程只保留最新一帧，同一摄像头 + 权重 + 阈值只运行一个推理循环，
+# 结果分发给多个 /predictCamera 观看者；每个观看者按实测的发送速度自适应调整 JPEG 质量与分辨率；
+# 可选的运动门控在画面静止时跳过推理，复用上一次的检测结果
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from predict.workerPool import executor as get_executor
+from predict.metrics import metrics, STAGE_SECONDS, VIDEO_FRAMES_TOTAL
+from predict.renderer import get_renderer
+from predict.motionGate import MotionGate
+from predict.weightsManifest import weights_manifest
+
+SYNTHETIC_SOURCE = 'synthetic'  # 合成画面，用于没有摄像头的环境
+
+
+class LatestFrameGrabber:
+    """采集线程：持续读取设备，只保留最新一帧，避免驱动缓冲区积压导致画面越来越滞后"""
+
+    def __init__(self, source, frame_size=(640, 480), loop_file=True):
+        """
+        :param source: 摄像头设备号、视频文件路径/地址，或 'synthetic'
+        :param frame_size: 输出帧尺寸 (宽, 高)
+        :param loop_file: 视频文件读完后是否从头循环（模拟摄像头）
+        """
+        self.source = source
+        self.frame_size = frame_size
+        self.loop_file = loop_file
+        self.fps = 0.0
+        self._frame = None
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._cap = None
+        self._is_file = isinstance(source, str) and source != SYNTHETIC_SOURCE
+        if source != SYNTHETIC_SOURCE:
+            self._cap = cv2.VideoCapture(source)
+            if not self._is_file:
+                self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, frame_size[0])
+                self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, frame_size[1])
+                self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 部分驱动支持，进一步减少缓冲
+            self.fps = self._cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.fps = self.fps if 0 < self.fps < 120 else 25.0
+        self._thread = threading.Thread(target=self._run, name='camera-grab', daemon=True)
+        self._thread.start()
+
+    def isOpened(self):
+        return self._cap is None or self._cap.isOpened()
+
+    def read(self, last_seq=0, timeout=1.0):
+        """等待比 last_seq 更新的一帧，返回 (seq, frame)；采集结束后返回 (seq, None)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq or self._stop.is_set(), timeout=timeout)
+            if self._seq > last_seq:
+                return self._seq, self._frame
+            return self._seq, None
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        if self._cap is not None:
+            self._cap.release()
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        next_time = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                if self._cap is None:
+                    frame = self._synthetic_frame()
+                else:
+                    ret, frame = self._cap.read()
+                    if not ret:
+                        if self._is_file and self.loop_file and self._seq > 0:
+                            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                            continue
+                        break
+                if (frame.shape[1], frame.shape[0]) != self.frame_size:
+                    frame = cv2.resize(frame, self.frame_size)
+                with self._cond:
+                    self._frame = frame
+                    self._seq += 1
+                    self._cond.notify_all()
+                VIDEO_FRAMES_TOTAL.inc(stage='camera_grab')
+                if self._cap is None or self._is_file:
+                    # 文件和合成画面按原始帧率读取，模拟真实摄像头；设备本身的 read 会阻塞到下一帧
+                    next_time += interval
+                    time.sleep(max(0.0, next_time - time.perf_counter()))
+        finally:
+            self._stop.set()
+            with self._cond:
+                self._cond.notify_all()
+
+    def _synthetic_frame(self):
+        width, height = self.frame_size
+        frame = np.full((height, width, 3), 40, dtype=np.uint8)
+        x = int((self._seq * 4) % width)
+        cv2.rectangle(frame, (x, height // 3), (min(width - 1, x + width // 5), 2 * height // 3), (60, 160, 60), -1)
+        cv2.putText(frame, str(self._seq), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        return frame
+
+
+class AdaptiveEncoder:
+    """按观看者的实测发送耗时调整 JPEG 质量和缩放比例：发送跟不上帧率时先降质量再降分辨率，富余时逐步恢复"""
+
+    QUALITY_STEPS = (85, 75, 65, 55, 45)
+    SCALE_STEPS = (1.0, 0.75, 0.5)
+
+    def __init__(self, target_fps=25.0):
+        self.target_interval = 1.0 / max(1.0, target_fps)
+        self.level = 0  # 0 为最高画质，越大越省带宽
+        self.send_time = 0.0  # 单帧发送耗时的指数滑动平均
+        self.bytes_per_sec = 0.0
+
+    @property
+    def max_level(self):
+        return len(self.QUALITY_STEPS) + len(self.SCALE_STEPS) - 2
+
+    @property
+    def quality(self):
+        return self.QUALITY_STEPS[min(self.level, len(self.QUALITY_STEPS) - 1)]
+
+    @property
+    def scale(self):
+        return self.SCALE_STEPS[max(0, self.level - len(self.QUALITY_STEPS) + 1)]
+
+    def encode(self, frame):
+        if self.scale != 1.0:
+            frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return jpeg.tobytes()
+
+    def observe(self, nbytes, seconds):
+        """记录一帧从交给服务器到客户端取走下一帧的耗时"""
+        self.send_time = seconds if self.send_time == 0 else 0.8 * self.send_time + 0.2 * seconds
+        if seconds > 0:
+            rate = nbytes / seconds
+            self.bytes_per_sec = rate if self.bytes_per_sec == 0 else 0.8 * self.bytes_per_sec + 0.2 * rate
+        if self.send_time > self.target_interval and self.level < self.max_level:
+            self.level += 1
+            self.send_time = 0.0
+        elif self.send_time < 0.4 * self.target_interval and self.level > 0:
+            self.level -= 1
+            self.send_time = 0.0
+
+
+class CameraStream:
+    """一个 (摄像头, 权重, conf, 推理尺寸, 门控设置) 对应一个推理循环，最新的标注帧分发给所有观看者"""
+
+    def __init__(self, hub, key, grabber, weights_path, conf, font_path=None, imgsz=640, motion_gate=None):
+        self.hub = hub
+        self.key = key
+        self.grabber = grabber
+        self.weights_path = weights_path
+        self.conf = float(conf)
+        self.font_path = font_path
+        self.imgsz = imgsz
+        self.viewers = 0
+        self.infer_fps = 0.0
+        self.gate = MotionGate(**motion_gate) if motion_gate else None
+        self._frame = None
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='camera-infer', daemon=True)
+        self._thread.start()
+
+    def read(self, last_seq=0, timeout=1.0):
+        """等待比 last_seq 更新的标注帧，返回 (seq, frame)；推理循环结束后返回 (seq, None)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq or self._stop.is_set(), timeout=timeout)
+            if self._seq > last_seq:
+                return self._seq, self._frame
+            return self._seq, None
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        grab_seq = 0
+        try:
+            executor = get_executor()
+            renderer = get_renderer(self.weights_path, weights_manifest.labels(self.weights_path), self.font_path)
+            boxes = annotated = None
+            while not self._stop.is_set():
+                grab_seq, frame = self.grabber.read(grab_seq)
+                if frame is None:
+                    if self.grabber.stopped:
+                        break
+                    continue
+                if boxes is not None and self.gate is not None and not self.gate.check(frame)[0]:
+                    # 画面与上次推理时相比没有明显变化：复用检测结果（redraw 时画到当前帧上，否则复用标注帧）
+                    if self.gate.redraw:
+                        annotated = renderer.draw(frame.copy(), boxes, inplace=True)
+                    VIDEO_FRAMES_TOTAL.inc(stage='camera_skip')
+                else:
+                    if boxes is None and self.gate is not None:
+                        self.gate.check(frame)  # 第一帧作为门控的参考画面
+                    start = time.perf_counter()
+                    boxes = executor.predict_boxes(self.weights_path, [frame], imgsz=self.imgsz, conf=self.conf,
+                                                   half=False, device='cpu', verbose=False)[0]
+                    # 采集帧由多个推理循环共享，拷贝后再绘制
+                    annotated = renderer.draw(frame.copy(), boxes, inplace=True)
+                    elapsed = time.perf_counter() - start
+                    STAGE_SECONDS.observe(elapsed, endpoint='camera', stage='inference')
+                    VIDEO_FRAMES_TOTAL.inc(stage='camera_infer')
+                    self.infer_fps = 1.0 / elapsed if self.infer_fps == 0 else 0.9 * self.infer_fps + 0.1 / elapsed
+                with self._cond:
+                    self._frame = annotated
+                    self._seq += 1
+                    self._cond.notify_all()
+        except Exception as e:
+            print(f"摄像头推理循环出错: {e}")
+        finally:
+            self.stop()
+
+
+class CameraViewer:
+    """单个观看者：只取最新的标注帧，按自己的网络状况编码"""
+
+    def __init__(self, hub, stream):
+        self.hub = hub
+        self.stream = stream
+        self.encoder = AdaptiveEncoder(stream.grabber.fps)
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self._closed = False
+
+    def frames(self, should_stop=None):
+        """生成 (标注帧 ndarray, JPEG 字节)；客户端取走上一帧后才编码下一帧，中间的帧直接丢弃"""
+        seq = 0
+        try:
+            while not self.stream.stopped and not (should_stop and should_stop()):
+                new_seq, frame = self.stream.read(seq)
+                if frame is None:
+                    continue
+                if seq:
+                    self.frames_skipped += new_seq - seq - 1
+                seq = new_seq
+                jpeg = self.encoder.encode(frame)
+                start = time.perf_counter()
+                yield frame, jpeg
+                self.encoder.observe(len(jpeg), time.perf_counter() - start)
+                self.frames_sent += 1
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.hub.release(self.stream)
+
+    def report(self):
+        return {
+            'framesSent': self.frames_sent,
+            'framesSkipped': self.frames_skipped,
+            'jpegQuality': self.encoder.quality,
+            'scale': self.encoder.scale,
+            'inferFps': round(self.stream.infer_fps, 2),
+            'gate': self.stream.gate.stats() if self.stream.gate is not None else None
+        }
+
+
+class CameraHub:
+    """摄像头与推理循环的共享管理：设备只打开一次，最后一个观看者离开后释放"""
+
+    def __init__(self, frame_size=(640, 480)):
+        self.frame_size = frame_size
+        self._grabbers = {}  # source -> [LatestFrameGrabber, 引用数]
+        self._streams = {}  # (source, 权重路径, conf, 门控设置) -> CameraStream
+        self._lock = threading.Lock()
+
+    def subscribe(self, source, weights_path, conf, font_path=None, imgsz=640, motion_gate=None):
+        """
+        加入观看，返回 CameraViewer；同一摄像头的不同权重共用一个采集线程
+        :param imgsz: 推理尺寸（延迟预算模式下按画像选择），不同尺寸的观看者使用各自的推理循环
+        :param motion_gate: 运动门控参数（MotionGate 的参数字典），为 None 时每帧都推理
+        """
+        gate_key = tuple(sorted(motion_gate.items())) if motion_gate else None
+        key = (source, weights_path, float(conf), imgsz, gate_key)
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None or stream.stopped:
+                grabber = self._acquire_grabber(source)
+                if not grabber.isOpened():
+                    self._release_grabber(source, grabber)
+                    raise ValueError(f"无法打开摄像头: {source}")
+                stream = CameraStream(self, key, grabber, weights_path, conf, font_path, imgsz, motion_gate)
+                self._streams[key] = stream
+            stream.viewers += 1
+        return CameraViewer(self, stream)
+
+    def release(self, stream):
+        with self._lock:
+            stream.viewers -= 1
+            if stream.viewers > 0:
+                return
+            stream.stop()
+            if self._streams.get(stream.key) is stream:
+                del self._streams[stream.key]
+            self._release_grabber(stream.key[0], stream.grabber)
+
+    def peek(self, source, timeout=2.0, keep_seconds=5.0):
+        """
+        读取摄像头的一帧（用于作物自动路由），读不到时返回 None；
+        采集线程保留 keep_seconds 秒，紧接着的 subscribe 直接复用，不必重新打开设备
+        """
+        with self._lock:
+            grabber = self._acquire_grabber(source)
+        _, frame = grabber.read(0, timeout=timeout)
+
+        def release():
+            with self._lock:
+                self._release_grabber(source, grabber)
+
+        timer = threading.Timer(keep_seconds, release)
+        timer.daemon = True
+        timer.start()
+        return frame
+
+    def viewer_count(self):
+        with self._lock:
+            return sum(stream.viewers for stream in self._streams.values())
+
+    def _acquire_grabber(self, source):
+        entry = self._grabbers.get(source)
+        if entry is None or entry[0].stopped:
+            entry = self._grabbers[source] = [LatestFrameGrabber(source, self.frame_size), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _release_grabber(self, source, grabber):
+        entry = self._grabbers.get(source)
+        if entry is None or entry[0] is not grabber:
+            grabber.stop()  # 已被替换的旧采集线程（设备中途断开后重新打开）
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._grabbers[source]
+            entry[0].stop()
+
+
+# 全局单例，所有 /predictCamera 请求共用
+camera_hub = CameraHub()
+metrics.gauge('yolo_camera_viewers', '正在观看摄像头推流的客户端数').set_function(camera_hub.viewer_count)
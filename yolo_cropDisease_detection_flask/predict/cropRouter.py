@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# @File : cropRouter.py
+# 作物自动路由：请求不指定 weight（或 weight=auto）时，先判断图片/视频片段属于哪种作物，再交给对应的检测模型。
+# 有作物分类模型（weights/router/crop_cls.pt，ultralytics 分类模型，类别名为 corn / rice / ...）时用分类模型判断；
+# 没有或置信度不足时，各作物检测模型以小尺寸各推理一次，按检测置信度投票。
+# 路由结果按内容哈希缓存：同一图片重复提交时不再判断，也不必让用户把同一张图依次提交给每个模型
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from predict.inputFetcher import decode_image
+from predict.metrics import metrics
+from predict.motionGate import dhash
+from predict.weightsManifest import weights_manifest
+from predict.workerPool import executor
+
+AUTO = 'auto'
+CLASSIFIER_PATH = os.path.join('router', 'crop_cls.pt')  # 相对于权重目录；放在子目录中，不会被当作检测权重列出
+
+ROUTER_DECISIONS_TOTAL = metrics.counter('yolo_router_decisions_total', '作物自动路由的判断次数',
+                                         ('method', 'kind'))
+ROUTER_CACHE_TOTAL = metrics.counter('yolo_router_cache_total', '路由结果缓存的命中情况', ('result',))
+ROUTER_SECONDS = metrics.histogram('yolo_router_seconds', '作物自动路由的耗时（秒）', ('method',),
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+# 不自动路由时，用户不确定作物就要把同一张图提交给每个检测模型；路由后只需其中一个，
+# 按“检测模型数 - 1”计入（投票方式本身已让每个模型以小尺寸推理过一次，不计入）
+ROUTER_AVOIDED_TOTAL = metrics.counter('yolo_router_avoided_inferences_total', '作物自动路由避免的重复检测推理次数',
+                                       ('source',))
+
+
+def is_auto(weight):
+    """请求未指定权重或指定为 auto 时自动路由"""
+    return not weight or str(weight).strip().lower() == AUTO
+
+
+def sample_frames(cap, count=3):
+    """
+    从视频中均匀抽取 count 帧用于路由（10% ~ 90% 处），之后回到开头；
+    不能定位的视频流只取第一帧，该帧已被读出，需随返回值交给流水线，否则会从输出中丢失
+    :return: (用于路由的帧, 已从当前位置读出、需要先于 cap 处理的帧)；能回到开头时后者为空
+    """
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    frames = []
+    if total > 0:
+        for i in range(count):
+            if not cap.set(cv2.CAP_PROP_POS_FRAMES, int(total * (0.1 + 0.8 * i / max(1, count - 1)))):
+                break
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+        if not cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+            print("视频无法回到开头，抽样位置之前的帧不会输出")
+    if frames:
+        return frames, []
+    ret, frame = cap.read()
+    return ([frame], [frame]) if ret else ([], [])
+
+
+class CropRouter:
+    def __init__(self, weights_root='./weights', max_entries=4096, min_confidence=0.6, vote_imgsz=320,
+                 vote_conf=0.25):
+        """
+        :param weights_root: 权重目录（检测模型与 router/crop_cls.pt）
+        :param max_entries: 路由缓存条数上限，按 LRU 淘汰
+        :param min_confidence: 分类模型的置信度低于该值时改用检测模型投票
+        :param vote_imgsz: 投票时检测模型的推理尺寸（只用于判断作物，不输出检测结果）
+        :param vote_conf: 投票时的置信度阈值
+        """
+        self.weights_root = weights_root
+        self.max_entries = max_entries
+        self.min_confidence = min_confidence
+        self.vote_imgsz = vote_imgsz
+        self.vote_conf = vote_conf
+        self._entries = OrderedDict()  # 内容哈希 -> 路由结果
+        self._lock = threading.Lock()
+        self._classifier = None  # (mtime, YOLO 分类模型)
+        self._classifier_lock = threading.Lock()
+        self._missing_warned = False
+
+    @property
+    def classifier_path(self):
+        return os.path.join(self.weights_root, CLASSIFIER_PATH)
+
+    def route_image(self, image_bytes, source='image'):
+        """按图片原始字节路由（内容哈希为字节的 sha1），返回路由结果字典"""
+        key = 'sha1:' + hashlib.sha1(image_bytes).hexdigest()
+        return self._route(key, lambda: [decode_image(image_bytes)], source)
+
+    def route_frames(self, frames, source='video'):
+        """
+        按若干帧路由（视频片段 / 摄像头画面），内容哈希为各帧感知哈希的组合：
+        同一视频、画面基本不变的摄像头重复请求时直接命中缓存
+        """
+        if not frames:
+            raise ValueError("没有可用于判断作物的画面")
+        digest = b''.join(dhash(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)).tobytes() for frame in frames)
+        key = 'dhash:' + digest.hex()
+        return self._route(key, lambda: frames, source)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'classifier': os.path.exists(self.classifier_path)}
+
+    def _route(self, key, load_images, source):
+        start = time.perf_counter()
+        with self._lock:
+            decision = self._entries.get(key)
+            if decision is not None:
+                self._entries.move_to_end(key)
+        if decision is not None:
+            ROUTER_CACHE_TOTAL.inc(result='hit')
+            ROUTER_SECONDS.observe(time.perf_counter() - start, method='cache')
+            ROUTER_AVOIDED_TOTAL.inc(max(0, len(decision['candidates']) - 1), source=source)
+            return dict(decision, cached=True, routeMs=round((time.perf_counter() - start) * 1000, 2))
+
+        ROUTER_CACHE_TOTAL.inc(result='miss')
+        images = load_images()
+        detectors = self._detectors()
+        if not detectors:
+            raise FileNotFoundError(f"权重目录中没有检测模型: {self.weights_root}")
+        decision = self._classify(images, detectors)
+        if decision is None:
+            decision = self._vote(images, detectors)
+        else:
+            ROUTER_AVOIDED_TOTAL.inc(len(detectors) - 1, source=source)
+        decision['candidates'] = sorted(detectors)
+        elapsed = time.perf_counter() - start
+        ROUTER_DECISIONS_TOTAL.inc(method=decision['method'], kind=decision['kind'])
+        ROUTER_SECONDS.observe(elapsed, method=decision['method'])
+        with self._lock:
+            self._entries[key] = decision
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        print(f"作物自动路由: {decision['kind']} -> {decision['weight']}（{decision['method']}，"
+              f"置信度 {decision['confidence']:.2f}，用时 {elapsed * 1000:.1f}ms）")
+        return dict(decision, cached=False, routeMs=round(elapsed * 1000, 2))
+
+    def _detectors(self):
+        """作物种类 -> 检测权重文件名；同一作物有多个权重时优先 <作物>_best.pt"""
+        detectors = {}
+        for entry in weights_manifest.weights():
+            name, kind = entry['name'], entry.get('kind')
+            if not os.path.exists(os.path.join(self.weights_root, name)):
+                continue
+            if kind not in detectors or name == f'{kind}_best.pt':
+                detectors[kind] = name
+        return detectors
+
+    def _classify(self, images, detectors):
+        """分类模型判断作物（多帧时概率取平均）；没有分类模型、类别不在检测模型中或置信度不足时返回 None"""
+        model = self._load_classifier()
+        if model is None:
+            if not self._missing_warned:
+                self._missing_warned = True
+                print(f"没有作物分类模型 {self.classifier_path}，改用各检测模型投票"
+                      f"（较慢，可运行 python train_all.py --only router 训练分类模型）")
+            return None
+        results = model.predict(source=images, imgsz=224, half=False, device='cpu', verbose=False)
+        probs = np.mean([result.probs.data.cpu().numpy() for result in results], axis=0)
+        names = model.names
+        index = int(np.argmax(probs))
+        kind, confidence = str(names[index]).lower(), float(probs[index])
+        if kind not in detectors or confidence < self.min_confidence:
+            print(f"作物分类结果不可用（{kind}，置信度 {confidence:.2f}），改用检测模型投票")
+            return None
+        return {'kind': kind, 'weight': detectors[kind], 'confidence': confidence, 'method': 'classifier'}
+
+    def _vote(self, images, detectors):
+        """
+        各检测模型以小尺寸推理，按最高的几个检测置信度之和投票；
+        图片不是任一作物时（所有模型都没有检出）仍返回得分最高的作物，置信度为 0
+        """
+        scores = {}
+        for kind, name in detectors.items():
+            boxes_list = executor().predict_boxes(os.path.join(self.weights_root, name), images,
+                                                  imgsz=self.vote_imgsz, conf=self.vote_conf, half=False,
+                                                  device='cpu', verbose=False)
+            scores[kind] = float(np.mean([np.sort(boxes[:, 4])[-3:].sum() if len(boxes) else 0.0
+                                          for boxes in boxes_list]))
+        kind = max(scores, key=scores.get)
+        total = sum(scores.values())
+        return {'kind': kind, 'weight': detectors[kind], 'confidence': scores[kind] / total if total else 0.0,
+                'method': 'vote', 'scores': {k: round(v, 3) for k, v in scores.items()}}
+
+    def _load_classifier(self):
+        """分类模型不经过模型注册表（注册表按检测任务导出、预热），在本进程内直接加载，文件更新后重新加载"""
+        path = self.classifier_path
+        if not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        with self._classifier_lock:
+            if self._classifier is None or self._classifier[0] != mtime:
+                from ultralytics import YOLO
+                import torch
+
+                model = YOLO(path, task='classify')
+                model.to(device='cpu', dtype=torch.float32)
+                self._classifier = (mtime, model)
+            return self._classifier[1]
+
+
+# 全局单例；main.py 启动时设置权重目录
+crop_router = CropRouter()
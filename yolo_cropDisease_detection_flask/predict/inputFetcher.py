@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# @File : inputFetcher.py
+# 输入获取层：图片/视频地址统一经连接池下载（keep-alive），带大小上限与条件请求缓存；
+# 图片直接在内存中解码，不落临时文件；视频优先边下载边解码，失败时再整体下载到工作目录
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from predict.metrics import CACHE_REQUESTS_TOTAL
+
+
+class InputTooLargeError(ValueError):
+    """输入文件超过大小上限"""
+
+
+class InputNotAllowedError(ValueError):
+    """输入地址既不是 http(s) 地址，也不在允许读取的本地目录下"""
+
+
+class InputFetcher:
+    def __init__(self, pool_size=16, chunk_size=256 * 1024, max_image_mb=20, max_video_mb=1024,
+                 cache_mb=64, timeout=(5, 30), local_roots=()):
+        """
+        初始化输入获取器
+        :param pool_size: HTTP 连接池大小（同一主机的连接复用）
+        :param chunk_size: 流式读取的块大小（字节）
+        :param max_image_mb: 图片大小上限（MB）
+        :param max_video_mb: 视频大小上限（MB）
+        :param cache_mb: 条件请求缓存容量（MB），缓存带 ETag/Last-Modified 的图片原始字节
+        :param timeout: (连接超时, 读取超时)，单位秒
+        :param local_roots: 允许读取本地文件的目录；默认为空，即只接受 http(s) 地址，
+                            接口参数中的本地路径不会被读取（否则客户端可借此读取服务器上的任意文件）
+        """
+        self.chunk_size = chunk_size
+        self.max_image_bytes = int(max_image_mb * 1024 * 1024)
+        self.max_video_bytes = int(max_video_mb * 1024 * 1024)
+        self.max_cache_bytes = int(cache_mb * 1024 * 1024)
+        self.timeout = timeout
+        self.local_roots = [os.path.realpath(root) for root in local_roots]
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._cache = OrderedDict()  # url -> (validators 字典, bytes)
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_remote(source):
+        return str(source).startswith(('http://', 'https://'))
+
+    def allow_local(self, *roots):
+        """允许读取这些目录下的本地文件（离线批量预测、命令行测试等不经过 HTTP 接口的场景）"""
+        self.local_roots.extend(os.path.realpath(root) for root in roots)
+        return self
+
+    def is_allowed(self, source):
+        """http(s) 地址，或解析符号链接后位于允许目录下的本地路径"""
+        if self.is_remote(source):
+            return True
+        path = os.path.realpath(str(source))
+        return any(os.path.commonpath([path, root]) == root for root in self.local_roots)
+
+    def check_allowed(self, source):
+        if not self.is_allowed(source):
+            raise InputNotAllowedError(f"只接受 http(s) 地址，不能读取本地文件: {source}")
+
+    def fetch(self, source, max_bytes=None):
+        """读取原始字节，支持 http(s) 地址和允许目录下的本地路径（含中文路径）"""
+        max_bytes = max_bytes or self.max_image_bytes
+        if not self.is_remote(source):
+            self.check_allowed(source)
+            if os.path.getsize(source) > max_bytes:
+                raise InputTooLargeError(f"文件超过大小上限 {max_bytes // 1024 // 1024} MB: {source}")
+            with open(source, 'rb') as f:
+                return f.read()
+
+        headers = {}
+        with self._lock:
+            cached = self._cache.get(source)
+        if cached is not None:
+            validators, _ = cached
+            if 'etag' in validators:
+                headers['If-None-Match'] = validators['etag']
+            if 'last_modified' in validators:
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        with self.session.get(source, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304 and cached is not None:
+                CACHE_REQUESTS_TOTAL.inc(cache='input', result='hit')
+                with self._lock:
+                    if source in self._cache:
+                        self._cache.move_to_end(source)
+                return cached[1]
+            response.raise_for_status()
+            data = self._read_limited(response, max_bytes, source)
+            validators = {}
+            if response.headers.get('ETag'):
+                validators['etag'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                validators['last_modified'] = response.headers['Last-Modified']
+
+        if validators:
+            CACHE_REQUESTS_TOTAL.inc(cache='input', result='miss')
+            self._cache_put(source, validators, data)
+        return data
+
+    def fetch_image(self, source):
+        """下载并在内存中解码图片，返回 (原始字节, BGR ndarray)"""
+        data = self.fetch(source, self.max_image_bytes)
+        return data, decode_image(data, source)
+
+    def open_video(self, source, fallback_path=None):
+        """
+        打开视频：远程地址先尝试由 FFmpeg 边下载边解码，打不开时再下载到 fallback_path 后打开
+        :return: cv2.VideoCapture（调用方负责 release）
+        """
+        if not self.is_remote(source):
+            self.check_allowed(source)
+            return cv2.VideoCapture(source)
+
+        length = self._remote_length(source)
+        if length and length > self.max_video_bytes:
+            raise InputTooLargeError(f"视频超过大小上限 {self.max_video_bytes // 1024 // 1024} MB: {source}")
+
+        cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG)
+        if cap.isOpened():
+            return cap
+        cap.release()
+        if not fallback_path:
+            return cap
+        print(f"视频无法流式读取，改为完整下载: {source}")
+        self.download(source, fallback_path, self.max_video_bytes)
+        return cv2.VideoCapture(fallback_path)
+
+    def download(self, url, save_path, max_bytes=None):
+        """流式下载到文件（复用连接池），超过大小上限时中止并删除已下载部分"""
+        max_bytes = max_bytes or self.max_video_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+        written = 0
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                self._check_length(response, max_bytes, url)
+                with open(save_path, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        written += len(chunk)
+                        if written > max_bytes:
+                            raise InputTooLargeError(f"文件超过大小上限 {max_bytes // 1024 // 1024} MB: {url}")
+                        file.write(chunk)
+        except Exception:
+            if os.path.exists(save_path):
+                os.remove(save_path)
+            raise
+        return save_path
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._cache), 'memory_mb': round(self._cache_bytes / 1024 / 1024, 3)}
+
+    def _remote_length(self, url):
+        try:
+            response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+            return int(response.headers.get('Content-Length', 0)) if response.ok else 0
+        except (requests.RequestException, ValueError):
+            return 0
+
+    @staticmethod
+    def _check_length(response, max_bytes, source):
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise InputTooLargeError(f"文件超过大小上限 {max_bytes // 1024 // 1024} MB: {source}")
+
+    def _read_limited(self, response, max_bytes, source):
+        self._check_length(response, max_bytes, source)
+        buffer = bytearray()
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            buffer.extend(chunk)
+            if len(buffer) > max_bytes:
+                raise InputTooLargeError(f"文件超过大小上限 {max_bytes // 1024 // 1024} MB: {source}")
+        return bytes(buffer)
+
+    def _cache_put(self, url, validators, data):
+        if len(data) > self.max_cache_bytes:
+            return
+        with self._lock:
+            old = self._cache.pop(url, None)
+            if old is not None:
+                self._cache_bytes -= len(old[1])
+            self._cache[url] = (validators, data)
+            self._cache_bytes += len(data)
+            while self._cache and self._cache_bytes > self.max_cache_bytes:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+
+def decode_image(data, source=''):
+    """把图片字节解码为 BGR ndarray"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"无法解码图片: {source}")
+    return image
+
+
+# 全局单例，图片/批量/视频接口共用同一个连接池
+input_fetcher = InputFetcher()
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+# @File : latencyBudget.py
+# 延迟预算：启动后在本机为每个权重测量不同推理尺寸、模型变体（fp32 / int8）下的单张推理耗时，
+# 请求带上延迟预算（毫秒）或质量档位时，选出预计耗时不超过预算、质量最高的 (imgsz, 变体, 切片) 组合；
+# 实际耗时以滑动平均回写到画像中，机器负载变化后估计值随之修正
+import json
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+
+from predict.metrics import metrics
+from predict.quantize import int8_path, resolve_variant
+from predict.tiling import make_tiles
+from predict.workerPool import executor
+
+IMGSZ_CANDIDATES = (320, 480, 640, 800)
+TIERS = ('fast', 'balanced', 'accurate')
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2
+TILE_BATCH = 4  # 切片推理按批执行，用该批大小下的单张耗时估算
+
+BUDGET_CHOICES_TOTAL = metrics.counter('yolo_budget_choices_total', '延迟预算模式选择的推理设置',
+                                       ('weight', 'variant', 'imgsz', 'tiling'))
+BUDGET_OVERRUN_TOTAL = metrics.counter('yolo_budget_overrun_total', '实际推理耗时超出延迟预算的请求数', ('weight',))
+
+
+def parse_budget(budget=None, tier=None):
+    """
+    解析请求参数：budget 为延迟预算（毫秒），tier 为质量档位（fast / balanced / accurate）
+    :return: {'budget_ms', 'tier'} 或 None（两者都未传时使用固定设置）；参数无效时抛出 ValueError
+    """
+    try:
+        budget_ms = float(budget) if budget not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError(f"无效的延迟预算: {budget}，应为毫秒数")
+    if budget_ms is not None and budget_ms <= 0:
+        raise ValueError(f"无效的延迟预算: {budget}，应为正数")
+    tier = str(tier).strip().lower() if tier not in (None, '') else None
+    if tier is not None and tier not in TIERS:
+        raise ValueError(f"未知的质量档位: {tier}，可选 {TIERS}")
+    if budget_ms is None and tier is None:
+        return None
+    return {'budget_ms': budget_ms, 'tier': tier}
+
+
+class LatencyPlanner:
+    def __init__(self, profile_path='./runs/latency_profile.json', imgsz_candidates=IMGSZ_CANDIDATES, runs=3,
+                 safety=0.9):
+        """
+        :param profile_path: 画像缓存文件；主机、权重文件未变时重启直接复用，不重新测量
+        :param imgsz_candidates: 参与选择的推理尺寸（ONNX / OpenVINO 后端以动态尺寸导出，可直接切换）
+        :param runs: 每个设置测量次数（取中位数）
+        :param safety: 预计耗时需不超过 预算 × safety 才会被选中，给排队和前后处理留余量
+        """
+        self.profile_path = profile_path
+        self.imgsz_candidates = tuple(imgsz_candidates)
+        self.runs = runs
+        self.safety = safety
+        self._profiles = {}  # 权重文件名 -> {'key', 'options': {'variant:imgsz': ms}, 'tileMs': {variant: ms}}
+        self._lock = threading.Lock()
+        self._profiling = set()
+        self._load()
+
+    # ---------------- 画像 ----------------
+
+    def profile(self, weights_path):
+        """测量一个权重在各变体、各推理尺寸下的单张耗时（毫秒），结果写入画像缓存"""
+        name = os.path.basename(weights_path)
+        key = self._profile_key(weights_path)
+        with self._lock:
+            cached = self._profiles.get(name)
+            if cached and cached.get('key') == key:
+                return cached
+        options, tile_ms = {}, {}
+        for variant in self._variants(weights_path):
+            model_path = resolve_variant(weights_path, variant)
+            for imgsz in self.imgsz_candidates:
+                try:
+                    options[f'{variant}:{imgsz}'] = self._measure(model_path, imgsz, 1)
+                except Exception as e:
+                    print(f"测量 {name} [{variant}, imgsz={imgsz}] 失败: {e}")
+            try:
+                tile_ms[variant] = self._measure(model_path, TILE_SIZE, TILE_BATCH)
+            except Exception as e:
+                print(f"测量 {name} [{variant}] 切片批量耗时失败: {e}")
+        profile = {'key': key, 'options': options, 'tileMs': tile_ms,
+                   'measuredAt': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with self._lock:
+            self._profiles[name] = profile
+        self._save()
+        print(f"{name} 延迟画像: " + ', '.join(f'{k}={v:.1f}ms' for k, v in options.items()))
+        return profile
+
+    def profile_all(self, weights_root, background=True):
+        """为目录下的所有 .pt 建立画像；background 时在后台线程中依次测量"""
+        if not os.path.isdir(weights_root):
+            return
+        paths = [os.path.join(weights_root, f) for f in sorted(os.listdir(weights_root)) if f.endswith('.pt')]
+        if background:
+            threading.Thread(target=lambda: [self._profile_safe(p) for p in paths], name='latency-profile',
+                             daemon=True).start()
+        else:
+            for path in paths:
+                self._profile_safe(path)
+
+    def report(self):
+        with self._lock:
+            return {name: {'options': p['options'], 'tileMs': p['tileMs'], 'measuredAt': p.get('measuredAt')}
+                    for name, p in self._profiles.items()}
+
+    # ---------------- 选择 ----------------
+
+    def choose(self, weights_path, image_shape=None, budget_ms=None, tier=None, variant=None, allow_tiling=True):
+        """
+        选择推理设置
+        :param weights_path: .pt 权重路径（变体由本方法选择）
+        :param image_shape: 输入图片 (高, 宽)，用于判断切片是否有意义并估算切片数
+        :param budget_ms: 延迟预算（毫秒）
+        :param tier: 质量档位：fast 取最快的设置；balanced 以 640 尺寸的耗时为上限（指定变体时为该变体的 640，
+                     否则为 fp32@640）；accurate 不设上限
+        :param variant: 请求显式指定的变体，各档位都只在该变体内选择
+        :param allow_tiling: 是否允许切片推理（摄像头、视频帧不切片）
+        :return: 选择结果字典（modelPath、imgsz、variant、tiling、estimatedMs 等）
+        """
+        name = os.path.basename(weights_path)
+        with self._lock:
+            profile = self._profiles.get(name)
+        if profile is None or profile.get('key') != self._profile_key(weights_path):
+            # 画像尚未建立：本次使用默认设置，后台开始测量
+            self._profile_async(weights_path)
+            return self._default_choice(weights_path, budget_ms, tier, variant, '延迟画像尚未建立，使用默认设置')
+
+        options = self._options(profile, image_shape, variant, allow_tiling)
+        if not options:
+            return self._default_choice(weights_path, budget_ms, tier, variant, '没有可用的测量结果，使用默认设置')
+        limit = self._tier_limit(options, profile, tier, variant)
+        if budget_ms is not None:
+            limit = min(limit, budget_ms * self.safety)
+        fitting = [o for o in options if o['estimatedMs'] <= limit]
+        if fitting:
+            best = max(fitting, key=lambda o: (o['quality'], -o['estimatedMs']))
+            reason = '预算内质量最高的设置'
+        else:
+            best = min(options, key=lambda o: o['estimatedMs'])
+            reason = '没有设置能满足预算，使用最快的设置'
+        BUDGET_CHOICES_TOTAL.inc(weight=name, variant=best['variant'], imgsz=best['imgsz'],
+                                 tiling='on' if best['tiling'] else 'off')
+        return {
+            'weight': name,
+            'modelPath': resolve_variant(weights_path, best['variant']),
+            'imgsz': best['imgsz'],
+            'variant': best['variant'],
+            'tiling': best['tiling'],
+            'estimatedMs': round(best['estimatedMs'], 2),
+            'budgetMs': budget_ms,
+            'tier': tier,
+            'reason': reason
+        }
+
+    def observe(self, choice, actual_ms):
+        """记录实际推理耗时：按滑动平均修正画像中的估计值，并统计超出预算的次数"""
+        name = choice['weight']
+        if choice.get('budgetMs') is not None and actual_ms > choice['budgetMs']:
+            BUDGET_OVERRUN_TOTAL.inc(weight=name)
+        if choice.get('imgsz') is None or choice.get('tiling'):
+            return  # 默认设置与切片推理的耗时不回写（切片耗时随图片尺寸变化）
+        key = f"{choice['variant']}:{choice['imgsz']}"
+        with self._lock:
+            profile = self._profiles.get(name)
+            if profile and key in profile['options']:
+                profile['options'][key] = 0.8 * profile['options'][key] + 0.2 * actual_ms
+
+    # ---------------- 内部方法 ----------------
+
+    @staticmethod
+    def _default_choice(weights_path, budget_ms, tier, variant, reason):
+        model_path = resolve_variant(weights_path, variant)
+        # 请求 int8 但量化模型不存在时 resolve_variant 退回 float32，按实际加载的模型报告变体
+        return {'weight': os.path.basename(weights_path), 'modelPath': model_path,
+                'imgsz': None, 'variant': 'fp32' if model_path == weights_path else 'int8', 'tiling': None,
+                'estimatedMs': None, 'budgetMs': budget_ms, 'tier': tier, 'reason': reason}
+
+    def _options(self, profile, image_shape, variant, allow_tiling):
+        options = []
+        for key, ms in profile['options'].items():
+            option_variant, imgsz = key.split(':')
+            if variant and option_variant != variant:
+                continue
+            imgsz = int(imgsz)
+            # 质量按推理尺寸排序，同尺寸下 fp32 略优于 int8
+            quality = imgsz - (1 if option_variant == 'int8' else 0)
+            options.append({'variant': option_variant, 'imgsz': imgsz, 'tiling': None, 'estimatedMs': ms,
+                            'quality': quality})
+        if allow_tiling and image_shape is not None:
+            height, width = image_shape[:2]
+            if max(width, height) >= TILE_SIZE * 1.5:
+                # 切片只对高分辨率图片有意义：切片数（外加一张缩略全图）× 批量推理下的单张耗时
+                crops = len(make_tiles(width, height, TILE_SIZE, TILE_OVERLAP)) + 1
+                for option_variant, ms in profile['tileMs'].items():
+                    if variant and option_variant != variant:
+                        continue
+                    options.append({'variant': option_variant, 'imgsz': TILE_SIZE,
+                                    'tiling': {'tile_size': TILE_SIZE, 'overlap': TILE_OVERLAP},
+                                    'estimatedMs': crops * ms,
+                                    'quality': max(self.imgsz_candidates) * 2 - (1 if option_variant == 'int8' else 0)})
+        return options
+
+    @staticmethod
+    def _tier_limit(options, profile, tier, variant=None):
+        if tier == 'fast':
+            return min(o['estimatedMs'] for o in options)
+        if tier == 'balanced':
+            return profile['options'].get(f'{variant or "fp32"}:640') or float('inf')
+        return float('inf')
+
+    def _variants(self, weights_path):
+        quantized = int8_path(weights_path)
+        fresh = os.path.exists(quantized) and os.path.getmtime(quantized) >= os.path.getmtime(weights_path)
+        return ['fp32', 'int8'] if fresh else ['fp32']
+
+    def _measure(self, model_path, imgsz, batch):
+        """随机图片推理若干次，返回单张耗时的中位数（毫秒）；首次调用兼作预热"""
+        images = [np.random.randint(0, 255, (imgsz, imgsz, 3), dtype=np.uint8) for _ in range(batch)]
+        kwargs = dict(imgsz=imgsz, conf=0.25, half=False, device='cpu', verbose=False)
+        executor().predict_boxes(model_path, images, **kwargs)
+        samples = []
+        for _ in range(self.runs):
+            start = time.perf_counter()
+            executor().predict_boxes(model_path, images, **kwargs)
+            samples.append((time.perf_counter() - start) * 1000 / batch)
+        return float(np.median(samples))
+
+    @staticmethod
+    def _profile_key(weights_path):
+        """画像只在同一台主机、同一份权重（及 INT8 产物）下有效"""
+        quantized = int8_path(weights_path)
+        return '|'.join([platform.node(), str(os.cpu_count()), str(os.path.getmtime(weights_path)),
+                         str(os.path.getmtime(quantized)) if os.path.exists(quantized) else '-'])
+
+    def _profile_safe(self, weights_path):
+        try:
+            self.profile(weights_path)
+        except Exception as e:
+            print(f"建立 {os.path.basename(weights_path)} 的延迟画像失败: {e}")
+        finally:
+            with self._lock:
+                self._profiling.discard(weights_path)
+
+    def _profile_async(self, weights_path):
+        with self._lock:
+            if weights_path in self._profiling:
+                return
+            self._profiling.add(weights_path)
+        threading.Thread(target=self._profile_safe, args=(weights_path,), name='latency-profile',
+                         daemon=True).start()
+
+    def _load(self):
+        try:
+            with open(self.profile_path, 'r', encoding='utf-8') as f:
+                self._profiles = json.load(f)
+        except (OSError, ValueError):
+            self._profiles = {}
+
+    def _save(self):
+        with self._lock:
+            data = json.dumps(self._profiles, ensure_ascii=False, indent=2)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.profile_path)), exist_ok=True)
+            tmp = self.profile_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp, self.profile_path)
+        except OSError as e:
+            print(f"保存延迟画像失败: {e}")
+
+
+# 全局单例；main.py 启动时在后台为所有权重建立画像
+latency_planner = LatencyPlanner()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# @File : metrics.py
+# 热路径计时与运行指标：分阶段耗时直方图、计数器、仪表盘，以 Prometheus 文本格式通过 /metrics 暴露
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._fn = None
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def set_function(self, fn):
+        """渲染时调用 fn 取值；fn 返回数值，或 {标签值元组: 数值} 字典"""
+        self._fn = fn
+        return self
+
+    def _callback_samples(self):
+        try:
+            value = self._fn()
+        except Exception as e:
+            print(f"采集指标 {self.name} 失败: {e}")
+            return []
+        if isinstance(value, dict):
+            return [(self.name, key if isinstance(key, tuple) else (key,), v) for key, v in value.items()]
+        return [(self.name, (), value)]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for name, key, value in (self._callback_samples() if self._fn else self.samples()):
+            lines.append(f'{name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # 标签值 -> [各桶计数..., 总和, 总数]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, data in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, data):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', key + (bound,), cumulative))
+                samples.append((f'{self.name}_bucket', key + ('+Inf',), data[-1]))
+                samples.append((f'{self.name}_sum', key, round(data[-2], 6)))
+                samples.append((f'{self.name}_count', key, data[-1]))
+        return samples
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for name, key, value in self.samples():
+            labelnames = self.labelnames + ('le',) if name.endswith('_bucket') else self.labelnames
+            lines.append(f'{name}{_format_labels(labelnames, key)} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.log_timings = False  # 为 True 时每个请求输出一行 JSON 格式的分阶段耗时日志
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram('yolo_stage_seconds', '各请求处理阶段耗时（秒）', ('endpoint', 'stage'))
+REQUESTS_TOTAL = metrics.counter('yolo_requests_total', '请求总数', ('endpoint', 'status'))
+REQUEST_SECONDS = metrics.histogram('yolo_request_seconds', '请求总耗时（秒）', ('endpoint',))
+MODEL_LOADS_TOTAL = metrics.counter('yolo_model_loads_total', '模型加载次数', ('weight', 'backend'))
+MODEL_LOAD_SECONDS = metrics.histogram('yolo_model_load_seconds', '模型加载耗时（秒）', ('weight',))
+CACHE_REQUESTS_TOTAL = metrics.counter('yolo_cache_requests_total', '检测结果缓存查询次数', ('cache', 'result'))
+VIDEO_FRAMES_TOTAL = metrics.counter('yolo_video_frames_total', '视频流水线各阶段处理帧数', ('stage',))
+
+
+class RequestTimer:
+    """单个请求的分阶段计时器：同时写入全局直方图，并可输出结构化日志"""
+
+    def __init__(self, endpoint, request_id=None):
+        self.endpoint = endpoint
+        self.request_id = request_id
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, endpoint=self.endpoint, stage=name)
+
+    def finish(self, status=200, **extra):
+        """请求结束：记录总耗时与状态，按需输出一行 JSON 计时日志"""
+        total = time.perf_counter() - self._start
+        REQUESTS_TOTAL.inc(endpoint=self.endpoint, status=status)
+        REQUEST_SECONDS.observe(total, endpoint=self.endpoint)
+        if metrics.log_timings:
+            print(json.dumps({
+                'endpoint': self.endpoint,
+                'requestId': self.request_id,
+                'status': status,
+                'totalMs': round(total * 1000, 2),
+                'stagesMs': {k: round(v * 1000, 2) for k, v in self.stages.items()},
+                **extra
+            }, ensure_ascii=False))
+        return total
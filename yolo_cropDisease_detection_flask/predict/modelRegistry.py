@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# @File : modelRegistry.py
+# 进程级模型注册表：同一权重文件只加载一次，所有接口共享同一个已融合、已预热的模型
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from predict import backends
+from predict.metrics import MODEL_LOADS_TOTAL, MODEL_LOAD_SECONDS
+
+
+class ModelEntry:
+    """注册表中的单个模型条目"""
+
+    def __init__(self, path, mtime, model, size_bytes, backend):
+        self.path = path
+        self.mtime = mtime
+        self.model = model
+        self.size_bytes = size_bytes
+        self.backend = backend  # 实际使用的推理后端（backends.Backend）
+        # ultralytics 的 predictor 不是线程安全的，同一模型的推理需要串行
+        self.lock = threading.RLock()
+
+
+class ModelRegistry:
+    def __init__(self, max_models=8, max_memory_mb=2048, warmup_imgsz=640, backend='auto'):
+        """
+        初始化模型注册表
+        :param max_models: 最多同时缓存的模型数量
+        :param max_memory_mb: 所有模型参数占用内存上限（MB），超出后按 LRU 淘汰
+        :param warmup_imgsz: 预热时使用的输入尺寸
+        :param backend: 推理后端（auto / openvino / onnx / torchscript / pytorch），auto 时启动测速取最快
+        """
+        self.backend = backend
+        self.max_models = max_models
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.warmup_imgsz = warmup_imgsz
+        self._entries = OrderedDict()  # 绝对路径 -> ModelEntry，按最近使用排序
+        self._lock = threading.Lock()
+        self._loading = {}  # 绝对路径 -> [加载锁, 等待线程数]，避免同一权重被并发重复加载；无人等待时删除
+
+    def get(self, weights_path):
+        """获取模型（不加锁），权重文件在磁盘上被修改后会自动重新加载"""
+        return self._get_entry(weights_path).model
+
+    @contextmanager
+    def acquire(self, weights_path):
+        """获取模型并持有该模型的推理锁，适合直接调用 model.predict 的场景"""
+        entry = self._get_entry(weights_path)
+        with entry.lock:
+            yield entry.model
+
+    def predict_batch(self, weights_path, images, **kwargs):
+        """
+        对一组图片执行一次（或按后端 batch 上限拆分的若干次）前向推理，返回 Results 列表
+        """
+        entry = self._get_entry(weights_path)
+        max_batch = entry.backend.max_batch or len(images)
+        results = []
+        with entry.lock:
+            for i in range(0, len(images), max_batch):
+                results.extend(entry.model.predict(source=images[i:i + max_batch], **kwargs))
+        return results
+
+    def predict_boxes(self, weights_path, images, **kwargs):
+        """批量推理，只返回每张图片的检测框 ndarray(N, 6)：x1, y1, x2, y2, conf, cls（与进程池接口一致）"""
+        return [result.boxes.data.cpu().numpy() for result in self.predict_batch(weights_path, images, **kwargs)]
+
+    def names(self, weights_path):
+        """类别号 -> 类别名"""
+        return self._get_entry(weights_path).model.names
+
+    def backend_of(self, weights_path):
+        """该权重当前使用的推理后端名称"""
+        return self._get_entry(weights_path).backend.name
+
+    def warm_up(self, weights_root):
+        """启动时预加载并预热目录下的所有 .pt 权重"""
+        if not os.path.isdir(weights_root):
+            print(f"模型目录不存在，跳过预热: {weights_root}")
+            return []
+        loaded = []
+        for name in sorted(os.listdir(weights_root)):
+            if not name.endswith('.pt'):
+                continue
+            try:
+                self._get_entry(os.path.join(weights_root, name))
+                loaded.append(name)
+            except Exception as e:
+                print(f"预热模型 {name} 失败: {e}")
+        print(f"模型预热完成: {loaded}")
+        return loaded
+
+    def evict(self, weights_path):
+        """手动移除某个模型"""
+        with self._lock:
+            self._entries.pop(os.path.abspath(weights_path), None)
+
+    def stats(self):
+        """返回当前缓存状态"""
+        with self._lock:
+            return {
+                'models': {os.path.basename(p): e.backend.name for p, e in self._entries.items()},
+                'memory_mb': round(sum(e.size_bytes for e in self._entries.values()) / 1024 / 1024, 2),
+                'max_models': self.max_models,
+                'max_memory_mb': round(self.max_memory_bytes / 1024 / 1024, 2)
+            }
+
+    def _get_entry(self, weights_path):
+        path = os.path.abspath(weights_path)
+        mtime = os.path.getmtime(path)  # 文件不存在时直接抛出 FileNotFoundError
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.mtime == mtime:
+                self._entries.move_to_end(path)
+                return entry
+            loading = self._loading.setdefault(path, [threading.Lock(), 0])
+            loading[1] += 1
+
+        try:
+            with loading[0]:
+                # 双重检查：等待期间可能已被其他线程加载
+                with self._lock:
+                    entry = self._entries.get(path)
+                    if entry is not None and entry.mtime == mtime:
+                        self._entries.move_to_end(path)
+                        return entry
+                if entry is not None:
+                    print(f"检测到权重文件已更新，重新加载: {path}")
+                entry = self._load(path, mtime)
+                with self._lock:
+                    self._entries[path] = entry
+                    self._entries.move_to_end(path)
+                    self._enforce_limits()
+                return entry
+        finally:
+            # 加载成功或失败后，最后一个等待的线程删除加载锁，_loading 不会随权重文件数增长
+            with self._lock:
+                loading[1] -= 1
+                if loading[1] == 0 and self._loading.get(path) is loading:
+                    del self._loading[path]
+
+    def _load(self, path, mtime):
+        """
+        加载模型：按配置选择推理后端（首次使用时导出并缓存在权重旁边），
+        PyTorch 后端强制 CPU + float32 并融合 Conv+BN；加载后用空白图预热一次
+        """
+        print(f"加载模型: {path}")
+        start = time.time()
+        backend, model = backends.load_fastest(path, self.backend, self.warmup_imgsz)
+        weight = os.path.basename(path)
+        MODEL_LOADS_TOTAL.inc(weight=weight, backend=backend.name)
+        MODEL_LOAD_SECONDS.observe(time.time() - start, weight=weight)
+        print(f"{weight} 使用推理后端: {backend.name}")
+        if backend.export_format is None:
+            size = self._model_size(model)
+        else:
+            size = backends.artifact_size(backend.artifact_path(path))
+        return ModelEntry(path, mtime, model, size, backend)
+
+    def _enforce_limits(self):
+        """按 LRU 淘汰超出数量或内存上限的模型（至少保留最近使用的一个）"""
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_models or
+                sum(e.size_bytes for e in self._entries.values()) > self.max_memory_bytes):
+            path, _ = self._entries.popitem(last=False)
+            print(f"模型缓存已满，淘汰: {path}")
+
+    @staticmethod
+    def _model_size(model):
+        """估算模型参数和缓冲区占用的字节数"""
+        try:
+            module = model.model
+            params = sum(p.numel() * p.element_size() for p in module.parameters())
+            buffers = sum(b.numel() * b.element_size() for b in module.buffers())
+            return params + buffers
+        except Exception:
+            return 0
+
+
+# 全局单例，所有接口共享
+model_registry = ModelRegistry()
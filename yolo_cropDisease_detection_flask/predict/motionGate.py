@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# @File : motionGate.py
+# 运动门控：大棚固定摄像头的画面大部分时间是静止的，推理前先在缩略灰度图上做帧差（或感知哈希）比较，
+# 与上一次推理时的画面相比没有明显变化就直接复用上一次的检测结果，并定期强制刷新一次
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from predict.metrics import metrics
+
+METHODS = ('diff', 'hash')
+
+MOTION_GATE_FRAMES_TOTAL = metrics.counter('yolo_motion_gate_frames_total', '运动门控的判定结果（推理 / 复用）',
+                                           ('decision', 'reason'))
+
+
+def parse_motion_gate(value, default=None):
+    """
+    解析请求参数中的门控设置：'true' 使用默认帧差门控，'diff:0.03' 指定变化像素比例阈值，
+    'hash:8' 指定哈希汉明距离阈值，第三段为强制刷新间隔（秒），如 'diff:0.03:2'；'false' 关闭
+    :return: MotionGate 的参数字典或 None；参数无效时抛出 ValueError
+    """
+    if value is None or value == '':
+        return default
+    if isinstance(value, dict):
+        return dict(value)
+    text = str(value).strip().lower()
+    if text in ('false', '0', 'off', 'no'):
+        return None
+    if text in ('true', 'on', 'yes'):
+        return default or {'method': 'diff'}
+    parts = text.split(':')
+    if parts[0] not in METHODS:
+        raise ValueError(f"未知的门控方式: {parts[0]}，可选 {METHODS}")
+    config = {'method': parts[0]}
+    try:
+        if len(parts) > 1 and parts[1]:
+            config['threshold'] = float(parts[1])
+        if len(parts) > 2 and parts[2]:
+            config['refresh_seconds'] = float(parts[2])
+    except ValueError:
+        raise ValueError(f"无效的门控参数: {value}，格式如 'diff:0.03:2'")
+    return config
+
+
+def dhash(gray):
+    """差值哈希：9×8 缩略图相邻像素比较得到 64 位指纹"""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+
+class MotionGate:
+    def __init__(self, method='diff', threshold=None, pixel_threshold=25, size=(64, 48), refresh_seconds=1.0,
+                 refresh_frames=None, redraw=False):
+        """
+        初始化运动门控（每个推理循环一个实例）
+        :param method: 'diff' 帧差（变化像素比例）或 'hash' 感知哈希（汉明距离）
+        :param threshold: diff 为变化像素比例阈值（默认 0.02），hash 为汉明距离阈值（默认 6）
+        :param pixel_threshold: diff 方式下单个像素灰度变化超过该值才算变化（过滤传感器噪声）
+        :param size: 比较用缩略图尺寸 (宽, 高)
+        :param refresh_seconds: 距上次推理超过该时间强制推理一次（光照缓慢变化、病斑缓慢扩大时不会一直复用）
+        :param refresh_frames: 距上次推理超过该帧数强制推理一次，为 None 时只按时间刷新
+        :param redraw: 复用时是否把上次的检测框重新画到当前帧上（画面保持实时），否则直接复用上次的标注帧
+        """
+        if method not in METHODS:
+            raise ValueError(f"未知的门控方式: {method}，可选 {METHODS}")
+        self.method = method
+        self.threshold = threshold if threshold is not None else (0.02 if method == 'diff' else 6)
+        self.pixel_threshold = pixel_threshold
+        self.size = tuple(size)
+        self.refresh_seconds = refresh_seconds
+        self.refresh_frames = refresh_frames
+        self.redraw = redraw
+        self._reference = None  # 上一次推理时画面的缩略图（或哈希）
+        self._last_infer = 0.0
+        self._since_infer = 0
+        self._lock = threading.Lock()
+        self._counts = {'inferred': 0, 'skipped': 0}
+        self._reasons = {}
+        self._check_seconds = 0.0
+
+    def check(self, frame):
+        """
+        判断该帧是否需要推理
+        :return: (是否推理, 原因)；原因为 first / motion / refresh / static
+        """
+        start = time.perf_counter()
+        signature = self._signature(frame)
+        now = time.time()
+        if self._reference is None:
+            reason = 'first'
+        elif self.refresh_seconds and now - self._last_infer >= self.refresh_seconds:
+            reason = 'refresh'
+        elif self.refresh_frames and self._since_infer + 1 >= self.refresh_frames:
+            reason = 'refresh'
+        elif self._changed(signature):
+            reason = 'motion'
+        else:
+            reason = 'static'
+        infer = reason != 'static'
+        if infer:
+            # 参考画面只在推理时更新：缓慢的累积变化最终也会超过阈值
+            self._reference = signature
+            self._last_infer = now
+            self._since_infer = 0
+        else:
+            self._since_infer += 1
+        with self._lock:
+            self._counts['inferred' if infer else 'skipped'] += 1
+            self._reasons[reason] = self._reasons.get(reason, 0) + 1
+            self._check_seconds += time.perf_counter() - start
+        MOTION_GATE_FRAMES_TOTAL.inc(decision='inferred' if infer else 'skipped', reason=reason)
+        return infer, reason
+
+    def stats(self):
+        with self._lock:
+            total = self._counts['inferred'] + self._counts['skipped']
+            return {
+                'method': self.method,
+                'threshold': self.threshold,
+                'inferred': self._counts['inferred'],
+                'skipped': self._counts['skipped'],
+                'skipRatio': round(self._counts['skipped'] / total, 3) if total else 0.0,
+                'reasons': dict(self._reasons),
+                'checkMs': round(self._check_seconds / total * 1000, 3) if total else 0.0
+            }
+
+    def _signature(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if self.method == 'hash':
+            return dhash(gray)
+        thumb = cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(thumb, (3, 3), 0)
+
+    def _changed(self, signature):
+        if self.method == 'hash':
+            distance = int(np.unpackbits(np.bitwise_xor(signature, self._reference)).sum())
+            return distance > self.threshold
+        changed = np.count_nonzero(cv2.absdiff(signature, self._reference) > self.pixel_threshold)
+        return changed / signature.size > self.threshold
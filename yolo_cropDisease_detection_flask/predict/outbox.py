@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# @File : outbox.py
+# 异步上传/记录发件箱：结果文件上传和 *Records 记录保存交给后台线程，使用连接池复用 HTTP 连接，
+# 失败按退避重试；所有待发任务先落盘到本地 spool 目录，Spring Boot 重启或本进程重启后都能继续发送
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from predict.metrics import metrics
+
+OUTBOX_JOBS_TOTAL = metrics.counter('yolo_outbox_jobs_total', '发件箱任务结果', ('type', 'result'))
+OUTBOX_BATCH_SIZE = metrics.histogram('yolo_outbox_record_batch_size', '每次 HTTP 请求保存的记录条数',
+                                      buckets=(1, 2, 5, 10, 20, 50))
+
+
+class Outbox:
+    def __init__(self, backend_url='http://localhost:9999', spool_dir='./runs/outbox', workers=2, max_retries=8,
+                 retry_backoff=2.0, batch_size=20, batch_wait=0.5, pool_size=10, timeout=30):
+        """
+        初始化发件箱
+        :param backend_url: Spring Boot 后端地址，文件上传到 <backend_url>/files/upload
+        :param spool_dir: 本地 spool 目录（pending 待发送、files 待上传文件、failed 超过重试次数）
+        :param workers: 发送线程数
+        :param max_retries: 最大重试次数，超过后移入 failed 目录
+        :param retry_backoff: 重试退避基数（秒），第 n 次重试等待 backoff * 2^(n-1)，最长 5 分钟
+        :param batch_size: 同一接口的记录每批最多条数（合并 POST 到 <url>/batch，后端在一个事务中插入）
+        :param batch_wait: 记录凑批的最长等待时间（秒）
+        :param pool_size: HTTP 连接池大小
+        :param timeout: 单次请求超时（秒）
+        """
+        self.backend_url = backend_url
+        self.spool_dir = spool_dir
+        self.pending_dir = os.path.join(spool_dir, 'pending')
+        self.files_dir = os.path.join(spool_dir, 'files')
+        self.failed_dir = os.path.join(spool_dir, 'failed')
+        for directory in (self.pending_dir, self.files_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._queue = queue.Queue()
+        self._batch_unsupported = set()  # 不支持 <url>/batch 的记录接口（旧版后端），改为逐条发送
+        self._callbacks = {}  # 任务 ID -> 上传成功回调（仅内存中，进程重启后不恢复）
+        self._started = False
+        self._lock = threading.Lock()
+        self._workers = workers
+
+    def start(self):
+        """启动发送线程，并把上次未发送完的任务重新入队"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for name in sorted(os.listdir(self.pending_dir)):
+            if name.endswith('.json'):
+                self._queue.put(name[:-5])
+        for _ in range(self._workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def post_record(self, url, record):
+        """异步保存一条记录（POST JSON 到 url）"""
+        return self._submit({'type': 'record', 'url': url, 'record': record})
+
+    def upload_then_record(self, data, filename, record_url=None, record=None, field=None, on_uploaded=None):
+        """
+        异步上传文件，成功后把返回的地址写入 record[field] 再保存记录
+        :param data: 文件内容（bytes）或本地文件路径（会被移动到 spool 目录）
+        :param filename: 上传时使用的文件名
+        :param record_url: 记录接口地址，为 None 时只上传
+        :param record: 记录内容
+        :param field: 上传地址写入记录的字段名（如 outImg / outVideo）
+        :param on_uploaded: 上传成功后的回调，参数为上传地址（进程重启后恢复的任务不会回调）
+        """
+        job_id = uuid.uuid4().hex
+        spool_file = os.path.join(self.files_dir, f'{job_id}_{os.path.basename(filename)}')
+        if isinstance(data, (bytes, bytearray)):
+            with open(spool_file, 'wb') as f:
+                f.write(data)
+        else:
+            shutil.move(data, spool_file)
+        return self._submit({
+            'type': 'upload', 'file': spool_file, 'filename': filename,
+            'record_url': record_url, 'record': record, 'field': field
+        }, job_id, on_uploaded)
+
+    def pending(self):
+        """尚未发送成功的任务数"""
+        return len([n for n in os.listdir(self.pending_dir) if n.endswith('.json')])
+
+    # ---------------- 内部实现 ----------------
+
+    def _submit(self, job, job_id=None, callback=None):
+        self.start()  # 先启动（会恢复磁盘上的旧任务），再写入新任务，避免新任务被重复入队
+        job_id = job_id or uuid.uuid4().hex
+        job.setdefault('attempts', 0)
+        job['created_at'] = time.time()
+        self._write_job(job_id, job)
+        if callback:
+            self._callbacks[job_id] = callback
+        self._queue.put(job_id)
+        return job_id
+
+    @property
+    def upload_url(self):
+        return f'{self.backend_url}/files/upload'
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            job = self._read_job(job_id)
+            if job is None:
+                continue
+            if job['type'] == 'record':
+                self._send_records(job_id, job)
+            else:
+                self._send_upload(job_id, job)
+
+    def _send_upload(self, job_id, job):
+        try:
+            with open(job['file'], 'rb') as f:
+                response = self.session.post(self.upload_url, files={'file': (job['filename'], f)},
+                                             timeout=self.timeout)
+            response.raise_for_status()
+            url = response.json().get('data', '')
+        except Exception as e:
+            self._retry(job_id, job, e)
+            return
+        OUTBOX_JOBS_TOTAL.inc(type='upload', result='ok')
+        callback = self._callbacks.pop(job_id, None)
+        if callback:
+            try:
+                callback(url)
+            except Exception as e:
+                print(f"上传回调出错: {e}")
+        if job.get('record_url'):
+            record = dict(job.get('record') or {})
+            if job.get('field'):
+                record[job['field']] = url
+            self.post_record(job['record_url'], record)
+        self._remove_job(job_id, job)
+
+    def _send_records(self, job_id, job):
+        """把同一接口排队中的记录合并为一批发送到 <url>/batch；只有一条或接口不支持批量时逐条发送"""
+        url = job['url']
+        batch = [(job_id, job)]
+        deadline = time.time() + self.batch_wait
+        deferred = []
+        while len(batch) < self.batch_size and time.time() < deadline:
+            try:
+                other_id = self._queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            other = self._read_job(other_id)
+            if other is None:
+                continue
+            if other['type'] == 'record' and other['url'] == url:
+                batch.append((other_id, other))
+            else:
+                deferred.append(other_id)
+        for other_id in deferred:
+            self._queue.put(other_id)
+
+        if len(batch) > 1 and url not in self._batch_unsupported:
+            try:
+                response = self.session.post(f'{url}/batch', json=[j['record'] for _, j in batch],
+                                             timeout=self.timeout)
+            except Exception as e:
+                for other_id, other in batch:
+                    self._retry(other_id, other, e)
+                return
+            if response.ok:
+                OUTBOX_JOBS_TOTAL.inc(len(batch), type='record', result='ok')
+                OUTBOX_BATCH_SIZE.observe(len(batch))
+                for other_id, other in batch:
+                    self._remove_job(other_id, other)
+                return
+            if response.status_code in (404, 405):
+                self._batch_unsupported.add(url)
+            elif response.status_code >= 500:
+                error = requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+                for other_id, other in batch:
+                    self._retry(other_id, other, error)
+                return
+            # 其余 4xx（某条记录格式不被接受）：逐条发送，只让有问题的记录进入重试，不拖累整批
+
+        for other_id, other in batch:
+            self._send_record(other_id, other)
+
+    def _send_record(self, job_id, job):
+        """发送单条记录，复用连接池中的连接；失败只重试这一条"""
+        try:
+            response = self.session.post(job['url'], json=job['record'], timeout=self.timeout)
+            response.raise_for_status()
+            OUTBOX_JOBS_TOTAL.inc(type='record', result='ok')
+            OUTBOX_BATCH_SIZE.observe(1)
+            self._remove_job(job_id, job)
+        except Exception as e:
+            self._retry(job_id, job, e)
+
+    def _retry(self, job_id, job, error):
+        job['attempts'] += 1
+        if job['attempts'] > self.max_retries:
+            print(f"发件箱任务 {job_id} 重试 {self.max_retries} 次仍失败，移入 failed: {error}")
+            OUTBOX_JOBS_TOTAL.inc(type=job['type'], result='failed')
+            job['error'] = str(error)
+            self._write_job(job_id, job)  # failed 中保留最终的重试次数和最后一次错误，便于排查
+            os.replace(self._job_path(job_id), os.path.join(self.failed_dir, f'{job_id}.json'))
+            return
+        delay = min(300.0, self.retry_backoff * (2 ** (job['attempts'] - 1)))
+        print(f"发件箱任务 {job_id} 发送失败，{delay:.0f} 秒后第 {job['attempts']} 次重试: {error}")
+        OUTBOX_JOBS_TOTAL.inc(type=job['type'], result='retry')
+        self._write_job(job_id, job)
+        timer = threading.Timer(delay, self._queue.put, args=(job_id,))
+        timer.daemon = True
+        timer.start()
+
+    def _job_path(self, job_id):
+        return os.path.join(self.pending_dir, f'{job_id}.json')
+
+    def _write_job(self, job_id, job):
+        path = self._job_path(job_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)  # 原子写入，进程中断也不会留下半个任务文件
+
+    def _read_job(self, job_id):
+        try:
+            with open(self._job_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"读取发件箱任务 {job_id} 失败: {e}")
+            return None
+
+    def _remove_job(self, job_id, job):
+        for path in (self._job_path(job_id), job.get('file')):
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"删除发件箱文件 {path} 失败: {e}")
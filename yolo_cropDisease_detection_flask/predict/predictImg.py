@@ -4,114 +4,274 @@
 # @File : predictImg.py
 import json
 import time
-import torch  # 新增：导入torch，用于控制精度
-from ultralytics import YOLO
+import cv2
+import numpy as np
+from predict.inputFetcher import input_fetcher, decode_image
+from predict.workerPool import executor
+from predict.metrics import RequestTimer
+from predict.tiling import tiled_predict
+from predict.renderer import get_renderer
+from predict.weightsManifest import weights_manifest
+from predict.latencyBudget import latency_planner
+
+
+def load_image_bytes(source):
+    """读取图片原始字节，支持 http(s) 地址和允许目录下的本地路径（含中文路径），远程地址经连接池获取"""
+    return input_fetcher.fetch(source)
+
+
+def load_image(source):
+    """读取图片为 BGR ndarray"""
+    return decode_image(load_image_bytes(source), source)
+
+
+def build_img_record(params, result):
+    """
+    按 ImgRecords 实体的格式组装图片识别记录（接口上传记录与离线批量导出共用）；
+    字段与 PredictionController 插入的记录一致：conf / confidence / allTime 为数值（实体中是 BigDecimal），
+    label 为逗号分隔的标签，confidence 取第一个目标的置信度
+    :param params: username、weight、conf、startTime、inputImg、kind
+    :param result: 含 labels、confidences（0~1）、allTime（秒）的预测结果
+    """
+    labels = result.get("labels") or []
+    confidences = result.get("confidences") or []
+    return {
+        "username": params.get("username"),
+        "weight": params.get("weight"),
+        "conf": float(params.get("conf") or 0.0),  # 返回数值而非字符串
+        "startTime": params.get("startTime"),
+        "inputImg": params.get("inputImg"),
+        "kind": params.get("kind"),
+        "label": ",".join(labels) if isinstance(labels, list) else str(labels),
+        "confidence": float(confidences[0]) if confidences else 0.0,  # 返回数值而非字符串
+        "allTime": float(result.get("allTime") or 0.0)  # 返回数值而非字符串
+    }
 
 
 class ImagePredictor:
-    def __init__(self, weights_path, img_path, kind, save_path="./runs/result.jpg", conf=0.5):
+    def __init__(self, weights_path, img_path, kind, save_path="./runs/result.jpg", conf=0.5, engine=None,
+                 cache=None, imgsz=None, timer=None, tiling=None, font_path=None, budget=None, image_bytes=None):
         """
         初始化ImagePredictor类
         :param weights_path: 权重文件路径
         :param img_path: 输入图像路径
-        :param save_path: 结果保存路径
+        :param kind: 作物种类（rice / corn / ...），权重清单中没有该权重时用于选择类别名称表
+        :param save_path: 结果保存路径，为 None 时只在内存中编码结果图（见 result_image）
         :param conf: 置信度阈值
+        :param engine: 微批推理引擎（BatchInferenceEngine），为空时单独推理
+        :param cache: 检测结果缓存（DetectionCache），同一图片换 conf 重复提交时直接过滤缓存框
+        :param imgsz: 推理尺寸，为 None 时使用模型默认值
+        :param timer: 分阶段计时器（RequestTimer），为空时自动创建
+        :param font_path: 绘制中文标签使用的 TrueType 字体，为空时只绘制标签的英文部分
+        :param tiling: 切片推理设置 {'tile_size', 'overlap'}，为 None 时整图推理；小图自动退回整图推理
+        :param budget: 延迟预算 {'budget_ms', 'tier', 'variant', 'allow_tiling'}，设置后按本机延迟画像选择
+                       推理尺寸、模型变体和切片设置（覆盖 imgsz / tiling），weights_path 需为 .pt 权重
+        :param image_bytes: 已读取的图片原始字节（如作物自动路由时已下载），传入时不再重新下载
         """
-        # 核心修改1：加载模型时强制使用CPU + 单精度(float32)
-        self.model = YOLO(weights_path)
-        self.model.to(device='cpu', dtype=torch.float32)  # 强制CPU运行，单精度浮点
-        
+        # 核心修改1：模型从全局注册表获取（已强制CPU + float32、融合并预热），不再每次请求重新加载
+        self.weights_path = weights_path
+
         self.conf = conf
         self.img_path = img_path
         self.save_path = save_path
-        self.kind = {
-            'rice': ['Brown_Spot（褐斑病）', 'Rice_Blast（稻瘟病）', 'Bacterial_Blight（细菌性叶枯病）'],
-            'corn': ['blight（疫病）', 'common_rust（普通锈病）', 'gray_spot（灰斑病）', 'health（健康）'],
-            'strawberry': ['Angular Leafspot（角斑病）', ' Anthracnose Fruit Rot（炭疽果腐病）', 'Blossom Blight（花枯病）', 'Gray Mold（灰霉病）', 'Leaf Spot（叶斑病）', 'Powdery Mildew Fruit（白粉病果）', 'Powdery Mildew Leaf（白粉病叶）'],
-            'tomato': ['Early Blight（早疫病）', 'Healthy（健康）', 'Late Blight（晚疫病）', 'Leaf Miner（潜叶病）', 'Leaf Mold（叶霉病）', 'Mosaic Virus（花叶病毒）', 'Septoria（壳针孢属）', 'Spider Mites（蜘蛛螨）', 'Yellow Leaf Curl Virus（黄化卷叶病毒	）']
-        }
-        self.labels = self.kind[kind]
+        self.engine = engine
+        self.cache = cache
+        self.imgsz = imgsz
+        self.cache_hit = False
+        self.timer = timer or RequestTimer('image')
+        self.timing = {}  # 微批推理的排队/推理耗时
+        self.tiling = tiling
+        self.tiling_report = None  # 切片推理的切片数、耗时与多检出数量
+        self.result_image = None  # 内存中的标注结果图（JPEG 字节）
+        self.jpeg_quality = 90
+        self.font_path = font_path
+        self.budget = budget
+        self.image_bytes = image_bytes
+        self.latency_choice = None  # 延迟预算模式下选择的设置、预计耗时与实际耗时
+        # 类别标签按模型头的类别顺序从权重清单读取（带中文名称），清单尚未建好时按作物种类的名称表
+        self.labels = weights_manifest.labels(weights_path, kind)
 
     def predict(self):
         """
         预测图像并保存结果
         """
+        if self.budget is not None:
+            results = self._predict_in_memory()
+            self._observe_latency(results)
+            return results
+        if self.engine is not None or self.cache is not None or self.tiling:
+            return self._predict_in_memory()
+
+        # 图片在内存中下载解码后再交给模型，不再由 ultralytics 按地址自行下载到临时文件
+        with self.timer.stage('download'):
+            data = self.image_bytes if self.image_bytes is not None else load_image_bytes(self.img_path)
+        with self.timer.stage('decode'):
+            image = decode_image(data, self.img_path)
         start_time = time.time()  # 开始计时
 
-        # 核心修改2：关闭half=True（CPU不支持），强制device=cpu
-        results = self.model(
-            source=self.img_path, 
-            conf=self.conf, 
+        # 核心修改2：关闭half=True（CPU不支持），强制device=cpu；启用进程池时在推理进程中执行
+        boxes = executor().predict_boxes(
+            self.weights_path, [image],
+            conf=self.conf,
             half=False,  # 关键：关闭半精度，CPU仅支持全精度
-            save_conf=True,
-            device='cpu'  # 明确指定CPU
-        )
+            device='cpu',  # 明确指定CPU
+            verbose=False
+        )[0]
+        results = [(image, boxes)]
 
         end_time = time.time()  # 结束计时
         elapsed_time = end_time - start_time  # 计算用时
+        return self.postprocess(results, elapsed_time)
+
+    def _predict_in_memory(self):
+        """内存解码 + 结果缓存 + 微批推理的预测路径"""
+        with self.timer.stage('download'):
+            data = self.image_bytes if self.image_bytes is not None else load_image_bytes(self.img_path)
+        with self.timer.stage('decode'):
+            image = decode_image(data, self.img_path)
+        if self.budget is not None:
+            self._apply_budget(image)
+        start_time = time.time()
+
+        boxes = None
+        if self.cache is not None:
+            with self.timer.stage('cache_lookup'):
+                # 切片推理的结果与整图推理不同，缓存键中带上切片设置
+                variant = self.imgsz
+                if self.tiling:
+                    variant = f"{self.imgsz or 'default'}:tile{self.tiling['tile_size']}-{self.tiling['overlap']}"
+                key = self.cache.make_key(data, self.weights_path, variant)
+                boxes = self.cache.get(key)
+        self.cache_hit = boxes is not None
+
+        # 写缓存时以较低的基础阈值推理，之后任意更高的 conf 都能由缓存框过滤得到
+        infer_conf = min(self.conf, self.cache.base_conf) if self.cache is not None else self.conf
+        if boxes is None and self.tiling:
+            with self.timer.stage('tiled_inference'):
+                boxes, self.tiling_report = tiled_predict(self.weights_path, image, infer_conf,
+                                                          self.tiling['tile_size'], self.tiling['overlap'],
+                                                          report_conf=self.conf)
+            if boxes is not None:
+                if self.cache is not None:
+                    self.cache.put(key, boxes)
+                else:
+                    boxes = boxes[boxes[:, 4] >= self.conf]
+                    return self.postprocess([self.build_result(image, boxes)], time.time() - start_time)
+
+        if boxes is None:
+            with self.timer.stage('inference'):
+                result = self._infer(image, infer_conf)
+            if self.timing:
+                self.timer.record('batch_queue', self.timing['queueTime'])
+            if self.cache is None:
+                return self.postprocess([result], time.time() - start_time)
+            boxes = result[1]
+            self.cache.put(key, boxes)
 
+        result = self.build_result(image, self.cache.filter(boxes, self.conf))
+        return self.postprocess([result], time.time() - start_time)
+
+    def _apply_budget(self, image):
+        """按延迟预算和图片尺寸选择推理设置（需要图片尺寸判断切片是否有意义，因此在解码后选择）"""
+        choice = latency_planner.choose(self.weights_path, image.shape[:2], self.budget.get('budget_ms'),
+                                        self.budget.get('tier'), self.budget.get('variant'),
+                                        self.budget.get('allow_tiling', True))
+        self.weights_path = choice['modelPath']
+        self.imgsz = choice['imgsz']
+        self.tiling = choice['tiling']
+        self.latency_choice = choice
+
+    def _observe_latency(self, results):
+        """记录实际推理耗时；缓存命中时没有推理，不回写画像"""
+        if self.latency_choice is None:
+            return
+        actual_ms = float(results.get('allTime', 0.0)) * 1000
+        self.latency_choice['actualMs'] = round(actual_ms, 2)
+        if not self.cache_hit:
+            latency_planner.observe(self.latency_choice, actual_ms)
+
+    def _infer(self, image, conf):
+        """对单张已解码图片推理，优先交给微批引擎与并发请求合并；返回 (原图, 检测框)"""
+        if self.engine is not None:
+            result, self.timing = self.engine.infer(self.weights_path, conf, image, imgsz=self.imgsz)
+            return result
+        kwargs = dict(conf=conf, half=False, device='cpu', verbose=False)
+        if self.imgsz:
+            kwargs['imgsz'] = self.imgsz
+        return image, executor().predict_boxes(self.weights_path, [image], **kwargs)[0]
+
+    def build_result(self, image, boxes):
+        """由原图和 (N, 6) 检测框数组构造待后处理的检测结果，不再构造 ultralytics Results"""
+        return image, np.ascontiguousarray(boxes, dtype=np.float32).reshape(-1, 6)
+
+    def postprocess(self, results, elapsed_time, save=True):
+        """
+        把推理结果整理为标签/置信度字典
+        :param results: ultralytics Results 列表，或 build_result 返回的 (原图, 检测框) 列表
+        :param elapsed_time: 推理耗时（秒）
+        :param save: 是否输出标注后的图片（写入 save_path，或 save_path 为 None 时编码到 result_image）
+        """
         # 核心修改3：返回数值型的耗时/置信度，适配后端BigDecimal接收
         all_results = {
             'labels': [],  # 存储所有标签
             'confidences': [],  # 存储数值型置信度（如0.95），而非字符串
             'allTime': elapsed_time  # 返回浮点数（秒），而非带单位的字符串
         }
+        failed = {
+            'labels': '预测失败',
+            'confidences': 0.0,  # 数值型默认值
+            'allTime': elapsed_time
+        }
 
         try:
             # 检查是否有检测结果
             if len(results) == 0:
                 print("未检测到目标，请换一张图片。")
-                all_results = {
-                    'labels': '预测失败',
-                    'confidences': 0.0,  # 数值型默认值
-                    'allTime': elapsed_time
-                }
-                return all_results
+                return failed
 
+            label_names = np.asarray(self.labels, dtype=object)
             for result in results:
-                # 提取置信度和标签
-                confidences = result.boxes.conf if hasattr(result.boxes, 'conf') else []
-                labels = result.boxes.cls if hasattr(result.boxes, 'cls') else []
-
-                # 检查 confidences 和 labels 是否为空
-                if confidences.numel() == 0 or labels.numel() == 0:
+                image, boxes = result if isinstance(result, tuple) else (result.orig_img,
+                                                                         result.boxes.data.cpu().numpy())
+                if len(boxes) == 0:
                     print("未检测到目标，请换一张图片。")
-                    all_results = {
-                        'labels': '预测失败',
-                        'confidences': 0.0,  # 数值型默认值
-                        'allTime': elapsed_time
-                    }
-                    return all_results
-
-                # 获取标签名称和对应置信度（转为数值型）
-                label_names = [self.labels[int(cls)] for cls in labels]
-                # 核心修改4：置信度转为浮点数（如tensor(0.95) → 0.95）
-                conf_values = [float(conf) for conf in confidences]
-                
-                predictions = list(zip(label_names, conf_values))
-
-                # 将每个结果保存到字典中
-                for label, conf in predictions:
-                    all_results['labels'].append(label)
-                    all_results['confidences'].append(conf)  # 存储数值，而非百分比字符串
-
-                result.save(filename=self.save_path)  # 保存结果
+                    return failed
+
+                # 核心修改4：按数组索引一次取出标签名称和数值型置信度（如 0.95），不再逐框转换
+                all_results['labels'].extend(label_names[boxes[:, 5].astype(np.int64)].tolist())
+                all_results['confidences'].extend(boxes[:, 4].astype(float).tolist())
+
+                if save:
+                    if self.save_path:
+                        with self.timer.stage('save'):
+                            # imencode + tofile 兼容中文路径
+                            self.encode_result((image, boxes), buffer_only=True).tofile(self.save_path)
+                    else:
+                        with self.timer.stage('encode'):
+                            self.result_image = self.encode_result((image, boxes))  # 直接编码到内存，不写磁盘
 
             return all_results  # 返回包含标签和置信度的字典
         except Exception as e:
             # 如果预测过程中发生异常，打印错误信息并返回空结果
             print(f"预测过程中发生异常: {e}")
-            all_results = {
-                'labels': '预测失败',
-                'confidences': 0.0,  # 数值型默认值
-                'allTime': elapsed_time
-            }
-            return all_results
+            return failed
+
+    def encode_result(self, result, buffer_only=False):
+        """把标注后的结果图编码为 JPEG 字节；标签图块按权重缓存，绘制在复用的输出缓冲区上"""
+        image, boxes = result if isinstance(result, tuple) else (result.orig_img, result.boxes.data.cpu().numpy())
+        renderer = get_renderer(self.weights_path, self.labels, self.font_path)
+        annotated = renderer.draw(image, boxes)
+        ok, buffer = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError("结果图编码失败")
+        return buffer if buffer_only else buffer.tobytes()
 
 
 if __name__ == '__main__':
-    # 初始化预测器
-    predictor = ImagePredictor("../weights/rice_best.pt", "../rice_test.png", 'rice', save_path="../runs/result.jpg", conf=0.5)
+    # 在 flask 项目根目录下执行：python -m predict.predictImg
+    # 初始化预测器（命令行测试读取本地图片，需允许读取当前目录）
+    input_fetcher.allow_local('.')
+    predictor = ImagePredictor("./weights/rice_best.pt", "./rice_test.png", 'rice', save_path="./runs/result.jpg", conf=0.5)
 
     # 执行预测
     result = predictor.predict()
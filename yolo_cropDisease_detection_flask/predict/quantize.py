@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# @File : quantize.py
+# INT8 量化：把 weights/*.pt 导出的 ONNX 模型用校准图片做静态量化（onnxruntime quantize_static），
+# 产物 <权重名>_int8.onnx 保存在权重旁边；接口通过 variant=int8 选择量化模型
+#
+# 用法（在 flask 项目根目录执行）：
+#   python -m predict.quantize --weights-root ./weights --calib ../测试图片
+import argparse
+import glob
+import os
+import re
+
+import cv2
+import numpy as np
+
+from predict.backends import BACKENDS, export_artifact
+
+VARIANTS = ('fp32', 'int8')
+INT8_SUFFIX = '_int8.onnx'
+
+
+def int8_path(weights_path):
+    """INT8 模型产物路径"""
+    return os.path.splitext(weights_path)[0] + INT8_SUFFIX
+
+
+def resolve_variant(weights_path, variant=None):
+    """
+    按变体选择实际加载的模型文件：int8 且量化产物存在（且不比 .pt 旧）时返回 INT8 模型，否则返回原权重
+    """
+    if not variant or variant == 'fp32':
+        return weights_path
+    if variant not in VARIANTS:
+        raise ValueError(f"未知的模型变体: {variant}，可选 {VARIANTS}")
+    path = int8_path(weights_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(weights_path):
+        return path
+    print(f"未找到 {os.path.basename(weights_path)} 的 INT8 模型（或已过期），使用 float32 模型")
+    return weights_path
+
+
+def letterbox(image, imgsz=640):
+    """与 ultralytics 推理一致的预处理：等比缩放 + 灰边填充到 imgsz，BGR -> RGB，NCHW float32 归一化"""
+    height, width = image.shape[:2]
+    ratio = min(imgsz / height, imgsz / width)
+    new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = resized
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def collect_images(calib_dir, max_images=200):
+    images = []
+    for pattern in ('*.jpg', '*.jpeg', '*.png', '*.bmp'):
+        images.extend(glob.glob(os.path.join(calib_dir, '**', pattern), recursive=True))
+    return sorted(set(images))[:max_images]
+
+
+def _calibration_reader(input_name, images, imgsz):
+    """onnxruntime 的校准数据读取器：逐张提供预处理后的校准图片"""
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self):
+            self._iter = iter(images)
+
+        def get_next(self):
+            for path in self._iter:
+                image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if image is not None:
+                    return {input_name: letterbox(image, imgsz)}
+            return None
+
+    return _Reader()
+
+
+def _head_nodes(model):
+    """
+    检测头（最后一个模块：DFL 解码、坐标拼接、Sigmoid）对量化误差很敏感，保持 float32
+    ultralytics 导出的节点名形如 /model.23/...，编号最大的即为检测头
+    """
+    indices = {}
+    for node in model.graph.node:
+        match = re.match(r'/model\.(\d+)/', node.name)
+        if match:
+            indices.setdefault(int(match.group(1)), []).append(node.name)
+    return indices[max(indices)] if indices else []
+
+
+def quantize_weights(weights_path, calib_dir, imgsz=640, max_images=200):
+    """
+    生成 INT8 模型：先导出（或复用）动态 batch 的 float32 ONNX，再以校准图片做逐通道静态量化
+    :return: INT8 模型路径
+    """
+    import onnx
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    images = collect_images(calib_dir, max_images)
+    if not images:
+        raise ValueError(f"校准目录中没有图片: {calib_dir}")
+    float_path = export_artifact(weights_path, BACKENDS['onnx'], imgsz)
+    target = int8_path(weights_path)
+    prepared = target + '.prep.onnx'
+    quant_pre_process(float_path, prepared)  # 形状推断与图优化，提高量化覆盖率
+
+    float_model = onnx.load(float_path)
+    input_name = float_model.graph.input[0].name
+    print(f"量化 {os.path.basename(weights_path)}：{len(images)} 张校准图片")
+    try:
+        quantize_static(
+            prepared, target, _calibration_reader(input_name, images, imgsz),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            op_types_to_quantize=['Conv', 'MatMul'],
+            nodes_to_exclude=_head_nodes(float_model)
+        )
+    finally:
+        if os.path.exists(prepared):
+            os.remove(prepared)
+
+    # 保留 ultralytics 写入的元数据（类别名、imgsz、task 等），否则加载后类别名丢失
+    quantized = onnx.load(target)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(float_model.metadata_props)
+    onnx.save(quantized, target)
+    print(f"INT8 模型已保存: {target} ({os.path.getsize(target) / 1024 / 1024:.1f} MB，"
+          f"float32 {os.path.getsize(float_path) / 1024 / 1024:.1f} MB)")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成 INT8 量化模型')
+    parser.add_argument('--weights-root', default='./weights')
+    parser.add_argument('--weights', nargs='*', help='只量化指定权重文件，默认目录下全部 .pt')
+    parser.add_argument('--calib', required=True, help='校准图片目录（建议每种作物 100~200 张真实图片，可按作物分子目录）')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--max-images', type=int, default=200)
+    args = parser.parse_args()
+
+    weights = args.weights or sorted(f for f in os.listdir(args.weights_root) if f.endswith('.pt'))
+    for name in weights:
+        # 校准目录下有按作物划分的子目录（如 rice/）时，只用该作物的图片校准
+        calib_dir = os.path.join(args.calib, name.split('_')[0])
+        calib_dir = calib_dir if os.path.isdir(calib_dir) else args.calib
+        try:
+            quantize_weights(os.path.join(args.weights_root, name), calib_dir, args.imgsz, args.max_images)
+        except Exception as e:
+            print(f"量化 {name} 失败: {e}")
+
+
+if __name__ == '__main__':
+    main()
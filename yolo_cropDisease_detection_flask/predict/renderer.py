@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# @File : renderer.py
+# 标注绘制：每个权重的类别标签（含中文）只用 TrueType 字体渲染一次并缓存为图块，
+# 之后每帧只做数组拷贝；检测框按类别合并为一次 cv2.polylines 调用，代替 ultralytics 的 Results.plot
+import os
+import re
+import threading
+
+import cv2
+import numpy as np
+
+# 与 ultralytics 默认配色一致，便于和历史结果对照
+_PALETTE_HEX = ('FF3838', 'FF9D97', 'FF701F', 'FFB21D', 'CFD231', '48F90A', '92CC17', '3DDB86', '1A9334', '00D4BB',
+                '2C99A8', '00C2FF', '344593', '6473FF', '0018EC', '8438FF', '520085', 'CB38FF', 'FF95C8', 'FF37C7')
+PALETTE = [(int(h[4:6], 16), int(h[2:4], 16), int(h[0:2], 16)) for h in _PALETTE_HEX]  # BGR
+
+
+def _text_color(color):
+    """按背景亮度选择黑/白文字"""
+    b, g, r = color
+    return (0, 0, 0) if (0.299 * r + 0.587 * g + 0.114 * b) > 150 else (255, 255, 255)
+
+
+class AnnotationRenderer:
+    def __init__(self, names, font_path=None, line_width=2, font_size=16):
+        """
+        初始化标注绘制器
+        :param names: 类别名称（列表或 {类别号: 名称} 字典），可为中文
+        :param font_path: TrueType 字体路径，为空或不存在时退回 OpenCV 内置字体（只能绘制 ASCII 部分）
+        :param line_width: 检测框线宽
+        :param font_size: 标签字号
+        """
+        self.names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else dict(names)
+        self.line_width = line_width
+        self.font_size = font_size
+        self.font = None
+        if font_path and os.path.exists(font_path):
+            try:
+                from PIL import ImageFont
+                self.font = ImageFont.truetype(font_path, font_size)
+            except Exception as e:
+                print(f"加载字体失败，使用内置字体: {e}")
+        self._sprites = {cls: self._render_sprite(name, self.color(cls)) for cls, name in self.names.items()}
+        self._conf_sprites = {}  # (类别, 置信度两位小数) -> 图块，按需生成
+        self._local = threading.local()
+
+    @staticmethod
+    def color(cls):
+        return PALETTE[int(cls) % len(PALETTE)]
+
+    def draw(self, image, boxes, conf=True, inplace=False):
+        """
+        绘制检测框与标签
+        :param image: BGR ndarray
+        :param boxes: ndarray(N, 6)：x1, y1, x2, y2, conf, cls
+        :param conf: 是否在标签后显示置信度
+        :param inplace: 为 True 时直接画在 image 上（调用方不再需要原图时使用，省去一次拷贝）；
+                        否则画在按线程复用的输出缓冲区上，返回值在本线程下次调用前有效
+        """
+        canvas = image if inplace else self._buffer(image)
+        boxes = np.asarray(boxes).reshape(-1, 6)
+        if len(boxes) == 0:
+            return canvas
+        height, width = canvas.shape[:2]
+        xyxy = np.round(boxes[:, :4]).astype(np.int32)
+        xyxy[:, [0, 2]] = np.clip(xyxy[:, [0, 2]], 0, width - 1)
+        xyxy[:, [1, 3]] = np.clip(xyxy[:, [1, 3]], 0, height - 1)
+        classes = boxes[:, 5].astype(np.int32)
+
+        # 同一类别的框一次绘制：(N, 4, 2) 的四边形顶点数组
+        corners = np.stack([xyxy[:, [0, 1]], xyxy[:, [2, 1]], xyxy[:, [2, 3]], xyxy[:, [0, 3]]], axis=1)
+        for cls in np.unique(classes):
+            cv2.polylines(canvas, list(corners[classes == cls]), True, self.color(cls), self.line_width,
+                          cv2.LINE_AA if self.line_width > 1 else cv2.LINE_8)
+
+        for (x1, y1, _, _), score, cls in zip(xyxy, boxes[:, 4], classes):
+            x = int(x1)
+            y = int(y1)
+            sprite = self._sprites.get(int(cls))
+            if sprite is None:
+                sprite = self._sprite_for(int(cls))
+            x = self._paste(canvas, sprite, x, y)
+            if conf:
+                self._paste(canvas, self._conf_sprite(int(cls), float(score)), x, y)
+        return canvas
+
+    def _buffer(self, image):
+        """按线程复用与输入同尺寸的输出缓冲区"""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.shape != image.shape or buffer.dtype != image.dtype:
+            buffer = self._local.buffer = np.empty_like(image)
+        np.copyto(buffer, image)
+        return buffer
+
+    @staticmethod
+    def _paste(canvas, sprite, x, y):
+        """把标签图块贴在框的左上角上方（贴不下时放到框内），返回图块右边缘的 x 坐标"""
+        h, w = sprite.shape[:2]
+        height, width = canvas.shape[:2]
+        top = y - h if y - h >= 0 else min(y, height - h)
+        if top < 0 or x >= width:
+            return x
+        w = min(w, width - x)
+        canvas[top:top + h, x:x + w] = sprite[:, :w]
+        return x + w
+
+    def _sprite_for(self, cls):
+        sprite = self._sprites[cls] = self._render_sprite(str(cls), self.color(cls))
+        return sprite
+
+    def _conf_sprite(self, cls, score):
+        key = (cls, round(score, 2))
+        sprite = self._conf_sprites.get(key)
+        if sprite is None:
+            sprite = self._conf_sprites[key] = self._render_sprite(f' {score:.2f}', self.color(cls), pad_left=0)
+        return sprite
+
+    def _render_sprite(self, text, color, pad_left=3):
+        """渲染一次标签图块：背景为类别颜色，文字为黑/白"""
+        fg = _text_color(color)
+        if self.font is not None:
+            from PIL import Image, ImageDraw
+            left, _, right, _ = self.font.getbbox(text)
+            ascent, descent = self.font.getmetrics()  # 固定行高，名称和置信度图块高度一致
+            image = Image.new('RGB', (max(1, right - left + pad_left + 3), ascent + descent + 4), color[::-1])
+            ImageDraw.Draw(image).text((pad_left - left, 2), text, font=self.font, fill=fg[::-1])
+            return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+        # 内置字体无法绘制中文：只保留 ASCII 部分（如 'Rice_Blast（稻瘟病）' -> 'Rice_Blast'）
+        text = re.sub(r'[^\x20-\x7e].*$', '', text).rstrip() or '?'
+        scale = self.font_size / 30
+        (w, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 1)
+        (_, h), baseline = cv2.getTextSize('Ag', cv2.FONT_HERSHEY_SIMPLEX, scale, 1)  # 固定行高
+        sprite = np.empty((h + baseline + 4, w + pad_left + 3, 3), dtype=np.uint8)
+        sprite[:] = color
+        cv2.putText(sprite, text, (pad_left, h + 2), cv2.FONT_HERSHEY_SIMPLEX, scale, fg, 1, cv2.LINE_AA)
+        return sprite
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+
+def get_renderer(weights_path, names, font_path=None, line_width=2, font_size=16):
+    """每个 (权重, 类别名称, 字体) 只创建一个绘制器，标签图块随之缓存"""
+    names_key = tuple(names) if isinstance(names, (list, tuple)) else tuple(sorted(dict(names).items()))
+    key = (os.path.abspath(weights_path), names_key, font_path, line_width, font_size)
+    with _renderers_lock:
+        renderer = _renderers.get(key)
+        if renderer is None:
+            renderer = _renderers[key] = AnnotationRenderer(names, font_path, line_width, font_size)
+        return renderer
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# @File : requestContext.py
+# 请求级上下文：每个请求拥有独立的参数、工作目录和停止标志，互不干扰
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+# 客户端传入的会话 ID 会拼进工作目录路径，只允许安全字符
+_SESSION_ID_PATTERN = re.compile(r'^[0-9A-Za-z_-]{1,64}$')
+
+
+class SessionExistsError(ValueError):
+    """客户端传入的会话 ID 已被正在运行的会话占用"""
+
+
+class RequestContext:
+    def __init__(self, kind, params, runs_root='./runs', session_id=None):
+        """
+        初始化请求上下文
+        :param kind: 请求类型（image / video / camera）
+        :param params: 本次请求的参数（username、weight、conf 等）
+        :param runs_root: 工作目录根路径
+        :param session_id: 会话 ID，为空时自动生成
+        """
+        self.id = session_id if session_id and _SESSION_ID_PATTERN.match(session_id) else uuid.uuid4().hex
+        self.kind = kind
+        self.data = dict(params)
+        self.workspace = os.path.join(runs_root, 'jobs', self.id)
+        self.stop_event = threading.Event()
+        self.created_at = time.time()
+
+    def path(self, name):
+        """返回工作目录下的文件路径（首次使用时才创建目录，纯内存请求不会触碰磁盘）"""
+        os.makedirs(self.workspace, exist_ok=True)
+        return os.path.join(self.workspace, name)
+
+    def stop(self):
+        """通知该会话停止（摄像头录制等长任务会轮询该标志）"""
+        self.stop_event.set()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def cleanup(self):
+        """删除整个工作目录"""
+        if not os.path.exists(self.workspace):
+            return
+        try:
+            shutil.rmtree(self.workspace, ignore_errors=True)
+        except Exception as e:
+            print(f"清理工作目录 {self.workspace} 失败: {e}")
+
+
+class SessionManager:
+    """管理正在运行的视频/摄像头会话，支持按 ID 停止"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def register(self, ctx):
+        """登记会话；ID 已被占用时抛出 SessionExistsError（共用 ID 会共用工作目录，也无法再单独停止）"""
+        with self._lock:
+            if ctx.id in self._sessions:
+                raise SessionExistsError(f"会话 ID 已存在: {ctx.id}")
+            self._sessions[ctx.id] = ctx
+        return ctx
+
+    def unregister(self, ctx):
+        with self._lock:
+            if self._sessions.get(ctx.id) is ctx:
+                del self._sessions[ctx.id]
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def stop(self, session_id, kind=None):
+        """
+        停止指定会话
+        :param session_id: 会话 ID
+        :param kind: 会话类型，不为 None 时只停止该类型的会话
+        :return: 被停止的会话 ID 列表
+        """
+        with self._lock:
+            ctx = self._sessions.get(session_id)
+            targets = [ctx] if ctx is not None and (kind is None or ctx.kind == kind) else []
+        for ctx in targets:
+            ctx.stop()
+        return [ctx.id for ctx in targets]
+
+    def find(self, kind=None, username=None):
+        """按类型和用户名（不为 None 时）查找正在运行的会话"""
+        with self._lock:
+            return [c for c in self._sessions.values()
+                    if (kind is None or c.kind == kind) and (username is None or c.data.get('username') == username)]
+
+    def active(self, kind=None):
+        """当前活跃会话数量"""
+        with self._lock:
+            return sum(1 for c in self._sessions.values() if kind is None or c.kind == kind)
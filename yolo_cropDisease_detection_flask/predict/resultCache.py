@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# @File : resultCache.py
+# 按内容寻址的检测结果缓存：键为 (图片内容哈希, 权重文件哈希, 推理尺寸)，
+# 以较低的基础阈值保存原始检测框，任何更高 conf 的请求只需过滤缓存框，无需重新推理
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from predict.metrics import CACHE_REQUESTS_TOTAL
+
+_file_hash_cache = {}  # (路径, mtime, 大小) -> sha1
+_file_hash_lock = threading.Lock()
+
+
+def file_hash(path):
+    """计算文件内容的 sha1，按 (路径, mtime, 大小) 缓存，权重文件被替换后自动失效"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    with _file_hash_lock:
+        cached = _file_hash_cache.get(key)
+    if cached:
+        return cached
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    digest = sha1.hexdigest()
+    with _file_hash_lock:
+        _file_hash_cache[key] = digest
+    return digest
+
+
+class DetectionCache:
+    def __init__(self, max_memory_mb=64, disk_dir=None, base_conf=0.05):
+        """
+        初始化检测结果缓存
+        :param max_memory_mb: 内存层容量上限（MB），超出后按 LRU 淘汰
+        :param disk_dir: 磁盘层目录，为 None 时只使用内存层
+        :param base_conf: 写入缓存时使用的基础置信度阈值
+        """
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.disk_dir = disk_dir
+        self.base_conf = base_conf
+        self._entries = OrderedDict()  # key -> ndarray(N, 6): x1, y1, x2, y2, conf, cls
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def make_key(self, image_bytes, weights_path, imgsz=None):
+        """由图片原始字节、权重文件哈希和推理尺寸生成缓存键"""
+        image_digest = hashlib.sha1(image_bytes).hexdigest()
+        return f"{image_digest}:{file_hash(weights_path)}:{imgsz or 'default'}"
+
+    def get(self, key):
+        """读取缓存的原始检测框，未命中返回 None"""
+        with self._lock:
+            boxes = self._entries.get(key)
+            if boxes is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS_TOTAL.inc(cache='detection', result='hit')
+                return boxes
+        boxes = self._disk_get(key)
+        with self._lock:
+            if boxes is None:
+                self.misses += 1
+                CACHE_REQUESTS_TOTAL.inc(cache='detection', result='miss')
+                return None
+            self.disk_hits += 1
+            CACHE_REQUESTS_TOTAL.inc(cache='detection', result='disk_hit')
+        self._memory_put(key, boxes)  # 磁盘命中后提升到内存层
+        return boxes
+
+    def put(self, key, boxes):
+        """写入原始检测框（应为 base_conf 阈值下的推理结果）"""
+        boxes = np.ascontiguousarray(boxes, dtype=np.float32).reshape(-1, 6)
+        self._memory_put(key, boxes)
+        self._disk_put(key, boxes)
+
+    @staticmethod
+    def filter(boxes, conf):
+        """按请求的置信度阈值过滤缓存框"""
+        return boxes[boxes[:, 4] >= conf]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'memory_mb': round(self._memory_bytes / 1024 / 1024, 3),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+    def _memory_put(self, key, boxes):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old.nbytes
+            self._entries[key] = boxes
+            self._memory_bytes += boxes.nbytes
+            while self._entries and self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._memory_bytes -= evicted.nbytes
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy')
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path)
+        except Exception as e:
+            print(f"读取磁盘缓存失败 {path}: {e}")
+            return None
+
+    def _disk_put(self, key, boxes):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, boxes)
+            os.replace(tmp_path, path)  # 原子替换，避免并发读到半个文件
+        except Exception as e:
+            print(f"写入磁盘缓存失败 {path}: {e}")
+
+
+# 全局单例；如需磁盘层，可改为 DetectionCache(disk_dir='./runs/cache')
+detection_cache = DetectionCache()
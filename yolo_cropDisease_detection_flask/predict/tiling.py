@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# @File : tiling.py
+# 高分辨率切片推理：把大图切成有重叠的切片（外加一张缩略全图）一次批量推理，
+# 检测框平移回原图坐标后用向量化 NumPy NMS 合并跨切片边界的重复框，小病斑不会因整体缩放到 640 而丢失
+import os
+import threading
+import time
+
+import numpy as np
+
+from predict.workerPool import executor
+from predict.metrics import metrics
+
+TILING_SECONDS = metrics.histogram('yolo_tiling_seconds', '切片推理耗时（秒）', ('tile', 'overlap'))
+TILING_EXTRA_DETECTIONS = metrics.counter('yolo_tiling_extra_detections_total',
+                                          '切片推理比整图推理多检出的目标数', ('tile', 'overlap'))
+
+
+def make_tiles(width, height, tile_size=640, overlap=0.2):
+    """
+    生成覆盖整图的切片坐标 (x1, y1, x2, y2)；最后一行/列贴齐图像边缘，保证所有切片尺寸一致
+    """
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def nms(boxes, iou_threshold=0.5, class_aware=True):
+    """
+    向量化 NMS
+    :param boxes: ndarray(N, 6)：x1, y1, x2, y2, conf, cls
+    :param class_aware: 为 True 时只在同类别框之间抑制（通过按类别平移坐标实现）
+    :return: 保留的框，按置信度降序
+    """
+    if len(boxes) == 0:
+        return boxes.reshape(0, 6)
+    coords = boxes[:, :4].astype(np.float64)
+    if class_aware:
+        coords = coords + boxes[:, 5:6] * (coords.max() + 1)  # 不同类别的框互不重叠
+    x1, y1, x2, y2 = coords.T
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    order = np.argsort(-boxes[:, 4], kind='stable')
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return boxes[np.asarray(keep)]
+
+
+class TilingStats:
+    """按 (权重, 切片尺寸, 重叠率) 汇总切片推理的耗时与多检出数量，用于比较不同设置的收益"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, weight, tile_size, overlap, seconds, full_detections, merged_detections):
+        key = (weight, tile_size, overlap)
+        with self._lock:
+            data = self._stats.setdefault(key, {'requests': 0, 'seconds': 0.0, 'full': 0, 'merged': 0})
+            data['requests'] += 1
+            data['seconds'] += seconds
+            data['full'] += full_detections
+            data['merged'] += merged_detections
+
+    def report(self):
+        with self._lock:
+            return [{
+                'weight': weight, 'tileSize': tile_size, 'overlap': overlap,
+                'requests': data['requests'],
+                'avgMs': round(data['seconds'] / data['requests'] * 1000, 2),
+                'avgFullDetections': round(data['full'] / data['requests'], 2),
+                'avgExtraDetections': round((data['merged'] - data['full']) / data['requests'], 2)
+            } for (weight, tile_size, overlap), data in self._stats.items()]
+
+
+tiling_stats = TilingStats()
+
+
+def parse_tiling(value, default=None):
+    """
+    解析请求参数中的切片设置：'true' 使用默认 640/0.2，'1024' 或 '1024:0.25' 指定尺寸和重叠率，'false' 关闭
+    :return: {'tile_size', 'overlap'} 或 None
+    """
+    if value is None or value == '':
+        return default
+    if isinstance(value, dict):
+        return {'tile_size': int(value.get('tile_size', 640)), 'overlap': float(value.get('overlap', 0.2))}
+    text = str(value).strip().lower()
+    if text in ('false', '0', 'off', 'no'):
+        return None
+    if text in ('true', 'on', 'yes'):
+        return default or {'tile_size': 640, 'overlap': 0.2}
+    size, _, overlap = text.partition(':')
+    return {'tile_size': int(size), 'overlap': float(overlap) if overlap else 0.2}
+
+
+def tiled_predict(weights_path, image, conf, tile_size=640, overlap=0.2, iou=0.5, include_full=True,
+                  min_side=None, report_conf=None):
+    """
+    切片推理
+    :param image: BGR ndarray
+    :param include_full: 是否同时推理缩放后的整图（检出跨切片的大目标，并作为多检出数量的基准）
+    :param min_side: 图像长边小于该值时不切片（默认 1.5 倍切片尺寸）
+    :param report_conf: 统计检出数量时使用的阈值（以低阈值推理写缓存时传入请求的 conf），默认同 conf
+    :return: (ndarray(N, 6) 原图坐标下的检测框, 报告字典)；图像太小未切片时返回 (None, None)
+    """
+    height, width = image.shape[:2]
+    if max(width, height) < (min_side or tile_size * 1.5):
+        return None, None
+
+    start = time.perf_counter()
+    tiles = make_tiles(width, height, tile_size, overlap)
+    crops = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles]
+    if include_full:
+        crops.append(image)
+    results = executor().predict_boxes(weights_path, crops, conf=conf, imgsz=tile_size, half=False,
+                                       device='cpu', verbose=False)
+
+    merged = []
+    for (x1, y1, _, _), boxes in zip(tiles, results):
+        if len(boxes):
+            boxes = boxes.copy()
+            boxes[:, [0, 2]] += x1
+            boxes[:, [1, 3]] += y1
+            merged.append(boxes)
+    report_conf = conf if report_conf is None else report_conf
+    full_detections = 0
+    if include_full:
+        full_boxes = results[-1]
+        full_detections = int((full_boxes[:, 4] >= report_conf).sum())
+        merged.append(full_boxes)
+    boxes = nms(np.concatenate(merged).astype(np.float32), iou) if merged else np.zeros((0, 6), np.float32)
+    elapsed = time.perf_counter() - start
+    detections = int((boxes[:, 4] >= report_conf).sum())
+
+    labels = dict(tile=tile_size, overlap=overlap)
+    TILING_SECONDS.observe(elapsed, **labels)
+    if include_full:
+        TILING_EXTRA_DETECTIONS.inc(max(0, detections - full_detections), **labels)
+        tiling_stats.add(os.path.basename(weights_path), tile_size, overlap, elapsed, full_detections, detections)
+    return boxes, {
+        'tileSize': tile_size,
+        'overlap': overlap,
+        'tiles': len(tiles),
+        'tilingTime': round(elapsed, 4),
+        'detections': detections,
+        'fullImageDetections': full_detections if include_full else None,
+        'extraDetections': detections - full_detections if include_full else None
+    }
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+# @File : tracker.py
+# 关键帧检测 + 光流跟踪：视频中叶片病斑在相邻帧间几乎不动，只在关键帧（固定间隔或场景突变时）运行 YOLO，
+# 中间帧用金字塔 LK 光流平移上一帧的检测框；关键帧上按 IoU 把检测结果关联到已有轨迹，
+# 轨迹的类别按累计置信度投票、置信度取平均，标签不会逐帧跳变
+import time
+
+import cv2
+import numpy as np
+
+from predict.metrics import metrics
+
+KEY = 'key'  # 关键帧：检测结果更新轨迹
+AUDIT = 'audit'  # 抽检帧：额外做一次检测，只用于统计与逐帧检测的一致程度，不更新轨迹
+
+TRACKER_FRAMES_TOTAL = metrics.counter('yolo_tracker_frames_total', '跟踪模式下各类帧的数量', ('role',))
+TRACKER_SCENE_CHANGES = metrics.counter('yolo_tracker_scene_changes_total', '因场景突变提前触发的关键帧数')
+
+
+def parse_tracking(value, default=None):
+    """
+    解析请求参数中的跟踪设置：'true' 使用默认间隔 5 帧，'8' 或 '8:0.2' 指定关键帧间隔和场景突变阈值，'false' 关闭
+    :return: {'stride', 'scene_threshold'} 或 None
+    """
+    if value is None or value == '':
+        return default
+    if isinstance(value, dict):
+        return {'stride': int(value.get('stride', 5)), 'scene_threshold': float(value.get('scene_threshold', 0.15))}
+    text = str(value).strip().lower()
+    if text in ('false', '0', 'off', 'no'):
+        return None
+    if text in ('true', 'on', 'yes'):
+        return default or {'stride': 5, 'scene_threshold': 0.15}
+    stride, _, threshold = text.partition(':')
+    return {'stride': max(1, int(stride)), 'scene_threshold': float(threshold) if threshold else 0.15}
+
+
+def box_iou(a, b):
+    """两组 xyxy 框的 IoU 矩阵 (len(a), len(b))"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def greedy_match(iou, threshold):
+    """按 IoU 从大到小贪心配对，返回 [(行, 列)]"""
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    rows, cols = np.nonzero(iou >= threshold)
+    used_rows, used_cols = set(), set()
+    for k in np.argsort(-iou[rows, cols], kind='stable'):
+        r, c = int(rows[k]), int(cols[k])
+        if r not in used_rows and c not in used_cols:
+            pairs.append((r, c))
+            used_rows.add(r)
+            used_cols.add(c)
+    return pairs
+
+
+class Track:
+    """单条轨迹：当前框、各类别累计置信度、命中次数"""
+
+    def __init__(self, track_id, box, conf, cls, frame_index):
+        self.id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.scores = {}
+        self.hits = 0
+        self.missed = 0
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.hit(box, conf, cls, frame_index)
+
+    def hit(self, box, conf, cls, frame_index):
+        self.box = np.asarray(box, dtype=np.float32)
+        self.scores[cls] = self.scores.get(cls, 0.0) + float(conf)
+        self.hits += 1
+        self.missed = 0
+        self.last_frame = frame_index
+
+    @property
+    def cls(self):
+        """累计置信度最高的类别（单帧误判不会改变轨迹标签）"""
+        return max(self.scores, key=self.scores.get)
+
+    @property
+    def conf(self):
+        """获胜类别的累计置信度 / 总命中次数：类别摇摆的轨迹置信度会相应降低"""
+        return self.scores[self.cls] / self.hits
+
+    def to_row(self):
+        return [*self.box.tolist(), self.conf, self.cls]
+
+
+class KeyframeTracker:
+    def __init__(self, stride=5, scene_threshold=0.15, match_iou=0.3, max_missed=2, audit_every=30,
+                 agreement_iou=0.5, grid=4, max_ended=200):
+        """
+        初始化关键帧跟踪器（一个视频一个实例，不可跨视频复用）
+        :param stride: 关键帧间隔（帧），1 即逐帧检测
+        :param scene_threshold: 缩略灰度图与上一关键帧的平均差异（0~1）超过该值时立即作为关键帧
+        :param match_iou: 关键帧上检测框与轨迹关联的最小 IoU
+        :param max_missed: 轨迹连续多少个关键帧未被检测到后删除
+        :param audit_every: 每隔多少个跟踪帧抽检一次（额外做一次检测，统计一致程度），0 为不抽检
+        :param agreement_iou: 抽检时判定跟踪框与检测框一致的 IoU（且类别相同）
+        :param grid: 每条轨迹在框内取 grid × grid 个光流点
+        :param max_ended: 报告中保留的已结束轨迹数（按命中次数保留最多的），长时间的视频/摄像头会话内存不会持续增长
+        """
+        self.stride = max(1, int(stride))
+        self.scene_threshold = scene_threshold
+        self.match_iou = match_iou
+        self.max_missed = max_missed
+        self.audit_every = audit_every
+        self.agreement_iou = agreement_iou
+        self.grid = grid
+        self.max_ended = max_ended
+        self.tracks = []
+        self._next_id = 1
+        self._frame_index = 0
+        self._since_key = None  # 距上一关键帧的帧数，None 表示还没有关键帧
+        self._since_audit = 0
+        self._key_thumb = None
+        self._prev_gray = None
+        self._ended = []  # 已删除的轨迹（最多约 2 × max_ended 条），供报告使用
+        self._counts = {KEY: 0, AUDIT: 0, 'propagated': 0, 'sceneChanges': 0}
+        self._agreement = {'tp': 0, 'tracked': 0, 'detected': 0}
+        self._track_seconds = 0.0
+
+    def plan(self, frames):
+        """
+        按解码顺序决定每帧的角色，返回 [(角色, 灰度图)]；角色为 KEY / AUDIT / None（只跟踪）
+        需要检测的帧（KEY、AUDIT）由调用方批量推理后连同结果交给 consume
+        """
+        plans = []
+        for frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            thumb = cv2.resize(gray, (64, 48), interpolation=cv2.INTER_AREA)
+            role = None
+            if self._since_key is None or self._since_key + 1 >= self.stride:
+                role = KEY
+            elif np.mean(cv2.absdiff(thumb, self._key_thumb)) / 255.0 > self.scene_threshold:
+                role = KEY
+                self._counts['sceneChanges'] += 1
+                TRACKER_SCENE_CHANGES.inc()
+            elif self.audit_every and self._since_audit + 1 >= self.audit_every:
+                role = AUDIT
+            if role == KEY:
+                self._since_key = 0
+                self._key_thumb = thumb
+            else:
+                self._since_key += 1
+                self._since_audit = 0 if role == AUDIT else self._since_audit + 1
+            plans.append((role, gray))
+        return plans
+
+    def consume(self, plans, detections):
+        """
+        按帧序处理一批帧
+        :param plans: plan() 的返回值
+        :param detections: 需要检测的帧（按顺序）的检测框列表
+        :return: 每帧输出的检测框 ndarray(N, 6)，类别和置信度为轨迹的聚合值
+        """
+        detections = iter(detections)
+        outputs = []
+        for role, gray in plans:
+            start = time.perf_counter()
+            if role is not None:
+                boxes = np.asarray(next(detections)).reshape(-1, 6)
+            if role == KEY:
+                self._update(boxes)
+            else:
+                self._propagate(gray)
+                self._counts['propagated'] += 1
+            if role == AUDIT:
+                self._audit(boxes)
+            self._prev_gray = gray
+            self._frame_index += 1
+            if role != KEY:
+                self._track_seconds += time.perf_counter() - start
+            TRACKER_FRAMES_TOTAL.inc(role=role or 'propagated')
+            if role is not None:
+                self._counts[role] += 1
+            outputs.append(self.boxes())
+        return outputs
+
+    def boxes(self):
+        if not self.tracks:
+            return np.zeros((0, 6), dtype=np.float32)
+        return np.asarray([t.to_row() for t in self.tracks], dtype=np.float32)
+
+    def report(self, names=None, detect_seconds=None):
+        """
+        跟踪统计
+        :param names: 类别名称，用于轨迹标签
+        :param detect_seconds: 推理阶段的总耗时（含抽检帧），用于估算逐帧检测的耗时与加速比
+        """
+        counts = self._counts
+        frames = self._frame_index
+        tp, tracked, detected = (self._agreement[k] for k in ('tp', 'tracked', 'detected'))
+        precision = tp / tracked if tracked else None
+        recall = tp / detected if detected else None
+        f1 = 2 * precision * recall / (precision + recall) if precision and recall else None
+        report = {
+            'frames': frames,
+            'keyframes': counts[KEY],
+            'sceneChanges': counts['sceneChanges'],
+            'propagatedFrames': counts['propagated'],
+            'detectRatio': round(counts[KEY] / frames, 3) if frames else None,
+            'agreement': {
+                'auditFrames': counts[AUDIT],
+                'precision': round(precision, 4) if precision is not None else None,
+                'recall': round(recall, 4) if recall is not None else None,
+                'f1': round(f1, 4) if f1 is not None else None
+            },
+            'trackMsPerFrame': round(self._track_seconds / counts['propagated'] * 1000, 3)
+            if counts['propagated'] else None
+        }
+        detected_frames = counts[KEY] + counts[AUDIT]
+        if detect_seconds and detected_frames and frames:
+            # 逐帧检测的耗时按检测帧的平均耗时外推；跟踪模式的实际耗时只计关键帧检测和光流
+            per_frame = detect_seconds / detected_frames
+            actual = per_frame * counts[KEY] + self._track_seconds
+            report['detectMsPerFrame'] = round(per_frame * 1000, 2)
+            report['estimatedSpeedup'] = round(per_frame * frames / actual, 2) if actual > 0 else None
+        tracks = self._ended + self.tracks
+        report['tracks'] = [{
+            'id': t.id,
+            'label': self._label(names, t.cls),
+            'conf': round(t.conf, 4),
+            'hits': t.hits,
+            'firstFrame': t.first_frame,
+            'lastFrame': t.last_frame
+        } for t in sorted(tracks, key=lambda t: -t.hits)[:100]]
+        return report
+
+    # ---------------- 内部方法 ----------------
+
+    def _update(self, boxes):
+        """关键帧：检测框按 IoU 关联到轨迹（与类别无关，类别由投票决定），未关联的检测框新建轨迹"""
+        current = np.asarray([t.box for t in self.tracks], dtype=np.float32).reshape(-1, 4)
+        pairs = greedy_match(box_iou(current, boxes[:, :4]), self.match_iou)
+        matched_tracks = {r for r, _ in pairs}
+        matched_boxes = {c for _, c in pairs}
+        for r, c in pairs:
+            self.tracks[r].hit(boxes[c, :4], boxes[c, 4], int(boxes[c, 5]), self._frame_index)
+        survivors = []
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.missed += 1
+                if track.missed >= self.max_missed:
+                    self._end(track)
+                    continue
+            survivors.append(track)
+        for c in range(len(boxes)):
+            if c not in matched_boxes:
+                survivors.append(Track(self._next_id, boxes[c, :4], boxes[c, 4], int(boxes[c, 5]),
+                                       self._frame_index))
+                self._next_id += 1
+        self.tracks = survivors
+
+    def _end(self, track):
+        """记录已结束的轨迹；超过 2 × max_ended 条时只保留命中次数最多的 max_ended 条（均摊开销很小）"""
+        self._ended.append(track)
+        if len(self._ended) > 2 * self.max_ended:
+            self._ended = sorted(self._ended, key=lambda t: -t.hits)[:self.max_ended]
+
+    def _propagate(self, gray):
+        """中间帧：每条轨迹在框内取网格点做 LK 光流，按位移中位数平移框、按点间距变化缩放框"""
+        if self._prev_gray is None or not self.tracks:
+            return
+        height, width = gray.shape
+        steps = (np.arange(self.grid) + 0.5) / self.grid
+        points = []
+        for track in self.tracks:
+            x1, y1, x2, y2 = track.box
+            xs = x1 + (x2 - x1) * steps
+            ys = y1 + (y2 - y1) * steps
+            points.append(np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2))
+        p0 = np.concatenate(points).astype(np.float32).reshape(-1, 1, 2)
+        p1, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, p0, None, winSize=(15, 15), maxLevel=2)
+        p0, p1, status = p0.reshape(-1, 2), p1.reshape(-1, 2), status.reshape(-1).astype(bool)
+        per_track = self.grid * self.grid
+        for i, track in enumerate(self.tracks):
+            sl = slice(i * per_track, (i + 1) * per_track)
+            good = status[sl]
+            if good.sum() < 3:
+                continue  # 光流点丢失（遮挡、模糊）时保持原位置，等待下一关键帧校正
+            old, new = p0[sl][good], p1[sl][good]
+            dx, dy = np.median(new - old, axis=0)
+            spread_old = np.median(np.linalg.norm(old - old.mean(axis=0), axis=1))
+            spread_new = np.median(np.linalg.norm(new - new.mean(axis=0), axis=1))
+            scale = float(np.clip(spread_new / spread_old, 0.9, 1.1)) if spread_old > 1e-3 else 1.0
+            x1, y1, x2, y2 = track.box
+            cx, cy = (x1 + x2) / 2 + dx, (y1 + y2) / 2 + dy
+            half_w, half_h = (x2 - x1) / 2 * scale, (y2 - y1) / 2 * scale
+            track.box = np.array([np.clip(cx - half_w, 0, width - 1), np.clip(cy - half_h, 0, height - 1),
+                                  np.clip(cx + half_w, 0, width - 1), np.clip(cy + half_h, 0, height - 1)],
+                                 dtype=np.float32)
+
+    def _audit(self, boxes):
+        """抽检帧：跟踪输出与该帧实际检测结果比较（IoU 达标且类别相同记为一致）"""
+        tracked = self.boxes()
+        iou = box_iou(tracked[:, :4], boxes[:, :4])
+        if iou.size:
+            same_class = tracked[:, None, 5].astype(np.int32) == boxes[None, :, 5].astype(np.int32)
+            iou = np.where(same_class, iou, 0.0)
+        self._agreement['tp'] += len(greedy_match(iou, self.agreement_iou))
+        self._agreement['tracked'] += len(tracked)
+        self._agreement['detected'] += len(boxes)
+
+    @staticmethod
+    def _label(names, cls):
+        if names is None:
+            return cls
+        try:
+            return names[cls]
+        except (KeyError, IndexError):
+            return cls
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# @File : videoEncoder.py
+# 单次编码输出 MP4：把标注后的原始帧通过 stdin 直接送入常驻 ffmpeg 进程，省去 AVI 临时文件和二次转码
+import shutil
+import subprocess
+import threading
+
+import cv2
+
+
+class FfmpegWriter:
+    """与 cv2.VideoWriter 接口一致（write / release / isOpened）的 ffmpeg 管道写入器"""
+
+    def __init__(self, output_path, fps, frame_size, total_frames=0, on_progress=None,
+                 preset='veryfast', crf=23, ffmpeg_bin='ffmpeg'):
+        """
+        初始化写入器并启动 ffmpeg 进程
+        :param output_path: 输出 MP4 路径
+        :param fps: 帧率
+        :param frame_size: 帧尺寸 (宽, 高)
+        :param total_frames: 总帧数，用于计算进度；未知时为 0
+        :param on_progress: 进度回调，参数为 0~100 的百分比
+        :param preset: x264 编码速度预设
+        :param crf: x264 质量参数
+        :param ffmpeg_bin: ffmpeg 可执行文件
+        """
+        self.output_path = output_path
+        self.frame_size = tuple(frame_size)
+        self.total_frames = total_frames
+        self.on_progress = on_progress
+        self.frames_written = 0
+        self._last_progress = -1
+        self._stderr = []
+        width, height = self.frame_size
+        command = [
+            ffmpeg_bin, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps),
+            '-i', '-',
+            '-an', '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+            '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+            output_path
+        ]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE)
+        # 持续读取 stderr，避免缓冲区写满导致 ffmpeg 阻塞
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def write(self, frame):
+        """写入一帧 BGR 图像，尺寸不一致时自动缩放"""
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size)
+        try:
+            self.process.stdin.write(frame.tobytes())
+        except (BrokenPipeError, ValueError) as e:
+            raise RuntimeError(f"ffmpeg 编码进程已退出: {''.join(self._stderr)[-500:] or e}")
+        self.frames_written += 1
+        self._report_progress()
+
+    def release(self):
+        """结束输入并等待 ffmpeg 写完文件，返回是否成功"""
+        if self.process.stdin and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        code = self.process.wait()
+        self._stderr_thread.join(timeout=1)
+        if code != 0:
+            print(f"ffmpeg 编码失败（退出码 {code}）: {''.join(self._stderr)[-500:]}")
+        return code == 0
+
+    def _report_progress(self):
+        if not self.on_progress or self.total_frames <= 0:
+            return
+        progress = min(99, int(self.frames_written * 100 / self.total_frames))
+        if progress != self._last_progress:  # 每变化 1% 才回调一次
+            self._last_progress = progress
+            self.on_progress(progress)
+
+    def _drain_stderr(self):
+        for line in iter(self.process.stderr.readline, b''):
+            self._stderr.append(line.decode('utf-8', errors='ignore'))
+
+
+def create_video_writer(output_path, fps, frame_size, total_frames=0, on_progress=None):
+    """
+    创建 MP4 写入器：优先使用 ffmpeg 管道（H.264，浏览器可直接播放），
+    找不到 ffmpeg 时退回到 OpenCV 的 mp4v 编码
+    """
+    fps = fps if fps and fps > 0 else 25
+    if shutil.which('ffmpeg'):
+        return FfmpegWriter(output_path, fps, frame_size, total_frames=total_frames, on_progress=on_progress)
+    print("未找到 ffmpeg，使用 OpenCV mp4v 编码输出")
+    return cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, tuple(frame_size))
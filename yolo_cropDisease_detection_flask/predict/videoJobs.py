@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# @File : videoJobs.py
+# 后台视频任务队列：视频分析作为带 ID 的任务提交，由固定数量的后台线程按提交顺序处理，
+# 不再占用 HTTP 请求线程；任务状态、进度、最新一帧预览都保存在任务对象上，客户端断开后可重新查询/订阅
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from predict.metrics import metrics
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+VIDEO_JOBS_TOTAL = metrics.counter('yolo_video_jobs_total', '结束的后台视频任务数', ('status',))
+VIDEO_JOB_WAIT_SECONDS = metrics.histogram('yolo_video_job_wait_seconds', '视频任务从提交到开始处理的排队时间（秒）')
+
+
+class QueueFullError(RuntimeError):
+    """排队的任务数已达上限"""
+
+
+class JobExistsError(RuntimeError):
+    """同 ID 的任务尚未结束"""
+
+
+class VideoJob:
+    """单个视频任务的状态；处理线程写入，接口线程和预览流读取"""
+
+    def __init__(self, ctx, room=None):
+        """
+        :param ctx: 任务的 RequestContext（参数、工作目录、停止标志）
+        :param room: 推送状态/进度的 Socket.IO 房间，默认为任务 ID（提交者和之后订阅该任务的客户端加入此房间）
+        """
+        self.ctx = ctx
+        self.id = ctx.id
+        self.room = room or ctx.id
+        self.status = QUEUED
+        self.progress = 0
+        self.frames = 0
+        self.total_frames = 0
+        self.error = None
+        self.result = {}
+        self.options = {}
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._jpeg = None
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def publish_frame(self, jpeg):
+        """处理线程每输出一帧调用一次，只保留最新一帧供预览"""
+        with self._cond:
+            self._jpeg = jpeg
+            self._seq += 1
+            self.frames += 1
+            self._cond.notify_all()
+
+    def preview(self, should_stop=lambda: False, timeout=1.0):
+        """逐个产出最新的 JPEG 帧；预览比处理慢时直接跳帧，不会拖慢任务本身"""
+        last_seq = 0
+        while not should_stop():
+            with self._cond:
+                self._cond.wait_for(lambda: self._seq > last_seq or self.finished, timeout=timeout)
+                if self._seq > last_seq:
+                    last_seq, jpeg = self._seq, self._jpeg
+                elif self.finished:
+                    return
+                else:
+                    continue
+            yield jpeg
+
+    def _set_status(self, status, error=None):
+        with self._cond:
+            self.status = status
+            if error is not None:
+                self.error = error
+            if status == RUNNING:
+                self.started_at = time.time()
+            elif status in FINISHED_STATES:
+                self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def to_dict(self, position=None):
+        data = {
+            'jobId': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'frames': self.frames,
+            'totalFrames': self.total_frames,
+            'weight': self.ctx.data.get('weight'),
+            'inputVideo': self.ctx.data.get('inputVideo'),
+            'submittedAt': round(self.submitted_at, 3),
+            'startedAt': round(self.started_at, 3) if self.started_at else None,
+            'finishedAt': round(self.finished_at, 3) if self.finished_at else None,
+            'error': self.error
+        }
+        if position is not None:
+            data['position'] = position  # 排队中的任务前面还有几个任务
+        return data
+
+
+class VideoJobQueue:
+    def __init__(self, runner, max_concurrent=2, max_queued=32, keep_seconds=3600, on_update=None):
+        """
+        初始化视频任务队列
+        :param runner: 处理函数 runner(job)，在后台线程中执行；应定期检查 job.ctx.stopped 以响应取消
+        :param max_concurrent: 同时处理的任务数（每个任务本身已是多线程流水线，CPU 推理节点上 1~2 个即可）
+        :param max_queued: 最多排队的任务数，超出时拒绝提交
+        :param keep_seconds: 结束的任务保留多久以便查询结果
+        :param on_update: 状态/进度变化时的回调 on_update(job, event)，event 为 'status' 或 'progress'
+        """
+        self.runner = runner
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.keep_seconds = keep_seconds
+        self.on_update = on_update
+        self._jobs = OrderedDict()  # 任务 ID -> VideoJob，按提交顺序
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """启动处理线程（首次提交时自动调用）"""
+        with self._lock:
+            if self._threads:
+                return self
+            for i in range(self.max_concurrent):
+                thread = threading.Thread(target=self._worker, name=f'video-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def submit(self, ctx, room=None, **options):
+        """
+        提交任务，返回 VideoJob；排队已满时抛出 QueueFullError，同 ID 任务未结束时抛出 JobExistsError
+        :param options: 不属于上传记录的处理参数（如模型变体），保存在 job.options 中供 runner 使用
+        """
+        self.start()
+        self._prune()
+        with self._lock:
+            if self._count(QUEUED) >= self.max_queued:
+                raise QueueFullError(f"排队的视频任务已达上限 {self.max_queued}，请稍后再试")
+            existing = self._jobs.get(ctx.id)
+            if existing is not None and not existing.finished:
+                raise JobExistsError(f"任务 {ctx.id} 正在处理中")
+            job = self._jobs[ctx.id] = VideoJob(ctx, room)
+            job.options = options
+        self._queue.put(job)
+        self._notify(job, 'status')
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接标记为已取消，运行中的通过停止标志让流水线尽快退出"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.ctx.stop()
+        with self._lock:
+            queued = job.status == QUEUED
+            if queued:
+                job._set_status(CANCELLED)
+        if queued:
+            VIDEO_JOBS_TOTAL.inc(status=CANCELLED)
+            self._notify(job, 'status')
+        return job
+
+    def position(self, job):
+        """排队中的任务前面还有几个排队任务"""
+        if job.status != QUEUED:
+            return None
+        with self._lock:
+            queued = [j for j in self._jobs.values() if j.status == QUEUED]
+        return queued.index(job) if job in queued else None
+
+    def status(self, job):
+        return job.to_dict(self.position(job))
+
+    def list(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [self.status(job) for job in jobs]
+
+    def counts(self):
+        """各状态的任务数（供 Prometheus 指标使用）"""
+        with self._lock:
+            return {state: self._count(state) for state in (QUEUED, RUNNING) + FINISHED_STATES}
+
+    def set_progress(self, job, progress):
+        progress = int(progress)
+        if progress != job.progress:
+            job.progress = progress
+            self._notify(job, 'progress')
+
+    def _count(self, state):
+        return sum(1 for j in self._jobs.values() if j.status == state)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.finished:  # 排队时已被取消
+                    continue
+                job._set_status(RUNNING)
+            VIDEO_JOB_WAIT_SECONDS.observe(time.time() - job.submitted_at)
+            self._notify(job, 'status')
+            try:
+                self.runner(job)
+            except Exception as e:
+                print(f"视频任务 {job.id} 失败: {e}")
+                self._finish(job, FAILED, f"{type(e).__name__}: {e}")
+                continue
+            self._finish(job, CANCELLED if job.ctx.stopped else DONE)
+
+    def _finish(self, job, status, error=None):
+        job._set_status(status, error)
+        VIDEO_JOBS_TOTAL.inc(status=status)
+        self._notify(job, 'status')
+
+    def _notify(self, job, event):
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(job, event)
+        except Exception as e:
+            print(f"推送视频任务 {job.id} 状态失败: {e}")
+
+    def _prune(self):
+        """删除结束超过 keep_seconds 的任务"""
+        deadline = time.time() - self.keep_seconds
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < deadline]:
+                del self._jobs[job_id]
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# @File : videoPipeline.py
+# 流水线式视频处理：解码 -> 批量推理 -> 标注/编码 -> 按序输出，各阶段独立线程，队列有界以形成背压
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import cv2
+
+from predict.workerPool import executor as get_executor
+from predict.metrics import STAGE_SECONDS, VIDEO_FRAMES_TOTAL
+from predict.renderer import get_renderer
+from predict.tracker import KeyframeTracker
+from predict.weightsManifest import weights_manifest
+
+_END = object()  # 阶段结束标记
+
+
+class StageStats:
+    """单个阶段的处理帧数与忙碌时间"""
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, frames, seconds):
+        with self._lock:
+            self.frames += frames
+            self.busy += seconds
+        VIDEO_FRAMES_TOTAL.inc(frames, stage=self.name)
+        STAGE_SECONDS.observe(seconds, endpoint='video', stage=self.name)
+
+    def to_dict(self, wall_time):
+        with self._lock:
+            return {
+                'frames': self.frames,
+                'fps': round(self.frames / wall_time, 2) if wall_time > 0 else 0.0,  # 实际吞吐
+                'busyFps': round(self.frames / self.busy, 2) if self.busy > 0 else 0.0  # 该阶段单独的处理能力
+            }
+
+
+class VideoPipeline:
+    def __init__(self, cap, weights_path, conf, frame_size=(640, 480), batch_size=4, queue_size=16,
+                 encode_workers=2, video_writer=None, font_path=None, jpeg_quality=80, imgsz=None,
+                 tracking=None, prefetched=None):
+        """
+        初始化视频流水线
+        :param cap: 已打开的 cv2.VideoCapture
+        :param weights_path: 权重文件路径（从模型注册表获取模型）
+        :param conf: 置信度阈值
+        :param frame_size: 输出帧尺寸 (宽, 高)，为 None 时保持原尺寸
+        :param batch_size: 推理阶段每批最多帧数
+        :param queue_size: 阶段之间队列的容量，队列满时上游阻塞（背压）
+        :param encode_workers: 标注/编码线程数
+        :param video_writer: 可选的视频写入器，按帧序写入
+        :param font_path: 标签字体路径（中文标签需要 TrueType 字体）
+        :param jpeg_quality: MJPEG 输出的 JPEG 质量
+        :param imgsz: 推理尺寸，为 None 时使用模型默认值
+        :param tracking: 关键帧跟踪设置（KeyframeTracker 的参数，如 {'stride': 5}），为 None 时逐帧检测
+        :param prefetched: 已从 cap 读出、尚未处理的帧（如作物路由从不能定位的视频流中读取的第一帧），先于 cap 处理
+        """
+        self.cap = cap
+        self._prefetched = deque(prefetched or ())
+        self.weights_path = weights_path
+        self.conf = float(conf)
+        self.frame_size = frame_size
+        self.batch_size = batch_size
+        self.encode_workers = encode_workers
+        self.video_writer = video_writer
+        self.font_path = font_path
+        self.jpeg_quality = jpeg_quality
+        self.imgsz = imgsz
+        # 跟踪模式：只检测关键帧，中间帧由光流跟踪器平移检测框（推理阶段单线程按帧序处理，状态无需加锁）
+        self.tracker = KeyframeTracker(**tracking) if tracking else None
+
+        self._decode_q = queue.Queue(maxsize=queue_size)
+        self._infer_q = queue.Queue(maxsize=queue_size)
+        self._encode_q = queue.Queue(maxsize=queue_size)
+        self._out_q = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+        self.error = None
+        self.stats = {name: StageStats(name) for name in ('decode', 'infer', 'encode', 'emit')}
+        self._start_time = None
+        self._detect_seconds = 0.0
+
+    def start(self):
+        """启动所有阶段线程"""
+        self._start_time = time.time()
+        targets = [self._decode_stage, self._infer_stage, self._emit_stage]
+        targets += [self._encode_stage] * self.encode_workers
+        for target in targets:
+            thread = threading.Thread(target=self._guard, args=(target,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def frames(self):
+        """按原始帧序逐个产出 JPEG 字节；调用方关闭生成器时整条流水线随之停止"""
+        if self._start_time is None:
+            self.start()
+        try:
+            while True:
+                item = self._get(self._out_q)
+                if item is _END or item is None:
+                    break
+                yield item
+        finally:
+            self.stop()
+
+    def stop(self, timeout=5):
+        """停止流水线并等待线程退出"""
+        self._stop.set()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=timeout)
+
+    def report(self):
+        """各阶段吞吐（帧/秒）"""
+        wall = time.time() - self._start_time if self._start_time else 0.0
+        report = {name: stat.to_dict(wall) for name, stat in self.stats.items()}
+        if self.tracker is not None:
+            report['tracking'] = self.tracker.report(weights_manifest.labels(self.weights_path), self._detect_seconds)
+        return report
+
+    # ---------------- 各阶段 ----------------
+
+    def _decode_stage(self):
+        index = 0
+        while not self._stop.is_set():
+            start = time.time()
+            if self._prefetched:
+                ret, frame = True, self._prefetched.popleft()
+            else:
+                ret, frame = self.cap.read()
+            if not ret:
+                break
+            if self.frame_size:
+                frame = cv2.resize(frame, self.frame_size)
+            self.stats['decode'].add(1, time.time() - start)
+            if not self._put(self._decode_q, (index, frame)):
+                return
+            index += 1
+        self._put(self._decode_q, _END)
+
+    def _infer_stage(self):
+        kwargs = dict(conf=self.conf, half=False, device='cpu', verbose=False)
+        if self.imgsz:
+            kwargs['imgsz'] = self.imgsz
+        executor = get_executor()
+        max_inflight = getattr(executor, 'workers', 1)
+        inflight = deque()  # (批次, 跟踪计划, Future, 提交时间)，按提交顺序取结果以保持帧序
+        finished = False
+        while not finished and not self._stop.is_set():
+            first = self._get(self._decode_q)
+            if first is _END or first is None:
+                break
+            batch = [first]
+            # 已解码好的帧直接凑批，不额外等待
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._decode_q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _END:
+                    finished = True
+                    break
+                batch.append(item)
+
+            frames = [frame for _, frame in batch]
+            plans = None
+            if self.tracker is not None:
+                # 只把关键帧（和抽检帧）送去推理，其余帧在取回结果时按帧序由跟踪器生成检测框
+                plans = self.tracker.plan(frames)
+                frames = [frame for frame, (role, _) in zip(frames, plans) if role is not None]
+            if not frames:
+                future = Future()
+                future.set_result([])
+                inflight.append((batch, plans, future, time.time()))
+            elif hasattr(executor, 'submit'):
+                # 多进程推理池：同时把多个批次分发到不同进程，不等待上一批完成
+                inflight.append((batch, plans, executor.submit(self.weights_path, frames, **kwargs), time.time()))
+            else:
+                future = Future()
+                start = time.time()
+                future.set_result(executor.predict_boxes(self.weights_path, frames, **kwargs))
+                inflight.append((batch, plans, future, start))
+            if not self._drain(inflight, max_inflight):
+                return
+        if not self._drain(inflight, 0):
+            return
+        for _ in range(self.encode_workers):
+            self._put(self._infer_q, _END)
+
+    def _drain(self, inflight, limit):
+        """按提交顺序取回已提交批次的结果，直到在途批次数不超过 limit"""
+        while len(inflight) > limit:
+            batch, plans, future, start = inflight.popleft()
+            boxes = future.result()
+            self.stats['infer'].add(len(batch), time.time() - start)
+            if plans is not None:
+                self._detect_seconds += time.time() - start
+                boxes = self.tracker.consume(plans, boxes)
+            for (index, frame), frame_boxes in zip(batch, boxes):
+                if not self._put(self._infer_q, (index, frame, frame_boxes)):
+                    return False
+        return True
+
+    def _encode_stage(self):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        # 标签图块按权重缓存，类别标签（带中文）来自权重清单
+        renderer = get_renderer(self.weights_path, weights_manifest.labels(self.weights_path), self.font_path)
+        while not self._stop.is_set():
+            item = self._get(self._infer_q)
+            if item is _END or item is None:
+                break
+            index, frame, boxes = item
+            start = time.time()
+            # 解码出的帧之后不再使用，直接在原帧上绘制
+            annotated = renderer.draw(frame, boxes, inplace=True)
+            _, jpeg = cv2.imencode('.jpg', annotated, params)
+            self.stats['encode'].add(1, time.time() - start)
+            if not self._put(self._encode_q, (index, annotated, jpeg.tobytes())):
+                return
+        self._put(self._encode_q, _END)
+
+    def _emit_stage(self):
+        """多个编码线程的输出可能乱序，这里按帧号重排后写入视频并交给 MJPEG 输出"""
+        pending = {}
+        next_index = 0
+        ended = 0
+        while ended < self.encode_workers and not self._stop.is_set():
+            item = self._get(self._encode_q)
+            if item is None:
+                break
+            if item is _END:
+                ended += 1
+                continue
+            pending[item[0]] = item
+            while next_index in pending:
+                _, annotated, jpeg = pending.pop(next_index)
+                start = time.time()
+                if self.video_writer is not None:
+                    self.video_writer.write(annotated)
+                self.stats['emit'].add(1, time.time() - start)
+                if not self._put(self._out_q, jpeg):
+                    return
+                next_index += 1
+        self._put(self._out_q, _END)
+
+    # ---------------- 工具方法 ----------------
+
+    def _guard(self, target):
+        """阶段异常时记录错误并停止整条流水线"""
+        try:
+            target()
+        except Exception as e:
+            print(f"视频流水线阶段 {target.__name__} 出错: {e}")
+            self.error = e
+            self._stop.set()
+
+    def _put(self, q, item):
+        """带停止检查的阻塞 put，队列满时形成背压"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """带停止检查的阻塞 get，停止时返回 None"""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
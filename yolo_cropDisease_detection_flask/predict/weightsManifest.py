@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# @File : weightsManifest.py
+# 权重清单：扫描一次 weights 目录，把每个 .pt 的类别名、训练输入尺寸、文件哈希和已导出的产物记录到
+# weights/manifest.json；之后 /file_names 和标签查询直接读清单，不必加载模型（也就不必在启动时导入 torch）
+#
+# 用法（在 flask 项目根目录执行，预先建好清单）：
+#   python -m predict.weightsManifest --weights-root ./weights
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+MANIFEST_NAME = 'manifest.json'
+
+# 各作物类别的中文名称；按规范化的英文类别名匹配模型输出的类别，模型头的类别顺序以清单为准
+LEGACY_LABELS = {
+    'rice': ['Brown_Spot（褐斑病）', 'Rice_Blast（稻瘟病）', 'Bacterial_Blight（细菌性叶枯病）'],
+    'corn': ['blight（疫病）', 'common_rust（普通锈病）', 'gray_spot（灰斑病）', 'health（健康）'],
+    'strawberry': ['Angular Leafspot（角斑病）', ' Anthracnose Fruit Rot（炭疽果腐病）', 'Blossom Blight（花枯病）',
+                   'Gray Mold（灰霉病）', 'Leaf Spot（叶斑病）', 'Powdery Mildew Fruit（白粉病果）',
+                   'Powdery Mildew Leaf（白粉病叶）'],
+    'tomato': ['Early Blight（早疫病）', 'Healthy（健康）', 'Late Blight（晚疫病）', 'Leaf Miner（潜叶病）',
+               'Leaf Mold（叶霉病）', 'Mosaic Virus（花叶病毒）', 'Septoria（壳针孢属）', 'Spider Mites（蜘蛛螨）',
+               'Yellow Leaf Curl Virus（黄化卷叶病毒	）']
+}
+
+# 权重目录不存在或为空时 /file_names 返回的默认列表（与旧版接口一致）
+DEFAULT_WEIGHTS = ['corn_best.pt', 'rice_best.pt', 'strawberry_best.pt', 'tomato_best.pt']
+
+
+def _normalize(name):
+    """'Brown_Spot（褐斑病）'、'brown spot' -> 'brownspot'"""
+    name = re.split(r'[（(]', str(name))[0]
+    return re.sub(r'[\s_\-]+', '', name).lower()
+
+
+_TRANSLATIONS = {_normalize(label): label.strip() for labels in LEGACY_LABELS.values() for label in labels}
+
+
+def display_label(name):
+    """模型类别名 -> 带中文的显示标签；没有对应中文名时原样返回"""
+    return _TRANSLATIONS.get(_normalize(name), str(name))
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def inspect_weights(path):
+    """加载一次 .pt，读取类别名、任务类型和训练时的输入尺寸（需要 ultralytics）"""
+    from ultralytics import YOLO
+
+    model = YOLO(path)
+    names = model.names
+    names = [names[i] for i in sorted(names)] if isinstance(names, dict) else list(names)
+    train_args = (getattr(model, 'ckpt', None) or {}).get('train_args') or {}
+    imgsz = train_args.get('imgsz') or model.overrides.get('imgsz') or 640
+    return {'task': model.task, 'names': names, 'imgsz': imgsz}
+
+
+def _exports(weights_path):
+    """权重旁边已有的导出产物（OpenVINO / ONNX / TorchScript / INT8），以及是否比 .pt 新"""
+    from predict.backends import BACKENDS, artifact_size
+
+    mtime = os.path.getmtime(weights_path)
+    found = {}
+    for backend in BACKENDS.values():
+        if backend.export_format is None:
+            continue
+        target = os.path.splitext(weights_path)[0] + backend.suffix
+        if os.path.exists(target):
+            found[backend.name] = {
+                'path': os.path.basename(target),
+                'sizeMB': round(artifact_size(target) / 1024 / 1024, 2),
+                'fresh': os.path.getmtime(target) >= mtime
+            }
+    return found
+
+
+class WeightsManifest:
+    def __init__(self, weights_root=None):
+        """
+        :param weights_root: 权重目录，清单保存为 <weights_root>/manifest.json
+        """
+        self.weights_root = weights_root
+        self._entries = {}  # 权重文件名 -> 清单条目
+        self._lock = threading.Lock()
+        self._refreshing = None
+
+    @property
+    def path(self):
+        return os.path.join(self.weights_root, MANIFEST_NAME)
+
+    def load(self, weights_root=None):
+        """读取已有的清单文件（不加载模型）"""
+        if weights_root:
+            self.weights_root = weights_root
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f).get('weights', {})
+        except (OSError, ValueError):
+            entries = {}
+        with self._lock:
+            self._entries = entries
+        return self
+
+    def refresh(self, background=False):
+        """
+        扫描权重目录：新增或改动（大小/修改时间变化）的权重才重新计算哈希并加载模型读取类别名，
+        未改动的只更新导出产物信息；background 为 True 时在后台线程执行，不阻塞服务启动
+        """
+        if background:
+            if self._refreshing is None or not self._refreshing.is_alive():
+                self._refreshing = threading.Thread(target=self.refresh, name='weights-manifest', daemon=True)
+                self._refreshing.start()
+            return self
+        if not self.weights_root or not os.path.isdir(self.weights_root):
+            print(f"模型目录不存在，跳过清单扫描: {self.weights_root}")
+            return self
+        start = time.time()
+        names = sorted(f for f in os.listdir(self.weights_root) if f.endswith('.pt'))
+        with self._lock:
+            entries = {name: dict(self._entries[name]) for name in names if name in self._entries}
+        changed = 0
+        for name in names:
+            path = os.path.join(self.weights_root, name)
+            stat = os.stat(path)
+            entry = entries.get(name)
+            if entry is None or entry.get('size') != stat.st_size or entry.get('mtime') != stat.st_mtime:
+                entry = {'name': name, 'kind': name.split('_')[0], 'size': stat.st_size, 'mtime': stat.st_mtime,
+                         'sha256': file_sha256(path)}
+                try:
+                    info = inspect_weights(path)
+                    entry.update(info, labels=[display_label(n) for n in info['names']])
+                except Exception as e:
+                    print(f"读取权重 {name} 的类别信息失败: {e}")
+                changed += 1
+            entry['exports'] = _exports(path)
+            entries[name] = entry
+        with self._lock:
+            self._entries = entries
+        self._save(entries)
+        print(f"权重清单已更新：{len(entries)} 个权重，{changed} 个重新索引，用时 {time.time() - start:.2f}s")
+        return self
+
+    def weights(self):
+        """清单中的权重（按文件名排序）；目录为空时返回默认列表"""
+        with self._lock:
+            entries = [self._entries[name] for name in sorted(self._entries)]
+        if entries:
+            return entries
+        names = []
+        if self.weights_root and os.path.isdir(self.weights_root):
+            names = sorted(f for f in os.listdir(self.weights_root) if f.endswith('.pt'))
+        return [{'name': name, 'kind': name.split('_')[0]} for name in names or DEFAULT_WEIGHTS]
+
+    def entry(self, weights_path):
+        """按权重路径（也可以是导出产物或 INT8 模型路径）查找清单条目"""
+        return self._entries.get(self._weights_name(weights_path))
+
+    def labels(self, weights_path, kind=None):
+        """
+        显示用的类别标签（按模型头的类别顺序）
+        查找顺序：清单 -> 按 kind 的中文名称表（清单尚未建好时） -> 已加载模型的类别名
+        """
+        entry = self.entry(weights_path)
+        if entry and entry.get('labels'):
+            return entry['labels']
+        if kind in LEGACY_LABELS:
+            return LEGACY_LABELS[kind]
+        from predict.workerPool import executor
+        names = executor().names(weights_path)
+        names = [names[i] for i in sorted(names)] if isinstance(names, dict) else list(names)
+        return [display_label(n) for n in names]
+
+    def imgsz(self, weights_path, default=640):
+        entry = self.entry(weights_path)
+        imgsz = entry.get('imgsz') if entry else None
+        return imgsz[0] if isinstance(imgsz, (list, tuple)) else (imgsz or default)
+
+    @staticmethod
+    def _weights_name(weights_path):
+        """'rice_best_int8.onnx'、'rice_best.onnx'、'rice_best_openvino_model' -> 'rice_best.pt'"""
+        name = os.path.basename(os.path.normpath(weights_path))
+        if name.endswith('.pt'):
+            return name
+        for suffix in ('_int8.onnx', '_openvino_model', '.onnx', '.torchscript'):
+            if name.endswith(suffix):
+                return name[:-len(suffix)] + '.pt'
+        return name
+
+    def _save(self, entries):
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'updatedAt': time.strftime('%Y-%m-%d %H:%M:%S'), 'weights': entries}, f,
+                          ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"保存权重清单失败: {e}")
+
+
+# 全局单例；main.py 启动时 load() 已有清单并在后台 refresh()
+weights_manifest = WeightsManifest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成权重清单 weights/manifest.json')
+    parser.add_argument('--weights-root', default='./weights')
+    args = parser.parse_args()
+    weights_manifest.load(args.weights_root).refresh()
+    for entry in weights_manifest.weights():
+        print(f"{entry['name']}: {len(entry.get('names', []))} 类，imgsz={entry.get('imgsz')}，"
+              f"sha256={entry.get('sha256', '')[:12]}，导出 {sorted(entry.get('exports', {}))}")
+
+
+if __name__ == '__main__':
+    main()
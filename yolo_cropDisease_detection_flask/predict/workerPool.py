@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# @File : workerPool.py
+# 多进程推理池：预先启动若干推理进程，每个进程有独立的 torch 线程预算，可绑定 CPU 核心并预加载模型；
+# 调度器按权重亲和性（已加载该模型的进程优先）和排队长度分发图片/视频批次，推理不再受单个解释器的 GIL 限制
+#
+# 注意：本模块顶层不导入 torch/ultralytics，子进程在设置线程数和 CPU 亲和性之后才加载它们
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from predict.metrics import metrics
+
+WORKER_JOBS_TOTAL = metrics.counter('yolo_worker_jobs_total', '推理进程完成的批次数', ('worker', 'result'))
+WORKER_JOB_SECONDS = metrics.histogram('yolo_worker_job_seconds', '推理进程单个批次的推理耗时（秒）', ('worker',))
+
+
+def _worker_main(index, threads, cores, preload, backend, request_q, result_q):
+    """推理进程入口"""
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # 已经初始化过并行后端时不能再修改
+
+    from predict.modelRegistry import model_registry
+    model_registry.backend = backend
+    for path in preload:
+        try:
+            model_registry.get(path)
+            result_q.put(('loaded', index, path, model_registry.names(path)))
+        except Exception as e:
+            print(f"推理进程 {index} 预加载 {path} 失败: {e}")
+    result_q.put(('ready', index, None, None))
+
+    while True:
+        message = request_q.get()
+        if message is None:
+            break
+        job_id, weights_path, images, kwargs = message
+        start = time.perf_counter()
+        try:
+            boxes = model_registry.predict_boxes(weights_path, images, **kwargs)
+            result_q.put(('ok', index, job_id, (boxes, model_registry.names(weights_path),
+                                                time.perf_counter() - start)))
+        except Exception as e:
+            result_q.put(('error', index, job_id, f"{type(e).__name__}: {e}"))
+
+
+class _WorkerHandle:
+    """父进程中记录的单个推理进程状态"""
+
+    def __init__(self, index, cores):
+        self.index = index
+        self.cores = cores
+        self.process = None
+        self.request_q = None
+        self.outstanding = {}  # job_id -> (Future, 权重路径)
+        self.weights = set()  # 已加载（或已分配过任务）的权重
+        self.completed = 0
+        self.busy = 0.0
+
+
+class InferenceWorkerPool:
+    def __init__(self, workers=None, threads_per_worker=None, pin_cores=False, preload=(), backend='auto',
+                 affinity_slack=2):
+        """
+        初始化多进程推理池
+        :param workers: 推理进程数，默认 CPU 核心数 // threads_per_worker
+        :param threads_per_worker: 每个进程的 torch 线程数，默认 2（小模型单图推理超过 2~4 线程收益很小）
+        :param pin_cores: 是否把每个进程绑定到互不重叠的 CPU 核心（仅 Linux）
+        :param preload: 每个进程启动时预加载的权重路径
+        :param backend: 推理后端（同 ModelRegistry）
+        :param affinity_slack: 已加载该权重的进程比最空闲的进程多排队超过该数量时，改派给最空闲的进程
+        """
+        cpu_count = os.cpu_count() or 4
+        self.threads_per_worker = threads_per_worker or 2
+        self.workers = workers or max(1, cpu_count // self.threads_per_worker)
+        self.pin_cores = pin_cores
+        self.preload = [os.path.abspath(p) for p in preload]
+        self.backend = backend
+        self.affinity_slack = affinity_slack
+        self._ctx = multiprocessing.get_context('spawn')  # fork 会复制父进程中的线程和 torch 状态，不安全
+        self._result_q = self._ctx.Queue()
+        self._handles = []
+        self._names = {}  # 权重路径 -> 类别名，供父进程绘制标签
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._ready_count = 0
+        self._closed = False
+        cores = list(range(cpu_count))
+        for i in range(self.workers):
+            pinned = None
+            if pin_cores:
+                pinned = cores[(i * self.threads_per_worker) % cpu_count:][:self.threads_per_worker] or None
+            self._handles.append(_WorkerHandle(i, pinned))
+
+    def start(self, wait=True, timeout=600):
+        """启动所有推理进程；wait 为 True 时等待预加载完成"""
+        for handle in self._handles:
+            self._spawn(handle)
+        threading.Thread(target=self._collect, name='worker-results', daemon=True).start()
+        threading.Thread(target=self._monitor, name='worker-monitor', daemon=True).start()
+        if wait:
+            self._ready.wait(timeout)
+        print(f"推理进程池已启动：{self.workers} 个进程 × {self.threads_per_worker} 线程"
+              f"{'（已绑定核心）' if self.pin_cores else ''}")
+        return self
+
+    def submit(self, weights_path, images, **kwargs):
+        """提交一批图片，返回 Future，结果为每张图片的检测框列表"""
+        weights_path = os.path.abspath(weights_path)
+        future = Future()
+        job_id = next(self._ids)
+        with self._lock:
+            handle = self._choose(weights_path)
+            handle.outstanding[job_id] = (future, weights_path)
+            handle.weights.add(weights_path)
+            request_q = handle.request_q
+        request_q.put((job_id, weights_path, list(images), kwargs))
+        return future
+
+    def predict_boxes(self, weights_path, images, **kwargs):
+        """与 ModelRegistry.predict_boxes 相同的同步接口"""
+        return self.submit(weights_path, images, **kwargs).result()
+
+    def names(self, weights_path):
+        weights_path = os.path.abspath(weights_path)
+        names = self._names.get(weights_path)
+        if names is None:
+            # 尚未有进程加载过该权重：用一张空白图推理一次，顺带让某个进程加载模型
+            import numpy as np
+            self.predict_boxes(weights_path, [np.zeros((64, 64, 3), dtype=np.uint8)], verbose=False)
+            names = self._names[weights_path]
+        return names
+
+    def stats(self):
+        with self._lock:
+            return [{
+                'worker': h.index,
+                'pid': h.process.pid if h.process else None,
+                'alive': bool(h.process and h.process.is_alive()),
+                'cores': h.cores,
+                'queued': len(h.outstanding),
+                'completed': h.completed,
+                'busySeconds': round(h.busy, 2),
+                'weights': sorted(os.path.basename(w) for w in h.weights)
+            } for h in self._handles]
+
+    def queue_depth(self):
+        with self._lock:
+            return {(str(h.index),): len(h.outstanding) for h in self._handles}
+
+    def shutdown(self):
+        self._closed = True
+        for handle in self._handles:
+            if handle.request_q is not None:
+                handle.request_q.put(None)
+        for handle in self._handles:
+            if handle.process is not None:
+                handle.process.join(timeout=5)
+
+    def _choose(self, weights_path):
+        """权重亲和性优先：在已加载该权重的进程中选排队最短的，除非它比全局最空闲的进程多排 affinity_slack 个以上"""
+        alive = [h for h in self._handles if h.process is not None and h.process.is_alive()] or self._handles
+        least = min(alive, key=lambda h: len(h.outstanding))
+        affine = [h for h in alive if weights_path in h.weights]
+        if affine:
+            best = min(affine, key=lambda h: len(h.outstanding))
+            if len(best.outstanding) - len(least.outstanding) <= self.affinity_slack:
+                return best
+        return least
+
+    def _spawn(self, handle):
+        handle.request_q = self._ctx.Queue()
+        handle.process = self._ctx.Process(
+            target=_worker_main, name=f'inference-{handle.index}', daemon=True,
+            args=(handle.index, self.threads_per_worker, handle.cores, self.preload, self.backend,
+                  handle.request_q, self._result_q))
+        handle.process.start()
+        handle.weights = set(self.preload)
+
+    def _collect(self):
+        """接收各进程的结果并完成对应的 Future"""
+        while not self._closed:
+            try:
+                kind, index, job_id, payload = self._result_q.get(timeout=1)
+            except queue.Empty:
+                continue
+            handle = self._handles[index]
+            if kind == 'loaded':
+                self._names[job_id] = payload
+                continue
+            if kind == 'ready':
+                with self._lock:
+                    self._ready_count += 1
+                    if self._ready_count >= self.workers:
+                        self._ready.set()
+                continue
+            with self._lock:
+                future, weights_path = handle.outstanding.pop(job_id, (None, None))
+                handle.completed += 1
+                if future is not None and kind == 'ok':
+                    handle.busy += payload[2]  # 与 stats / 调度线程共用同一把锁
+            if future is None:
+                continue
+            if kind == 'ok':
+                boxes, names, seconds = payload
+                self._names[weights_path] = names
+                WORKER_JOB_SECONDS.observe(seconds, worker=index)
+                WORKER_JOBS_TOTAL.inc(worker=index, result='ok')
+                future.set_result(boxes)
+            else:
+                WORKER_JOBS_TOTAL.inc(worker=index, result='error')
+                future.set_exception(RuntimeError(payload))
+
+    def _monitor(self):
+        """推理进程意外退出时让其未完成的任务失败并重启该进程"""
+        while not self._closed:
+            time.sleep(2)
+            for handle in self._handles:
+                if self._closed or handle.process is None or handle.process.is_alive():
+                    continue
+                print(f"推理进程 {handle.index} 已退出（exitcode={handle.process.exitcode}），正在重启")
+                with self._lock:
+                    failed = list(handle.outstanding.values())
+                    handle.outstanding.clear()
+                    self._spawn(handle)
+                for future, _ in failed:
+                    WORKER_JOBS_TOTAL.inc(worker=handle.index, result='crashed')
+                    future.set_exception(RuntimeError(f"推理进程 {handle.index} 异常退出"))
+
+
+_active_pool = None
+
+
+def start_worker_pool(**kwargs):
+    """启动全局推理进程池，之后 executor() 返回该进程池"""
+    global _active_pool
+    _active_pool = InferenceWorkerPool(**kwargs).start()
+    metrics.gauge('yolo_worker_queue_depth', '各推理进程中排队的批次数', ('worker',)).set_function(
+        _active_pool.queue_depth)
+    return _active_pool
+
+
+def executor():
+    """当前的推理执行者：启用进程池时为进程池，否则为本进程的模型注册表（两者都提供 predict_boxes / names）"""
+    if _active_pool is not None:
+        return _active_pool
+    from predict.modelRegistry import model_registry
+    return model_registry
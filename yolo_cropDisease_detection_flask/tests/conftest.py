@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# 测试从 tests 目录运行时，把项目根目录加入 sys.path 以便导入 predict 包
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
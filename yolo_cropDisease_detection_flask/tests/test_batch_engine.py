@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# 微批推理引擎测试：用假的推理执行者代替模型，校验凑批、批大小上限、超时和错误分发
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import numpy as np
+import pytest
+
+import predict.batchEngine as batch_module
+from predict.batchEngine import BatchInferenceEngine
+
+
+class FakeExecutor:
+    """记录每次前向推理的图片数；每张图片返回一个检测框，conf 列写入图片编号便于核对"""
+
+    def __init__(self, block=None, error=None):
+        self.block = block
+        self.error = error
+        self.batches = []
+
+    def predict_boxes(self, weights_path, images, **kwargs):
+        if self.block is not None:
+            self.block.wait(5)
+        self.batches.append(len(images))
+        if self.error is not None:
+            raise self.error
+        return [np.array([[0, 0, 1, 1, float(img[0, 0, 0]), 0]], dtype=np.float32) for img in images]
+
+
+class FakePool(FakeExecutor):
+    """模拟多进程推理池：带 submit 接口，异步返回 Future"""
+
+    def submit(self, weights_path, images, **kwargs):
+        future = Future()
+        future.set_result(self.predict_boxes(weights_path, images, **kwargs))
+        return future
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    def install(executor):
+        monkeypatch.setattr(batch_module, 'executor', lambda: executor)
+        return executor
+    return install
+
+
+def image(n):
+    return np.full((4, 4, 3), n, dtype=np.uint8)
+
+
+def test_concurrent_requests_share_one_forward_pass(fake):
+    executor = fake(FakeExecutor())
+    engine = BatchInferenceEngine(max_batch_size=8, max_wait_ms=200)
+    futures = [engine.submit('w.pt', 0.5, image(i)) for i in range(3)]
+    results = [f.result(timeout=5) for f in futures]
+    assert executor.batches == [3]
+    for i, ((img, boxes), timing) in enumerate(results):
+        assert boxes[0, 4] == i  # 每个请求拿回自己那张图的结果
+        assert timing['batchSize'] == 3
+
+
+def test_batches_are_split_at_max_batch_size(fake):
+    executor = fake(FakeExecutor())
+    engine = BatchInferenceEngine(max_batch_size=2, max_wait_ms=200)
+    futures = [engine.submit('w.pt', 0.5, image(i)) for i in range(5)]
+    for f in futures:
+        f.result(timeout=5)
+    assert executor.batches == [2, 2, 1]
+
+
+def test_different_conf_is_never_batched_together(fake):
+    executor = fake(FakeExecutor())
+    engine = BatchInferenceEngine(max_batch_size=8, max_wait_ms=100)
+    futures = [engine.submit('w.pt', 0.5, image(0)), engine.submit('w.pt', 0.25, image(1))]
+    for f in futures:
+        f.result(timeout=5)
+    assert sorted(executor.batches) == [1, 1]
+
+
+def test_lone_request_runs_after_max_wait(fake):
+    executor = fake(FakeExecutor())
+    engine = BatchInferenceEngine(max_batch_size=8, max_wait_ms=50)
+    start = time.time()
+    (_, boxes), timing = engine.infer('w.pt', 0.5, image(7), timeout=5)
+    assert time.time() - start < 2
+    assert executor.batches == [1]
+    assert timing['batchSize'] == 1
+
+
+def test_infer_timeout_while_batch_is_running(fake):
+    release = threading.Event()
+    fake(FakeExecutor(block=release))
+    engine = BatchInferenceEngine(max_wait_ms=1)
+    with pytest.raises(TimeoutError):
+        engine.infer('w.pt', 0.5, image(0), timeout=0.05)
+    release.set()
+
+
+def test_inference_error_fails_every_request_in_batch(fake):
+    fake(FakeExecutor(error=RuntimeError('boom')))
+    engine = BatchInferenceEngine(max_wait_ms=100)
+    futures = [engine.submit('w.pt', 0.5, image(i)) for i in range(2)]
+    for f in futures:
+        with pytest.raises(RuntimeError, match='boom'):
+            f.result(timeout=5)
+
+
+def test_worker_pool_path_completes_futures(fake):
+    pool = fake(FakePool())
+    engine = BatchInferenceEngine(max_wait_ms=100)
+    futures = [engine.submit('w.pt', 0.5, image(i)) for i in range(2)]
+    assert [f.result(timeout=5)[0][1][0, 4] for f in futures] == [0, 1]
+    assert pool.batches == [2]
+
+
+def test_idle_group_is_reclaimed(fake):
+    fake(FakeExecutor())
+    engine = BatchInferenceEngine(max_wait_ms=1, idle_timeout=0.05)
+    engine.infer('w.pt', 0.5, image(0), timeout=5)
+    deadline = time.time() + 5
+    while engine._queues and time.time() < deadline:
+        time.sleep(0.02)
+    assert engine._queues == {}
+    assert engine.queue_depth() == 0
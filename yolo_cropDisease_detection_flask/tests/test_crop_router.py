@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import cv2
+import numpy as np
+
+from predict.cropRouter import sample_frames
+
+
+class FakeCapture:
+    """按帧序号返回纯色帧的视频；seekable=False 时模拟不能定位的网络流（帧数未知，set 失败）"""
+
+    def __init__(self, total=10, seekable=True):
+        self.total = total
+        self.seekable = seekable
+        self.position = 0
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.total if self.seekable else 0
+        return 0
+
+    def set(self, prop, value):
+        if not self.seekable:
+            return False
+        self.position = int(value)
+        return True
+
+    def read(self):
+        if self.position >= self.total:
+            return False, None
+        frame = np.full((4, 4, 3), self.position, dtype=np.uint8)
+        self.position += 1
+        return True, frame
+
+
+def test_sample_frames_rewinds_seekable_video():
+    cap = FakeCapture(total=10)
+    frames, prefetched = sample_frames(cap)
+    assert [int(f[0, 0, 0]) for f in frames] == [1, 5, 9]
+    assert prefetched == [] and cap.position == 0
+
+
+def test_sample_frames_hands_back_frame_from_stream():
+    cap = FakeCapture(total=10, seekable=False)
+    frames, prefetched = sample_frames(cap)
+    assert len(frames) == 1 and prefetched[0] is frames[0]
+    assert int(prefetched[0][0, 0, 0]) == 0 and cap.position == 1
+
+
+def test_sample_frames_empty_stream():
+    assert sample_frames(FakeCapture(total=0, seekable=False)) == ([], [])
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from predict.inputFetcher import InputFetcher, InputNotAllowedError
+
+
+def test_local_paths_rejected_by_default(tmp_path):
+    secret = tmp_path / 'secret.txt'
+    secret.write_bytes(b'secret')
+    fetcher = InputFetcher()
+    assert fetcher.is_allowed('http://example.com/a.jpg') and fetcher.is_allowed('https://example.com/a.jpg')
+    for source in (str(secret), '/etc/passwd', 'file:///etc/passwd'):
+        assert not fetcher.is_allowed(source)
+    with pytest.raises(InputNotAllowedError):
+        fetcher.fetch(str(secret))
+    with pytest.raises(InputNotAllowedError):
+        fetcher.open_video(str(secret))
+
+
+def test_local_roots_allow_only_their_subtree(tmp_path):
+    uploads = tmp_path / 'uploads'
+    uploads.mkdir()
+    (uploads / 'leaf.jpg').write_bytes(b'jpeg')
+    (tmp_path / 'outside.txt').write_bytes(b'secret')
+    os.symlink(tmp_path / 'outside.txt', uploads / 'link.jpg')
+    fetcher = InputFetcher(local_roots=[str(uploads)])
+    assert fetcher.fetch(str(uploads / 'leaf.jpg')) == b'jpeg'
+    for source in (uploads / '..' / 'outside.txt', uploads / 'link.jpg', tmp_path / 'uploads_other' / 'x.jpg'):
+        with pytest.raises(InputNotAllowedError):
+            fetcher.fetch(str(source))
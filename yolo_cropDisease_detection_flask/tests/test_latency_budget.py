@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from predict.latencyBudget import LatencyPlanner, parse_budget
+from predict.quantize import int8_path
+
+
+@pytest.fixture
+def planner(tmp_path):
+    weights = tmp_path / 'corn_best.pt'
+    weights.write_bytes(b'pt')
+    quantized = int8_path(str(weights))
+    with open(quantized, 'wb') as f:
+        f.write(b'onnx')
+    os.utime(quantized, (os.path.getmtime(weights) + 1,) * 2)
+    planner = LatencyPlanner(profile_path=str(tmp_path / 'profile.json'), imgsz_candidates=(320, 640, 800))
+    planner._profiles['corn_best.pt'] = {
+        'key': planner._profile_key(str(weights)),
+        'options': {'fp32:320': 20.0, 'fp32:640': 60.0, 'fp32:800': 95.0,
+                    'int8:320': 8.0, 'int8:640': 25.0, 'int8:800': 40.0},
+        'tileMs': {}
+    }
+    return planner, str(weights)
+
+
+def test_parse_budget_rejects_invalid_values():
+    assert parse_budget() is None
+    assert parse_budget('150', 'FAST') == {'budget_ms': 150.0, 'tier': 'fast'}
+    for budget, tier in (('abc', None), ('-5', None), (None, 'turbo')):
+        with pytest.raises(ValueError):
+            parse_budget(budget, tier)
+
+
+@pytest.mark.parametrize('tier', ['fast', 'balanced', 'accurate'])
+@pytest.mark.parametrize('variant', ['fp32', 'int8'])
+def test_choose_honors_requested_variant(planner, tier, variant):
+    planner, weights = planner
+    choice = planner.choose(weights, (480, 640), tier=tier, variant=variant, allow_tiling=False)
+    assert choice['variant'] == variant
+    assert choice['modelPath'].endswith('.onnx') == (variant == 'int8')
+
+
+def test_balanced_caps_at_requested_variant_640(planner):
+    planner, weights = planner
+    assert planner.choose(weights, tier='balanced', variant='int8', allow_tiling=False)['imgsz'] == 640
+    # 不指定变体时以 fp32@640 为上限，更快的 int8@800 也可以选
+    choice = planner.choose(weights, tier='balanced', allow_tiling=False)
+    assert (choice['variant'], choice['imgsz']) == ('int8', 800)
+
+
+def test_budget_limits_choice(planner):
+    planner, weights = planner
+    choice = planner.choose(weights, budget_ms=30, variant='fp32', allow_tiling=False)
+    assert (choice['variant'], choice['imgsz']) == ('fp32', 320)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# ModelRegistry 加载锁清理测试：用假的 _load 代替真实模型加载
+import pytest
+
+from predict.modelRegistry import ModelEntry, ModelRegistry
+
+
+class FakeBackend:
+    name = 'pytorch'
+    max_batch = None
+
+
+def make_registry(fail=False):
+    registry = ModelRegistry()
+
+    def fake_load(path, mtime):
+        if fail:
+            raise RuntimeError('load failed')
+        return ModelEntry(path, mtime, object(), 0, FakeBackend())
+
+    registry._load = fake_load
+    return registry
+
+
+def test_loading_lock_removed_after_success(tmp_path):
+    weights = tmp_path / 'a.pt'
+    weights.write_bytes(b'x')
+    registry = make_registry()
+    registry.get(str(weights))
+    assert registry._loading == {}
+    assert len(registry._entries) == 1
+
+
+def test_loading_lock_removed_after_failure(tmp_path):
+    weights = tmp_path / 'a.pt'
+    weights.write_bytes(b'x')
+    registry = make_registry(fail=True)
+    with pytest.raises(RuntimeError):
+        registry.get(str(weights))
+    assert registry._loading == {}
+    assert len(registry._entries) == 0
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from predict import motionGate
+from predict.motionGate import MotionGate, dhash, parse_motion_gate
+
+
+def _frame(value=100, block=None):
+    frame = np.full((240, 320, 3), value, dtype=np.uint8)
+    if block is not None:
+        x, y = block
+        frame[y:y + 80, x:x + 80] = 255
+    return frame
+
+
+def test_dhash_is_64_bits_and_stable():
+    gray = np.tile(np.arange(64, dtype=np.uint8) * 4, (48, 1))
+    digest = dhash(gray)
+    assert digest.dtype == np.uint8 and digest.shape == (8,)
+    np.testing.assert_array_equal(digest, dhash(gray.copy()))
+    assert not np.array_equal(digest, dhash(gray[:, ::-1].copy()))
+
+
+@pytest.mark.parametrize('method', ['diff', 'hash'])
+def test_gate_skips_static_and_infers_on_motion(method):
+    gate = MotionGate(method=method, refresh_seconds=None)
+    assert gate.check(_frame(block=(20, 20))) == (True, 'first')
+    assert gate.check(_frame(block=(20, 20))) == (False, 'static')
+    assert gate.check(_frame(block=(200, 140))) == (True, 'motion')
+    stats = gate.stats()
+    assert stats['inferred'] == 2 and stats['skipped'] == 1
+
+
+def test_gate_threshold_ignores_small_changes():
+    gate = MotionGate(method='diff', threshold=0.5, refresh_seconds=None)
+    gate.check(_frame())
+    assert gate.check(_frame(block=(20, 20))) == (False, 'static')  # 变化区域约占 8%，低于阈值
+
+
+def test_gate_refresh_by_frames():
+    gate = MotionGate(refresh_seconds=None, refresh_frames=3)
+    decisions = [gate.check(_frame())[1] for _ in range(7)]
+    assert decisions == ['first', 'static', 'static', 'refresh', 'static', 'static', 'refresh']
+
+
+def test_gate_refresh_by_seconds(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(motionGate.time, 'time', lambda: now[0])
+    gate = MotionGate(refresh_seconds=1.0)
+    assert gate.check(_frame())[1] == 'first'
+    now[0] += 0.5
+    assert gate.check(_frame())[1] == 'static'
+    now[0] += 0.6
+    assert gate.check(_frame())[1] == 'refresh'
+
+
+def test_parse_motion_gate():
+    assert parse_motion_gate('false') is None
+    assert parse_motion_gate('true') == {'method': 'diff'}
+    assert parse_motion_gate('hash:8:2') == {'method': 'hash', 'threshold': 8.0, 'refresh_seconds': 2.0}
+    for value in ('optical', 'diff:abc', 'hash:8:soon'):
+        with pytest.raises(ValueError):
+            parse_motion_gate(value)
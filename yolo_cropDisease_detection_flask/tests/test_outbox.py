@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# 发件箱测试：本地起一个假的 Spring Boot 记录接口，校验重试、移入 failed、合并批量和逐条回退
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from predict.outbox import Outbox
+from predict.predictImg import build_img_record
+
+NUMERIC_FIELDS = ('conf', 'confidence', 'allTime')  # ImgRecords 中为 BigDecimal 的字段
+
+
+class FakeBackend:
+    """记录收到的请求；fail_first 次请求返回 500，batch_status 控制 /batch 接口的状态码"""
+
+    def __init__(self, fail_first=0, batch_status=200):
+        self.fail_first = fail_first
+        self.batch_status = batch_status
+        self.requests = []  # (path, body)
+        self.saved = []
+        self.lock = threading.Lock()
+
+    def handle(self, path, body):
+        with self.lock:
+            self.requests.append((path, body))
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return 500
+            if path.endswith('/batch'):
+                if self.batch_status != 200:
+                    return self.batch_status
+                records = body
+            else:
+                records = [body]
+            # 与实体反序列化一致：数值字段不是数字时整个请求 400
+            if any(not isinstance(r.get(f), (int, float)) for r in records for f in NUMERIC_FIELDS):
+                return 400
+            self.saved.extend(records)
+            return 200
+
+
+@pytest.fixture
+def backend():
+    state = FakeBackend()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            status = state.handle(self.path, body)
+            payload = json.dumps({'code': 0 if status == 200 else status}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state.url = f'http://127.0.0.1:{server.server_address[1]}/imgRecords'
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def make_outbox(tmp_path, **kwargs):
+    kwargs.setdefault('workers', 1)
+    kwargs.setdefault('retry_backoff', 0.01)
+    kwargs.setdefault('batch_wait', 0.2)
+    kwargs.setdefault('timeout', 5)
+    return Outbox(spool_dir=str(tmp_path / 'outbox'), **kwargs)
+
+
+def make_record(label='稻瘟病'):
+    params = {'username': 'tester', 'weight': 'rice_best.pt', 'conf': '0.5',
+              'startTime': '2024-12-26 12:00:00', 'inputImg': 'http://x/a.jpg', 'kind': 'rice'}
+    return build_img_record(params, {'labels': [label], 'confidences': [0.91], 'allTime': 0.12})
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def failed_jobs(outbox):
+    return [n for n in os.listdir(outbox.failed_dir) if n.endswith('.json')]
+
+
+def test_img_record_matches_entity_types(backend, tmp_path):
+    record = make_record()
+    assert all(isinstance(record[f], float) for f in NUMERIC_FIELDS)
+    outbox = make_outbox(tmp_path)
+    outbox.post_record(backend.url, record)
+    assert wait_until(lambda: outbox.pending() == 0)
+    assert backend.saved == [record]
+
+
+def test_retry_until_backend_recovers(backend, tmp_path):
+    backend.fail_first = 2
+    outbox = make_outbox(tmp_path, max_retries=5)
+    outbox.post_record(backend.url, make_record())
+    assert wait_until(lambda: outbox.pending() == 0)
+    assert len(backend.requests) == 3
+    assert len(backend.saved) == 1
+    assert failed_jobs(outbox) == []
+
+
+def test_move_to_failed_after_max_retries(backend, tmp_path):
+    backend.fail_first = 100
+    outbox = make_outbox(tmp_path, max_retries=2)
+    job_id = outbox.post_record(backend.url, make_record())
+    assert wait_until(lambda: outbox.pending() == 0)
+    assert failed_jobs(outbox) == [f'{job_id}.json']
+    assert len(backend.requests) == 3  # 首次 + 2 次重试
+    with open(os.path.join(outbox.failed_dir, f'{job_id}.json'), encoding='utf-8') as f:
+        job = json.load(f)
+    assert job['attempts'] == 3
+    assert '500' in job['error']
+
+
+def test_records_for_same_url_are_batched(backend, tmp_path):
+    outbox = make_outbox(tmp_path)
+    for i in range(3):
+        outbox.post_record(backend.url, make_record(f'病害{i}'))
+    assert wait_until(lambda: outbox.pending() == 0)
+    assert [path for path, _ in backend.requests] == ['/imgRecords/batch']
+    assert sorted(r['label'] for r in backend.saved) == ['病害0', '病害1', '病害2']
+
+
+def test_rejected_batch_falls_back_to_single_records(backend, tmp_path):
+    outbox = make_outbox(tmp_path, max_retries=0)
+    bad = dict(make_record('坏记录'), confidence='91.00%')
+    ids = [outbox.post_record(backend.url, make_record('好记录')), outbox.post_record(backend.url, bad)]
+    assert wait_until(lambda: outbox.pending() == 0)
+    paths = [path for path, _ in backend.requests]
+    assert paths == ['/imgRecords/batch', '/imgRecords', '/imgRecords']
+    assert [r['label'] for r in backend.saved] == ['好记录']
+    assert failed_jobs(outbox) == [f'{ids[1]}.json']  # 只有格式不对的那条进入 failed
+
+
+def test_missing_batch_endpoint_sends_one_by_one(backend, tmp_path):
+    backend.batch_status = 404
+    outbox = make_outbox(tmp_path)
+    for i in range(2):
+        outbox.post_record(backend.url, make_record(f'病害{i}'))
+    assert wait_until(lambda: outbox.pending() == 0)
+    assert [path for path, _ in backend.requests] == ['/imgRecords/batch', '/imgRecords', '/imgRecords']
+    assert backend.url in outbox._batch_unsupported
+    assert len(backend.saved) == 2
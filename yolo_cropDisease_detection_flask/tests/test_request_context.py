@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from predict.requestContext import RequestContext, SessionExistsError, SessionManager
+
+
+def _ctx(tmp_path, kind, session_id, username='admin'):
+    return RequestContext(kind, {'username': username}, runs_root=str(tmp_path), session_id=session_id)
+
+
+def test_register_rejects_duplicate_id(tmp_path):
+    sessions = SessionManager()
+    first = sessions.register(_ctx(tmp_path, 'camera', 'cam1'))
+    with pytest.raises(SessionExistsError):
+        sessions.register(_ctx(tmp_path, 'camera', 'cam1'))
+    sessions.unregister(_ctx(tmp_path, 'camera', 'cam1'))  # 其他同 ID 的上下文不能注销已登记的会话
+    assert sessions.get('cam1') is first
+
+
+def test_stop_only_targets_requested_kind(tmp_path):
+    sessions = SessionManager()
+    video = sessions.register(_ctx(tmp_path, 'video', 'job1'))
+    camera = sessions.register(_ctx(tmp_path, 'camera', 'cam1'))
+    assert sessions.stop('job1', kind='camera') == [] and not video.stopped
+    assert sessions.stop('cam1', kind='camera') == ['cam1'] and camera.stopped
+
+
+def test_find_by_kind_and_username(tmp_path):
+    sessions = SessionManager()
+    sessions.register(_ctx(tmp_path, 'camera', 'cam1', 'alice'))
+    sessions.register(_ctx(tmp_path, 'camera', 'cam2', 'bob'))
+    sessions.register(_ctx(tmp_path, 'video', 'job1', 'alice'))
+    assert [c.id for c in sessions.find('camera', 'alice')] == ['cam1']
+    assert len(sessions.find('camera')) == 2
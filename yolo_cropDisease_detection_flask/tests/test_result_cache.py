@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from predict.resultCache import DetectionCache
+
+BOXES = np.array([
+    [0, 0, 10, 10, 0.08, 0],
+    [10, 10, 20, 20, 0.3, 1],
+    [20, 20, 30, 30, 0.9, 2],
+], dtype=np.float32)
+
+
+def _weights(tmp_path, content=b'weights-v1'):
+    path = tmp_path / 'corn_best.pt'
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_make_key_depends_on_image_weights_and_size(tmp_path):
+    cache = DetectionCache()
+    weights = _weights(tmp_path)
+    key = cache.make_key(b'image', weights, 640)
+    assert key == cache.make_key(b'image', weights, 640)
+    assert key != cache.make_key(b'other', weights, 640)
+    assert key != cache.make_key(b'image', weights, 320)
+
+
+def test_rethreshold_cached_boxes():
+    cache = DetectionCache(base_conf=0.05)
+    cache.put('k', BOXES)
+    boxes = cache.get('k')
+    assert len(DetectionCache.filter(boxes, cache.base_conf)) == 3
+    np.testing.assert_array_equal(DetectionCache.filter(boxes, 0.25)[:, 5], [1, 2])
+    np.testing.assert_array_equal(DetectionCache.filter(boxes, 0.5)[:, 5], [2])
+    assert len(DetectionCache.filter(boxes, 0.95)) == 0
+    assert len(cache.get('k')) == 3  # 过滤不修改缓存中的原始框
+
+
+def test_miss_and_stats():
+    cache = DetectionCache()
+    assert cache.get('missing') is None
+    cache.put('k', BOXES)
+    cache.get('k')
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['entries'] == 1
+
+
+def test_disk_layer_survives_new_instance(tmp_path):
+    DetectionCache(disk_dir=str(tmp_path)).put('k', BOXES)
+    cache = DetectionCache(disk_dir=str(tmp_path))
+    np.testing.assert_array_equal(cache.get('k'), BOXES)
+    assert cache.stats()['disk_hits'] == 1
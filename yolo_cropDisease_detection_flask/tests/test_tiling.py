@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from predict.tiling import make_tiles, nms
+
+
+@pytest.mark.parametrize('width, height', [(1920, 1080), (1000, 1000), (641, 2000), (4000, 3000)])
+def test_make_tiles_covers_image_and_reaches_edges(width, height):
+    tiles = make_tiles(width, height, tile_size=640, overlap=0.2)
+    covered = np.zeros((height, width), dtype=bool)
+    for x1, y1, x2, y2 in tiles:
+        assert x2 - x1 == min(640, width) and y2 - y1 == min(640, height)
+        covered[y1:y2, x1:x2] = True
+    assert covered.all()
+    assert max(t[2] for t in tiles) == width
+    assert max(t[3] for t in tiles) == height
+
+
+def test_make_tiles_overlap_between_neighbours():
+    tiles = make_tiles(2000, 640, tile_size=640, overlap=0.25)
+    xs = sorted(x1 for x1, _, _, _ in tiles)
+    assert xs[0] == 0 and xs[-1] == 2000 - 640
+    for left, right in zip(xs, xs[1:]):
+        assert left + 640 - right >= 640 * 0.25  # 相邻切片至少重叠 overlap 比例（贴边的最后一块重叠更多）
+
+
+def test_make_tiles_small_image_is_single_tile():
+    assert make_tiles(320, 240, tile_size=640) == [(0, 0, 320, 240)]
+
+
+def test_nms_suppresses_overlapping_boxes():
+    boxes = np.array([
+        [0, 0, 100, 100, 0.9, 0],
+        [5, 5, 105, 105, 0.8, 0],
+        [300, 300, 400, 400, 0.7, 0],
+    ], dtype=np.float32)
+    kept = nms(boxes, iou_threshold=0.5)
+    np.testing.assert_array_equal(kept[:, 4], np.array([0.9, 0.7], dtype=np.float32))
+
+
+def test_nms_keeps_classes_apart():
+    boxes = np.array([
+        [0, 0, 100, 100, 0.9, 0],
+        [0, 0, 100, 100, 0.8, 1],
+    ], dtype=np.float32)
+    assert len(nms(boxes, iou_threshold=0.5, class_aware=True)) == 2
+    assert len(nms(boxes, iou_threshold=0.5, class_aware=False)) == 1
+
+
+def test_nms_empty_input():
+    assert nms(np.zeros((0, 6), dtype=np.float32)).shape == (0, 6)
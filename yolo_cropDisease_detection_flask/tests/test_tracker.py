@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from predict.tracker import KEY, KeyframeTracker, box_iou, greedy_match
+
+
+def test_box_iou_values():
+    a = np.array([[0, 0, 10, 10]], dtype=np.float32)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]], dtype=np.float32)
+    np.testing.assert_allclose(box_iou(a, b), [[1.0, 1 / 3, 0.0]], atol=1e-6)
+
+
+def test_box_iou_empty_inputs():
+    boxes = np.array([[0, 0, 10, 10]], dtype=np.float32)
+    empty = np.zeros((0, 4), dtype=np.float32)
+    assert box_iou(empty, boxes).shape == (0, 1)
+    assert box_iou(boxes, empty).shape == (1, 0)
+    assert box_iou(empty, empty).shape == (0, 0)
+
+
+def test_greedy_match_empty_inputs():
+    assert greedy_match(np.zeros((0, 3)), 0.3) == []
+    assert greedy_match(np.zeros((2, 0)), 0.3) == []
+
+
+def test_greedy_match_prefers_highest_iou_and_respects_threshold():
+    iou = np.array([
+        [0.6, 0.9],
+        [0.7, 0.1],
+        [0.2, 0.25],
+    ])
+    assert sorted(greedy_match(iou, 0.3)) == [(0, 1), (1, 0)]
+
+
+def _frames(count, width=160, height=120):
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    frame[40:80, 50:100] = 200
+    return [frame.copy() for _ in range(count)]
+
+
+def test_keyframe_tracker_stride_and_track_identity():
+    tracker = KeyframeTracker(stride=3, audit_every=0)
+    plans = tracker.plan(_frames(6))
+    assert [role for role, _ in plans] == [KEY, None, None, KEY, None, None]
+
+    box = [50, 40, 100, 80, 0.8, 1]
+    outputs = tracker.consume(plans, [[box], [box]])
+    assert len(outputs) == 6
+    assert all(len(out) == 1 for out in outputs)
+    assert len(tracker.tracks) == 1 and tracker.tracks[0].hits == 2
+
+    report = tracker.report()
+    assert report['frames'] == 6 and report['keyframes'] == 2 and report['propagatedFrames'] == 4
+
+
+def test_keyframe_tracker_votes_class_and_drops_missed_tracks():
+    tracker = KeyframeTracker(stride=1, audit_every=0, max_missed=2)
+    plans = tracker.plan(_frames(5))
+    box = [50, 40, 100, 80]
+    detections = [[box + [0.9, 0]], [box + [0.6, 1]], [box + [0.9, 0]], [], []]
+    tracker.consume(plans, detections)
+    assert tracker.tracks == []
+    track = tracker.report()['tracks'][0]
+    assert track['label'] == 0 and track['hits'] == 3
+
+
+def test_keyframe_tracker_caps_ended_tracks():
+    tracker = KeyframeTracker(stride=1, audit_every=0, max_missed=1, max_ended=3)
+    frames = _frames(40, width=1000)
+    # 每帧检测到一个位置不同（互不重叠）的新目标，上一帧的轨迹随即结束
+    detections = [[[i * 20, 10, i * 20 + 10, 20, 0.9, 0]] for i in range(40)]
+    tracker.consume(tracker.plan(frames), detections)
+    assert tracker._next_id == 41
+    assert 3 <= len(tracker._ended) <= 2 * 3
+    assert len(tracker.report()['tracks']) <= 2 * 3 + 1
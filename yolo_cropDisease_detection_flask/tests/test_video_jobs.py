@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from predict.requestContext import RequestContext
+from predict.videoJobs import (CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobExistsError, QueueFullError,
+                               VideoJobQueue)
+
+
+class BlockingRunner:
+    """运行中的任务阻塞到被取消或被放行，模拟会轮询停止标志的视频流水线"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, job):
+        self.started.set()
+        while not job.ctx.stopped and not self.release.is_set():
+            self.release.wait(0.01)
+
+
+def _ctx(tmp_path, job_id):
+    return RequestContext('video', {'weight': 'corn_best.pt'}, runs_root=str(tmp_path), session_id=job_id)
+
+
+def _wait_finished(job, timeout=5):
+    with job._cond:
+        assert job._cond.wait_for(lambda: job.finished, timeout=timeout)
+
+
+def test_queued_running_cancelled(tmp_path):
+    runner = BlockingRunner()
+    events = []
+    finished = threading.Event()
+
+    def on_update(job, event):
+        events.append((job.id, job.status))
+        if job.id == 'job1' and job.finished:
+            finished.set()
+
+    jobs = VideoJobQueue(runner, max_concurrent=1, on_update=on_update)
+    running = jobs.submit(_ctx(tmp_path, 'job1'))
+    assert runner.started.wait(5)
+    assert running.status == RUNNING
+
+    queued = jobs.submit(_ctx(tmp_path, 'job2'))
+    assert queued.status == QUEUED and jobs.position(queued) == 0
+
+    jobs.cancel('job2')
+    assert queued.status == CANCELLED and queued.ctx.stopped
+
+    jobs.cancel('job1')
+    assert finished.wait(5)
+    assert running.status == CANCELLED
+    assert ('job1', RUNNING) in events and ('job2', CANCELLED) in events and ('job1', CANCELLED) in events
+
+
+def test_done_and_failed(tmp_path):
+    def runner(job):
+        if job.id == 'bad':
+            raise RuntimeError('decode error')
+
+    jobs = VideoJobQueue(runner, max_concurrent=1)
+    good, bad = jobs.submit(_ctx(tmp_path, 'good')), jobs.submit(_ctx(tmp_path, 'bad'))
+    _wait_finished(good)
+    _wait_finished(bad)
+    assert good.status == DONE
+    assert bad.status == FAILED and 'decode error' in bad.error
+
+
+def test_rejects_duplicate_id_and_full_queue(tmp_path):
+    runner = BlockingRunner()
+    jobs = VideoJobQueue(runner, max_concurrent=1, max_queued=1)
+    first = jobs.submit(_ctx(tmp_path, 'job1'))
+    assert runner.started.wait(5)
+    with pytest.raises(JobExistsError):
+        jobs.submit(_ctx(tmp_path, 'job1'))
+
+    jobs.submit(_ctx(tmp_path, 'job2'))
+    with pytest.raises(QueueFullError):
+        jobs.submit(_ctx(tmp_path, 'job3'))
+
+    runner.release.set()
+    _wait_finished(first)
+    _wait_finished(jobs.get('job2'))
+    assert first.status == DONE
+    jobs.submit(_ctx(tmp_path, 'job1'))  # 同 ID 的任务结束后可以重新提交
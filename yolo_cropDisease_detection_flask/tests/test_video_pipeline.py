@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# 视频流水线测试：假的视频源和推理执行者，校验帧序、预读帧、提前关闭和阶段出错时的停止路径
+import itertools
+
+import numpy as np
+import pytest
+
+import predict.videoPipeline as pipeline_module
+from predict.videoPipeline import VideoPipeline
+
+NO_BOXES = np.zeros((0, 6), dtype=np.float32)
+
+
+class FakeCapture:
+    """按帧序号返回纯色帧；total 为 None 时是读不完的直播流，fail_at 帧抛出异常"""
+
+    def __init__(self, total=10, start=0, fail_at=None):
+        self.total = total
+        self.fail_at = fail_at
+        self.position = itertools.count(start)
+
+    def read(self):
+        index = next(self.position)
+        if index == self.fail_at:
+            raise IOError('decode failed')
+        if self.total is not None and index >= self.total:
+            return False, None
+        return True, np.full((16, 16, 3), index % 256, dtype=np.uint8)
+
+
+class FakeExecutor:
+    def __init__(self, error_after=None):
+        self.error_after = error_after
+        self.frames = 0
+
+    def predict_boxes(self, weights_path, images, **kwargs):
+        self.frames += len(images)
+        if self.error_after is not None and self.frames > self.error_after:
+            raise RuntimeError('inference failed')
+        return [NO_BOXES for _ in images]
+
+
+class FakeWriter:
+    def __init__(self):
+        self.written = []
+
+    def write(self, frame):
+        self.written.append(int(frame[0, 0, 0]))
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    fake = FakeExecutor()
+    monkeypatch.setattr(pipeline_module, 'get_executor', lambda: fake)
+    monkeypatch.setattr(pipeline_module.weights_manifest, 'labels', lambda *args, **kwargs: ['leaf'])
+    return fake
+
+
+def make_pipeline(cap, **kwargs):
+    kwargs.setdefault('frame_size', None)
+    kwargs.setdefault('batch_size', 3)
+    kwargs.setdefault('queue_size', 4)
+    return VideoPipeline(cap, 'fake.pt', 0.5, **kwargs)
+
+
+def assert_stopped(pipeline):
+    assert not any(thread.is_alive() for thread in pipeline._threads)
+
+
+def test_frames_are_emitted_in_order(executor):
+    writer = FakeWriter()
+    pipeline = make_pipeline(FakeCapture(total=20), video_writer=writer, encode_workers=3)
+    jpegs = list(pipeline.frames())
+    assert len(jpegs) == 20
+    assert writer.written == list(range(20))
+    assert executor.frames == 20
+    assert pipeline.error is None
+    assert pipeline.report()['emit']['frames'] == 20
+    assert_stopped(pipeline)
+
+
+def test_prefetched_frames_come_first(executor):
+    writer = FakeWriter()
+    prefetched = [np.full((16, 16, 3), 100, dtype=np.uint8)]
+    pipeline = make_pipeline(FakeCapture(total=3, start=1), video_writer=writer, prefetched=prefetched)
+    assert len(list(pipeline.frames())) == 3
+    assert writer.written == [100, 1, 2]
+
+
+def test_closing_the_generator_stops_a_live_stream(executor):
+    pipeline = make_pipeline(FakeCapture(total=None))
+    frames = pipeline.frames()
+    assert len([next(frames) for _ in range(5)]) == 5
+    frames.close()
+    assert_stopped(pipeline)
+    assert pipeline.error is None
+
+
+def test_inference_error_stops_the_pipeline(executor):
+    executor.error_after = 6
+    pipeline = make_pipeline(FakeCapture(total=None))
+    jpegs = list(pipeline.frames())
+    assert len(jpegs) <= 6
+    assert isinstance(pipeline.error, RuntimeError)
+    assert_stopped(pipeline)
+
+
+def test_decode_error_stops_the_pipeline(executor):
+    pipeline = make_pipeline(FakeCapture(total=None, fail_at=4))
+    jpegs = list(pipeline.frames())
+    assert len(jpegs) <= 4
+    assert isinstance(pipeline.error, IOError)
+    assert_stopped(pipeline)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# 推理进程池调度测试：不启动子进程，直接向结果队列投递消息，校验分发、结果收集和忙碌时间统计
+import queue
+import threading
+
+import numpy as np
+import pytest
+
+from predict.workerPool import InferenceWorkerPool
+
+
+@pytest.fixture
+def pool():
+    pool = InferenceWorkerPool(workers=2, threads_per_worker=1, affinity_slack=1)
+    for handle in pool._handles:
+        handle.request_q = queue.Queue()  # 代替子进程的请求队列
+    collector = threading.Thread(target=pool._collect, daemon=True)
+    collector.start()
+    yield pool
+    pool._closed = True
+    collector.join(timeout=5)
+
+
+def take_job(pool, index):
+    job_id, weights_path, images, kwargs = pool._handles[index].request_q.get(timeout=5)
+    return job_id
+
+
+def test_results_complete_futures_and_track_busy_time(pool):
+    future = pool.submit('a.pt', [np.zeros((4, 4, 3), dtype=np.uint8)], conf=0.5)
+    job_id = take_job(pool, 0)
+    boxes = [np.zeros((0, 6), dtype=np.float32)]
+    pool._result_q.put(('ok', 0, job_id, (boxes, {0: 'leaf'}, 0.25)))
+    assert future.result(timeout=5)[0].shape == (0, 6)
+    stats = pool.stats()[0]
+    assert stats['completed'] == 1
+    assert stats['queued'] == 0
+    assert stats['busySeconds'] == 0.25
+    assert pool.names('a.pt') == {0: 'leaf'}
+
+
+def test_worker_error_fails_the_future(pool):
+    future = pool.submit('a.pt', [np.zeros((4, 4, 3), dtype=np.uint8)])
+    job_id = take_job(pool, 0)
+    pool._result_q.put(('error', 0, job_id, 'RuntimeError: boom'))
+    with pytest.raises(RuntimeError, match='boom'):
+        future.result(timeout=5)
+    assert pool.stats()[0]['busySeconds'] == 0.0
+
+
+def test_affinity_until_queue_exceeds_slack(pool):
+    image = [np.zeros((4, 4, 3), dtype=np.uint8)]
+    pool.submit('a.pt', image)
+    pool.submit('a.pt', image)  # 1 号进程空闲但差距未超过 affinity_slack，仍交给已分配过 a.pt 的 0 号
+    pool.submit('a.pt', image)  # 0 号比 1 号多排 2 个，改派给最空闲的 1 号
+    assert [len(h.outstanding) for h in pool._handles] == [2, 1]
+    assert pool.queue_depth() == {('0',): 2, ('1',): 1}
@@ -2,6 +2,7 @@
 # @Time : 2024-12-2024/12/22 11:25
 # @Author : 林枫
 # @File : train.py
+# 单个数据集的训练示例；按配置训练全部作物并更新 weights 目录见 train_all.py
 
 from ultralytics import YOLO
 import warnings
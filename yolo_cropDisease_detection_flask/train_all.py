@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+# 多作物训练：按 train_config.json 依次训练各作物的数据集（不再逐个修改 train.py 手动训练）。
+# 每个数据集只预处理一次：图片按训练尺寸等比缩小后写入 dataset/cache/<作物>_<imgsz>/，训练时以
+# cache='disk' 把解码后的数组另存为 .npy，之后的训练直接复用；训练过程中按轮记录吞吐（张/秒）、
+# 数据加载等待时间和峰值内存，完成后把 best.pt 复制为 weights/<作物>_best.pt 并更新权重清单。
+# 最后训练作物分类模型（配置中的 router 段）：各作物数据集的图片按作物分目录，训练 YOLO 分类模型并安装为
+# weights/router/crop_cls.pt，供作物自动路由使用（没有分类模型时路由只能让每个检测模型各推理一次再投票）
+#
+# 用法（在 flask 项目根目录执行）：
+#   python train_all.py
+#   python train_all.py --only corn rice --epochs 50
+#   python train_all.py --device cpu --batch 8        # 没有 GPU 的机器
+#   python train_all.py --only router                 # 只训练作物分类模型
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from predict.cropRouter import CLASSIFIER_PATH
+from predict.weightsManifest import weights_manifest
+
+warnings.filterwarnings('ignore')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+SPLITS = ('train', 'val', 'test')
+CACHE_INFO = 'cache_info.json'
+ROUTER = 'router'  # 作物分类模型在 --only 中的名称
+
+
+def load_config(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def resolve_device(device=None):
+    """未指定设备时有 GPU 用第一块 GPU，否则使用 CPU"""
+    if device not in (None, ''):
+        return str(device)
+    import torch
+
+    return '0' if torch.cuda.is_available() else 'cpu'
+
+
+def training_args(defaults, overrides, device):
+    """
+    合并默认参数与数据集参数；CPU 训练时关闭 AMP（CPU 不支持半精度），
+    自动批大小（batch=-1）依赖显存估算，CPU 上改为固定 16
+    """
+    args = dict(defaults, **overrides)
+    args.pop('data', None)
+    args['device'] = device
+    if device == 'cpu':
+        args['amp'] = False
+        if args.get('batch', -1) in (-1, None):
+            args['batch'] = 16
+        args['workers'] = min(args.get('workers', 8), os.cpu_count() or 1)
+    return args
+
+
+class DatasetCache:
+    """数据集的预处理缓存：图片等比缩小到训练尺寸（小图直接复制），标签原样复制（YOLO 标签为归一化坐标）"""
+
+    def __init__(self, data_yaml, cache_root, name, imgsz=640):
+        """
+        :param data_yaml: 原数据集的 data.yaml
+        :param cache_root: 缓存根目录，缓存写入 <cache_root>/<name>_<imgsz>/
+        :param name: 数据集名称（作物）
+        :param imgsz: 训练尺寸，图片最长边缩小到该尺寸
+        """
+        self.data_yaml = os.path.abspath(data_yaml)
+        self.imgsz = imgsz
+        self.cache_dir = os.path.abspath(os.path.join(cache_root, f'{name}_{imgsz}'))
+        self.info_path = os.path.join(self.cache_dir, CACHE_INFO)
+
+    def build(self, rebuild=False, workers=8):
+        """
+        生成（或复用）缓存，返回缓存数据集的 data.yaml 路径；
+        原数据集的图片、标签有增删改（文件列表、大小、修改时间变化）时自动重建
+        """
+        import yaml
+
+        with open(self.data_yaml, 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f)
+        base = data.get('path') or os.path.dirname(self.data_yaml)
+        if not os.path.isabs(base):
+            base = os.path.join(os.path.dirname(self.data_yaml), base)
+        splits = {split: self._split_images(data[split], base) for split in SPLITS if data.get(split)}
+        fingerprint = self._fingerprint(splits)
+
+        info = self._read_info()
+        cache_yaml = os.path.join(self.cache_dir, 'data.yaml')
+        if not rebuild and info.get('fingerprint') == fingerprint and os.path.exists(cache_yaml):
+            print(f"复用预处理缓存: {self.cache_dir}（{info.get('images')} 张）")
+            return cache_yaml
+
+        start = time.time()
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)  # 同时删除旧的 .npy，避免与新图片不一致
+        counts, skipped = {}, 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cache') as pool:
+            for split, images in splits.items():
+                root = os.path.commonpath([os.path.dirname(p) for p in images]) if images else base
+                jobs = [(src, os.path.join(self.cache_dir, 'images', split, os.path.relpath(src, root)),
+                         os.path.join(self.cache_dir, 'labels', split, os.path.relpath(src, root)))
+                        for src in images]
+                results = list(pool.map(lambda job: self._process(*job), jobs))
+                counts[split] = sum(results)
+                skipped += len(results) - counts[split]
+
+        cache_data = {'path': self.cache_dir, 'names': data['names']}
+        if 'nc' in data:
+            cache_data['nc'] = data['nc']
+        for split in splits:
+            cache_data[split] = f'images/{split}'
+        with open(cache_yaml, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(cache_data, f, allow_unicode=True, sort_keys=False)
+        with open(self.info_path, 'w', encoding='utf-8') as f:
+            json.dump({'source': self.data_yaml, 'imgsz': self.imgsz, 'fingerprint': fingerprint,
+                       'images': sum(counts.values()), 'splits': counts, 'skipped': skipped,
+                       'builtAt': time.strftime('%Y-%m-%d %H:%M:%S'), 'seconds': round(time.time() - start, 2)},
+                      f, ensure_ascii=False, indent=2)
+        print(f"预处理缓存已生成: {self.cache_dir}，{counts}，跳过 {skipped} 张无法读取的图片，"
+              f"用时 {time.time() - start:.1f}s")
+        return cache_yaml
+
+    def _process(self, src, dst_image, dst_label):
+        """缩小一张图片并复制其标签；图片无法解码时返回 False"""
+        os.makedirs(os.path.dirname(dst_image), exist_ok=True)
+        image = cv2.imdecode(np.fromfile(src, dtype=np.uint8), cv2.IMREAD_COLOR)  # 兼容中文路径
+        if image is None:
+            return False
+        height, width = image.shape[:2]
+        ratio = self.imgsz / max(height, width)
+        if ratio < 1:
+            image = cv2.resize(image, (round(width * ratio), round(height * ratio)), interpolation=cv2.INTER_AREA)
+            dst_image = os.path.splitext(dst_image)[0] + '.jpg'
+            cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tofile(dst_image)
+        else:
+            shutil.copy2(src, dst_image)
+        label = self._label_path(src)
+        if os.path.exists(label):
+            dst_label = os.path.splitext(dst_label)[0] + '.txt'
+            os.makedirs(os.path.dirname(dst_label), exist_ok=True)
+            shutil.copy2(label, dst_label)
+        return True
+
+    @staticmethod
+    def _split_images(value, base):
+        """data.yaml 中的 train/val/test：目录、图片列表 .txt，或二者组成的列表"""
+        images = []
+        for entry in value if isinstance(value, list) else [value]:
+            path = entry if os.path.isabs(entry) else os.path.join(base, entry)
+            if os.path.isdir(path):
+                images.extend(os.path.join(root, f) for root, _, files in os.walk(path)
+                              for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+            elif os.path.isfile(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            images.append(line if os.path.isabs(line) else os.path.join(os.path.dirname(path), line))
+            else:
+                raise FileNotFoundError(f"数据集路径不存在: {path}")
+        return sorted(os.path.normpath(p) for p in images)
+
+    @staticmethod
+    def _label_path(image_path):
+        """与 ultralytics 一致：.../images/xxx.jpg -> .../labels/xxx.txt；没有 images 目录层级时标签与图片同目录"""
+        sa, sb = f'{os.sep}images{os.sep}', f'{os.sep}labels{os.sep}'
+        path = sb.join(image_path.rsplit(sa, 1)) if sa in image_path else image_path
+        return os.path.splitext(path)[0] + '.txt'
+
+    def _fingerprint(self, splits):
+        digest = hashlib.sha1(str(self.imgsz).encode())
+        for split, images in splits.items():
+            for path in images:
+                for file in (path, self._label_path(path)):
+                    try:
+                        stat = os.stat(file)
+                        digest.update(f'{split}|{file}|{stat.st_size}|{stat.st_mtime}'.encode('utf-8'))
+                    except OSError:
+                        digest.update(f'{split}|{file}|-'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _read_info(self):
+        try:
+            with open(self.info_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+def peak_memory_mb(device_type):
+    """本轮的峰值内存（MB）：GPU 训练为显存峰值，CPU 训练为训练主进程的常驻内存峰值"""
+    if device_type == 'cuda':
+        import torch
+
+        return torch.cuda.max_memory_allocated() / 1024 / 1024
+    try:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux 下单位为 KB
+    except ImportError:
+        pass
+    try:
+        import psutil
+
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) / 1024 / 1024  # Windows 提供 peak_wset
+    except ImportError:
+        return None
+
+
+class ThroughputLogger:
+    """训练回调：按轮统计训练吞吐、数据加载等待时间和峰值内存，输出到控制台并追加到 throughput.jsonl"""
+
+    def __init__(self, name, log_path):
+        self.name = name
+        self.log_path = log_path
+        self.epochs = []
+        self._epoch_start = self._last_batch_end = 0.0
+        self._stall = 0.0
+        self._batches = 0
+
+    def attach(self, model):
+        model.add_callback('on_train_epoch_start', self.on_epoch_start)
+        model.add_callback('on_train_batch_start', self.on_batch_start)
+        model.add_callback('on_train_batch_end', self.on_batch_end)
+        model.add_callback('on_train_epoch_end', self.on_epoch_end)
+        return self
+
+    def on_epoch_start(self, trainer):
+        self._epoch_start = self._last_batch_end = time.perf_counter()
+        self._stall = 0.0
+        self._batches = 0
+        if trainer.device.type == 'cuda':
+            import torch
+
+            torch.cuda.reset_peak_memory_stats()
+
+    def on_batch_start(self, trainer):
+        # 上一批结束到这一批开始之间，训练循环只在等待 DataLoader 取下一批数据
+        self._stall += time.perf_counter() - self._last_batch_end
+        self._batches += 1
+
+    def on_batch_end(self, trainer):
+        self._last_batch_end = time.perf_counter()
+
+    def on_epoch_end(self, trainer):
+        seconds = time.perf_counter() - self._epoch_start
+        images = len(trainer.train_loader.dataset)
+        peak = peak_memory_mb(trainer.device.type)
+        entry = {
+            'dataset': self.name,
+            'epoch': trainer.epoch + 1,
+            'images': images,
+            'batchSize': trainer.batch_size,
+            'batches': self._batches,
+            'trainSeconds': round(seconds, 2),
+            'imagesPerSec': round(images / seconds, 2) if seconds else 0.0,
+            'stallSeconds': round(self._stall, 2),
+            'stallRatio': round(self._stall / seconds, 3) if seconds else 0.0,
+            'peakMemMB': round(peak, 1) if peak is not None else None,
+            'device': trainer.device.type
+        }
+        self.epochs.append(entry)
+        print(f"[{self.name}] 第 {entry['epoch']} 轮：{entry['imagesPerSec']} 张/秒，"
+              f"数据加载等待 {entry['stallSeconds']}s（{entry['stallRatio']:.1%}），峰值内存 {entry['peakMemMB']} MB")
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def summary(self):
+        if not self.epochs:
+            return {}
+        return {
+            'epochs': len(self.epochs),
+            'imagesPerSec': round(sum(e['imagesPerSec'] for e in self.epochs) / len(self.epochs), 2),
+            'stallSeconds': round(sum(e['stallSeconds'] for e in self.epochs), 2),
+            'peakMemMB': max((e['peakMemMB'] or 0) for e in self.epochs)
+        }
+
+
+def install_weights(best_path, weights_root, name):
+    """把训练得到的 best.pt 复制为 <weights_root>/<作物>_best.pt（先写临时文件再替换，服务读取时不会读到半个文件）"""
+    os.makedirs(weights_root, exist_ok=True)
+    target = os.path.join(weights_root, f'{name}_best.pt')
+    tmp = target + '.tmp'
+    shutil.copy2(best_path, tmp)
+    os.replace(tmp, target)
+    return target
+
+
+def train_dataset(name, spec, config, args):
+    """预处理（或复用缓存）并训练一个数据集，返回训练摘要"""
+    from ultralytics import YOLO
+
+    device = resolve_device(args.device or spec.get('device') or config['defaults'].get('device'))
+    overrides = {k: v for k, v in (('epochs', args.epochs), ('batch', args.batch), ('imgsz', args.imgsz),
+                                   ('workers', args.workers)) if v is not None}
+    train_kwargs = training_args(config['defaults'], dict(spec, **overrides), device)
+
+    cache = DatasetCache(spec['data'], config.get('cache_root', './dataset/cache'), name, train_kwargs['imgsz'])
+    data = cache.build(rebuild=args.rebuild_cache, workers=args.cache_workers)
+
+    project = os.path.abspath(config.get('project', './runs/train'))
+    os.makedirs(project, exist_ok=True)
+    logger = ThroughputLogger(name, os.path.join(project, 'throughput.jsonl'))
+
+    model = YOLO(config.get('model', 'yolo11n.yaml'), task='detect')
+    if config.get('pretrained'):
+        model = model.load(config['pretrained'])  # build from YAML and transfer weights
+    logger.attach(model)
+
+    start = time.time()
+    print(f"开始训练 {name}: {train_kwargs}")
+    model.train(data=data, cache='disk', project=project, name=name, exist_ok=True, **train_kwargs)
+    best = str(model.trainer.best)
+    summary = {'dataset': name, 'status': 'done', 'device': device, 'best': best,
+               'minutes': round((time.time() - start) / 60, 1), **logger.summary()}
+    if not args.no_install and os.path.exists(best):
+        summary['installed'] = install_weights(best, config.get('weights_root', './weights'), name)
+        print(f"已更新权重: {summary['installed']}")
+    return summary
+
+
+def build_router_dataset(config, imgsz, rebuild=False, workers=8, max_per_class=2000, val_ratio=0.1):
+    """
+    由各作物的检测数据集生成分类数据集 <cache_root>/router/{train,val}/<作物>/（类别名即作物名，
+    与权重文件名前缀一致）；图片取自检测训练的预处理缓存（硬链接，不能链接时复制），每个作物最多 max_per_class 张，
+    原数据集没有 val 时按 val_ratio 从 train 中划分
+    """
+    cache_root = config.get('cache_root', './dataset/cache')
+    router_dir = os.path.abspath(os.path.join(cache_root, ROUTER))
+    if os.path.isdir(router_dir):
+        shutil.rmtree(router_dir)
+    counts = {}
+    for name, spec in config['datasets'].items():
+        cache = DatasetCache(spec['data'], cache_root, name, imgsz)
+        cache.build(rebuild=rebuild, workers=workers)
+        images = {split: DatasetCache._split_images(os.path.join(cache.cache_dir, 'images', split), cache.cache_dir)
+                  for split in ('train', 'val')
+                  if os.path.isdir(os.path.join(cache.cache_dir, 'images', split))}
+        train = images.get('train', [])
+        val = images.get('val')
+        if not val:
+            val = train[::max(2, round(1 / val_ratio))]
+            held_out = set(val)
+            train = [path for path in train if path not in held_out]
+        for split, paths in (('train', train), ('val', val)):
+            limit = max_per_class if split == 'train' else max(1, int(max_per_class * val_ratio))
+            step = max(1, len(paths) // limit)
+            target_dir = os.path.join(router_dir, split, name)
+            os.makedirs(target_dir, exist_ok=True)
+            for i, src in enumerate(paths[::step][:limit]):
+                dst = os.path.join(target_dir, f'{i:06d}{os.path.splitext(src)[1]}')
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+            counts.setdefault(split, {})[name] = len(os.listdir(target_dir))
+    print(f"作物分类数据集已生成: {router_dir}，{counts}")
+    return router_dir
+
+
+def train_router(config, args):
+    """训练作物分类模型，安装为 <weights_root>/router/crop_cls.pt，返回训练摘要"""
+    from ultralytics import YOLO
+
+    spec = config.get(ROUTER, {})
+    device = resolve_device(args.device or spec.get('device') or config['defaults'].get('device'))
+    overrides = {k: v for k, v in (('epochs', args.epochs), ('batch', args.batch), ('workers', args.workers))
+                 if v is not None}
+    train_kwargs = training_args(config['defaults'], dict(spec, **overrides), device)
+    for key in ('model', 'max_per_class', 'source_imgsz'):
+        train_kwargs.pop(key, None)
+    train_kwargs.setdefault('imgsz', 224)
+
+    # 复用检测训练的预处理缓存（同一训练尺寸），不再单独解码原图
+    data = build_router_dataset(config, spec.get('source_imgsz', config['defaults'].get('imgsz', 640)),
+                                rebuild=args.rebuild_cache, workers=args.cache_workers,
+                                max_per_class=spec.get('max_per_class', 2000))
+
+    project = os.path.abspath(config.get('project', './runs/train'))
+    os.makedirs(project, exist_ok=True)
+    logger = ThroughputLogger(ROUTER, os.path.join(project, 'throughput.jsonl'))
+    model = YOLO(spec.get('model', 'yolo11n-cls.pt'), task='classify')
+    logger.attach(model)
+
+    start = time.time()
+    print(f"开始训练作物分类模型: {train_kwargs}")
+    model.train(data=data, project=project, name=ROUTER, exist_ok=True, **train_kwargs)
+    best = str(model.trainer.best)
+    summary = {'dataset': ROUTER, 'status': 'done', 'device': device, 'best': best,
+               'minutes': round((time.time() - start) / 60, 1), **logger.summary()}
+    if not args.no_install and os.path.exists(best):
+        weights_root = config.get('weights_root', './weights')
+        target = os.path.join(weights_root, CLASSIFIER_PATH)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(best, target + '.tmp')
+        os.replace(target + '.tmp', target)
+        summary['installedRouter'] = target  # 不是检测权重，不写入权重清单；路由按修改时间自动重新加载
+        print(f"已更新作物分类模型: {target}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按配置依次训练各作物的病害检测模型')
+    parser.add_argument('--config', default='./train_config.json')
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='只训练指定的数据集，如 --only corn rice；router 为作物分类模型')
+    parser.add_argument('--epochs', type=int, default=None)
+    parser.add_argument('--batch', type=int, default=None)
+    parser.add_argument('--imgsz', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None, help='DataLoader 进程数')
+    parser.add_argument('--device', default=None, help="如 'cpu'、'0'，默认有 GPU 时使用 GPU")
+    parser.add_argument('--rebuild-cache', action='store_true', help='忽略已有的预处理缓存，重新生成')
+    parser.add_argument('--cache-workers', type=int, default=8, help='预处理图片的线程数')
+    parser.add_argument('--no-install', action='store_true', help='不把 best.pt 复制到权重目录')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    datasets = config['datasets']
+    choices = list(datasets) + ([ROUTER] if ROUTER in config else [])
+    names = args.only or choices
+    unknown = [name for name in names if name not in choices]
+    if unknown:
+        parser.error(f"配置中没有数据集: {unknown}，可选 {choices}")
+    if ROUTER in names:
+        names = [name for name in names if name != ROUTER] + [ROUTER]  # 分类模型最后训练，复用检测训练生成的缓存
+
+    summaries = []
+    for name in names:
+        try:
+            if name == ROUTER:
+                summaries.append(train_router(config, args))
+            else:
+                summaries.append(train_dataset(name, datasets[name], config, args))
+        except Exception as e:
+            # 一个数据集失败（路径错误、显存不足等）不影响其余数据集
+            print(f"训练 {name} 失败: {e}")
+            summaries.append({'dataset': name, 'status': 'failed', 'error': str(e)})
+
+    if any('installed' in s for s in summaries):
+        # 只有新训练的权重会重新索引，其余条目沿用已有清单
+        weights_manifest.load(config.get('weights_root', './weights')).refresh()
+
+    project = config.get('project', './runs/train')
+    os.makedirs(project, exist_ok=True)
+    with open(os.path.join(project, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump({'finishedAt': time.strftime('%Y-%m-%d %H:%M:%S'), 'datasets': summaries}, f,
+                  ensure_ascii=False, indent=2)
+    for summary in summaries:
+        print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,11 @@ import com.baomidou.mybatisplus.extension.plugins.pagination.Page;
 import com.example.Kcsj.common.Result;
 import com.example.Kcsj.entity.CameraRecords;
 import com.example.Kcsj.mapper.CameraRecordsMapper;
+import org.springframework.transaction.annotation.Transactional;
 import org.springframework.web.bind.annotation.*;
 
 import javax.annotation.Resource;
+import java.util.List;
 
 @RestController
 @RequestMapping("/cameraRecords")
@@ -70,4 +72,14 @@ public class CameraRecordsController {
         cameraRecordsMapper.insert(cameraRecords);
         return Result.success();
     }
+
+    // Flask 发件箱把排队中的记录合并为一批提交，在一个事务中插入，减少逐条请求的开销
+    @PostMapping("/batch")
+    @Transactional(rollbackFor = Exception.class)
+    public Result<?> saveBatch(@RequestBody List<CameraRecords> records) {
+        for (CameraRecords record : records) {
+            cameraRecordsMapper.insert(record);
+        }
+        return Result.success();
+    }
 }
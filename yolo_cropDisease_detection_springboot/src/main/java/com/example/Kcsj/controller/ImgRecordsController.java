@@ -7,9 +7,11 @@ import com.baomidou.mybatisplus.extension.plugins.pagination.Page;
 import com.example.Kcsj.common.Result;
 import com.example.Kcsj.entity.ImgRecords;
 import com.example.Kcsj.mapper.ImgRecordsMapper;
+import org.springframework.transaction.annotation.Transactional;
 import org.springframework.web.bind.annotation.*;
 
 import javax.annotation.Resource;
+import java.util.List;
 
 @RestController
 @RequestMapping("/imgRecords")
@@ -71,4 +73,14 @@ public class ImgRecordsController {
         imgRecordsMapper.insert(imgrecords);
         return Result.success();
     }
+
+    // Flask 发件箱把排队中的记录合并为一批提交，在一个事务中插入，减少逐条请求的开销
+    @PostMapping("/batch")
+    @Transactional(rollbackFor = Exception.class)
+    public Result<?> saveBatch(@RequestBody List<ImgRecords> records) {
+        for (ImgRecords record : records) {
+            imgRecordsMapper.insert(record);
+        }
+        return Result.success();
+    }
 }
@@ -101,6 +101,9 @@ public class PredictionController {
             
             if(responses.get("status").equals(400)){
                 return Result.error("-1", "Error: " + responses.get("message"));
+            } else if (Boolean.TRUE.equals(responses.getBoolean("recordQueued"))) {
+                // Flask 异步上传结果图：识别记录在上传成功后由 Flask 保存到 /imgRecords，这里不再重复插入
+                return Result.success(response);
             } else {
                 ImgRecords imgRecords = new ImgRecords();
                 imgRecords.setWeight(request.getWeight());
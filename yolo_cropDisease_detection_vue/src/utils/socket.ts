@@ -11,6 +11,10 @@ export class SocketService {
     this.socket.on(event, (data) => callback(data.data));
   }
  
+  get id() {
+    return this.socket.id;
+  }
+
   emit(event: string, data: any) {
     this.socket.emit(event, data);
   }